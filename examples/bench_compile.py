@@ -0,0 +1,82 @@
+"""\
+    This benchmark measures how fast templates are compiled into Python
+    code, which runs the optimizer and the visitors of the code generator.
+    Pass folders with templates, for example a theme, to compile them
+    instead of the built-in template:
+
+        $ python examples/bench_compile.py path/to/theme -x liquid\
+"""
+import os
+import sys
+from argparse import ArgumentParser
+from timeit import Timer
+from jinja2 import Environment
+from jinja2.exceptions import TemplateSyntaxError
+
+source = """\
+<!doctype html>
+<html>
+  <head>
+    <title>{{ page_title | escape }}</title>
+    {% include 'head' %}
+  </head>
+  <body>
+    {% section 'header' %}
+    <ul class="products">
+    {% for product in collection.products %}
+      <li class="{{ loop.cycle('odd', 'even') }}">
+        <a href="{{ product.url }}">{{ product.title | truncate(40) }}</a>
+        {% if product.price > 1000 and product.available %}
+          <span>{{ product.price | round(2) }}</span>
+        {% elsif 'sale' in product.tags %}
+          <span>{{ product.compare_at_price - 0.5 }}</span>
+        {% endif %}
+        {% set images = product.images | map(attribute='src') | join(', ') %}
+      </li>
+    {% endfor %}
+    </ul>
+  </body>
+</html>
+"""
+
+
+def find_templates(folders, extensions):
+    for folder in folders:
+        for dirpath, dirnames, filenames in os.walk(folder):
+            for filename in filenames:
+                if extensions and \
+                   os.path.splitext(filename)[1][1:] not in extensions:
+                    continue
+                with open(os.path.join(dirpath, filename), 'rb') as f:
+                    yield f.read().decode('utf-8')
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('folders', nargs='*')
+    parser.add_argument('-x', '--extension', action='append',
+                        dest='extensions')
+    parser.add_argument('-n', '--number', type=int, default=5)
+    args = parser.parse_args()
+
+    env = Environment()
+    trees = []
+    for x in list(find_templates(args.folders, args.extensions)) or \
+            [source] * 50:
+        try:
+            trees.append(env.parse(x))
+        except TemplateSyntaxError:
+            pass
+
+    def run():
+        for tree in trees:
+            env.compile(tree, raw=True)
+
+    seconds = min(Timer(run).repeat(5, args.number)) / args.number
+    sys.stdout.write('%d templates: %.2f ms per run, %.2f ms per '
+                     'template\n' % (len(trees), seconds * 1000,
+                                      seconds * 1000 / len(trees)))
+
+
+if __name__ == '__main__':
+    main()
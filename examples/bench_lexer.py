@@ -0,0 +1,81 @@
+"""\
+    This benchmark measures how fast the lexer tokenizes templates.  Pass
+    folders with templates, for example a theme, to tokenize them instead
+    of the built-in template:
+
+        $ python examples/bench_lexer.py path/to/theme -x liquid\
+"""
+import os
+import sys
+from argparse import ArgumentParser
+from timeit import Timer
+from jinja2 import Environment
+
+source = """\
+<!doctype html>
+<html>
+  <head>
+    <title>{{ page_title | escape }}</title>
+    {% include 'head' %}
+  </head>
+  <body>
+    {% section 'header' %}
+    {# the products of the collection #}
+    <ul class="products">
+    {% for product in collection.products limit: 12 %}
+      <li class="{% cycle 'odd', 'even' %}">
+        <a href="{{ product.url | within: collection }}">
+          {{ product.title | truncate: 40, '...' }}
+        </a>
+        {% if product.price > 1000 and product.available %}
+          <span>{{ product.price | money_with_currency }}</span>
+        {% elsif product.tags contains "sale" %}
+          <span>{{ product.compare_at_price | minus: 0.5 | money }}</span>
+        {% endif %}
+        {% assign images = product.images | map: 'src' | join: ', ' %}
+      </li>
+    {% endfor %}
+    </ul>
+    {% raw %}{{ not parsed }}{% endraw %}
+  </body>
+</html>
+"""
+
+
+def find_templates(folders, extensions):
+    for folder in folders:
+        for dirpath, dirnames, filenames in os.walk(folder):
+            for filename in filenames:
+                if extensions and \
+                   os.path.splitext(filename)[1][1:] not in extensions:
+                    continue
+                with open(os.path.join(dirpath, filename), 'rb') as f:
+                    yield f.read().decode('utf-8')
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('folders', nargs='*')
+    parser.add_argument('-x', '--extension', action='append',
+                        dest='extensions')
+    parser.add_argument('-n', '--number', type=int, default=20)
+    args = parser.parse_args()
+
+    sources = list(find_templates(args.folders, args.extensions)) or \
+        [source] * 50
+    lexer = Environment().lexer
+    tokens = sum(1 for x in sources for token in lexer.tokeniter(x, None))
+
+    def run():
+        for x in sources:
+            for token in lexer.tokeniter(x, None):
+                pass
+
+    seconds = min(Timer(run).repeat(5, args.number)) / args.number
+    sys.stdout.write('%d templates, %d tokens: %.2f ms per run, '
+                     '%.0f tokens/s\n' % (len(sources), tokens,
+                                          seconds * 1000, tokens / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""\
+    This benchmark measures the memory the parsed syntax trees of templates
+    take.  Pass folders with templates, for example a theme, to parse them
+    instead of the built-in template:
+
+        $ python examples/bench_nodes.py path/to/theme -x liquid
+
+    Requires Python 3.4 or later for `tracemalloc`.\
+"""
+import gc
+import os
+import sys
+import tracemalloc
+from argparse import ArgumentParser
+from jinja2 import Environment, nodes
+
+source = """\
+<!doctype html>
+<html>
+  <head>
+    <title>{{ page_title | escape }}</title>
+    {% include 'head' %}
+  </head>
+  <body>
+    {% section 'header' %}
+    <ul class="products">
+    {% for product in collection.products %}
+      <li class="{{ loop.cycle('odd', 'even') }}">
+        <a href="{{ product.url }}">{{ product.title | truncate(40) }}</a>
+        {% if product.price > 1000 and product.available %}
+          <span>{{ product.price | round(2) }}</span>
+        {% elsif 'sale' in product.tags %}
+          <span>{{ product.compare_at_price - 0.5 }}</span>
+        {% endif %}
+        {% set images = product.images | map(attribute='src') | join(', ') %}
+      </li>
+    {% endfor %}
+    </ul>
+  </body>
+</html>
+"""
+
+
+def find_templates(folders, extensions):
+    for folder in folders:
+        for dirpath, dirnames, filenames in os.walk(folder):
+            for filename in filenames:
+                if extensions and \
+                   os.path.splitext(filename)[1][1:] not in extensions:
+                    continue
+                with open(os.path.join(dirpath, filename), 'rb') as f:
+                    yield f.read().decode('utf-8')
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('folders', nargs='*')
+    parser.add_argument('-x', '--extension', action='append',
+                        dest='extensions')
+    args = parser.parse_args()
+
+    sources = list(find_templates(args.folders, args.extensions)) or \
+        [source] * 1000
+    env = Environment()
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    trees = []
+    for x in sources:
+        try:
+            trees.append(env.parse(x))
+        except Exception:
+            pass
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    count = sum(1 for tree in trees for node in tree.find_all(nodes.Node))
+    sys.stdout.write('%d templates, %d nodes: %.2f MB, %.0f bytes per '
+                     'node\n' % (len(trees), count, size / 1024.0 / 1024.0,
+                                 size / float(count)))
+
+
+if __name__ == '__main__':
+    main()
@@ -39,7 +39,8 @@ from jinja2.loaders import BaseLoader, FileSystemLoader, PackageLoader, \
 
 # bytecode caches
 from jinja2.bccache import BytecodeCache, FileSystemBytecodeCache, \
-     MemcachedBytecodeCache
+     MemcachedBytecodeCache, ContentAddressedBytecodeCache, \
+     PackFileBytecodeCache, MemoryBytecodeCache, TieredBytecodeCache
 
 # undefined types
 from jinja2.runtime import Undefined, DebugUndefined, StrictUndefined, \
@@ -61,10 +62,24 @@ __all__ = [
     'Environment', 'Template', 'BaseLoader', 'FileSystemLoader',
     'PackageLoader', 'DictLoader', 'FunctionLoader', 'PrefixLoader',
     'ChoiceLoader', 'BytecodeCache', 'FileSystemBytecodeCache',
-    'MemcachedBytecodeCache', 'Undefined', 'DebugUndefined',
-    'StrictUndefined', 'TemplateError', 'UndefinedError', 'TemplateNotFound',
-    'TemplatesNotFound', 'TemplateSyntaxError', 'TemplateAssertionError',
+    'MemcachedBytecodeCache', 'ContentAddressedBytecodeCache',
+    'PackFileBytecodeCache', 'MemoryBytecodeCache', 'TieredBytecodeCache',
+    'Undefined', 'DebugUndefined',
+    'StrictUndefined', 'TemplateError', 'UndefinedError',
+    'TemplateNotFound', 'TemplatesNotFound', 'TemplateSyntaxError',
+    'TemplateAssertionError',
     'ModuleLoader', 'environmentfilter', 'contextfilter', 'Markup', 'escape',
     'environmentfunction', 'contextfunction', 'clear_caches', 'is_undefined',
     'evalcontextfilter', 'evalcontextfunction', 'make_logging_undefined',
 ]
+
+
+def _patch_async():
+    from jinja2.utils import have_async_gen
+    if have_async_gen:
+        from jinja2.asyncsupport import patch_all
+        patch_all()
+
+
+_patch_async()
+del _patch_async
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+    jinja2.asyncsupport
+    ~~~~~~~~~~~~~~~~~~~
+
+    Has all the code for async support which is implemented as a patch
+    for supported Python versions.  The module is only imported if the
+    interpreter supports async generators.
+
+    :copyright: (c) 2010 by the Jinja Team.
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import asyncio
+import inspect
+from functools import update_wrapper
+
+from jinja2.environment import TemplateModule, TemplateExpression
+from jinja2.runtime import BlockReference, Undefined
+from jinja2.utils import concat, internalcode, Markup
+
+
+async def auto_await(value):
+    """Await the value if it's awaitable, otherwise return it unchanged."""
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+async def auto_to_seq(value):
+    """Turn an async iterable into a list so that the loop code can iterate
+    over it.  Other iterables are returned unchanged.
+    """
+    if hasattr(value, '__aiter__'):
+        return [x async for x in value]
+    return value
+
+
+async def collect_events(rv):
+    """Return the events of a render function as list.  Render functions are
+    async generators or, in buffered render mode, coroutines that return the
+    list of events.
+    """
+    if hasattr(rv, '__aiter__'):
+        return [x async for x in rv]
+    return await rv
+
+
+async def concat_async(rv):
+    """Like `concat` for the result of a render function."""
+    return concat(await collect_events(rv))
+
+
+class AsyncTemplateStream(object):
+    """Works like :class:`~jinja2.environment.TemplateStream` for the async
+    generator of :meth:`Template.generate_async`.  The stream is iterated
+    with ``async for``.
+
+    .. versionadded:: 2.9
+    """
+
+    def __init__(self, gen):
+        self._gen = gen
+        self.disable_buffering()
+
+    async def dump(self, fp, encoding=None, errors='strict'):
+        """Write the complete stream into a file-like object.  Per default
+        unicode strings are written, if you want to encode before writing
+        specify an `encoding`.
+        """
+        async for item in self:
+            if encoding is not None:
+                item = item.encode(encoding, errors)
+            fp.write(item)
+
+    def disable_buffering(self):
+        """Disable the output buffering."""
+        self._iter = self._gen
+        self.buffered = False
+
+    async def _buffered_generator(self, size):
+        buf = []
+        c_size = 0
+        async for c in self._gen:
+            buf.append(c)
+            if c:
+                c_size += 1
+            if c_size >= size:
+                yield concat(buf)
+                del buf[:]
+                c_size = 0
+        if c_size:
+            yield concat(buf)
+
+    def enable_buffering(self, size=5):
+        """Enable buffering.  Buffer `size` items before yielding them."""
+        if size <= 1:
+            raise ValueError('buffer size too small')
+        self.buffered = True
+        self._iter = self._buffered_generator(size)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self._iter.__anext__()
+
+
+def get_event_loop():
+    """Return the event loop that runs the coroutines of the synchronous
+    render methods.
+    """
+    return asyncio.get_event_loop()
+
+
+def async_only(f):
+    def decorator(self, *args, **kwargs):
+        if not self.environment.is_async:
+            raise RuntimeError('The environment was not created with async '
+                               'mode enabled.')
+        return f(self, *args, **kwargs)
+    return update_wrapper(decorator, f)
+
+
+async def generate_async(self, *args, **kwargs):
+    vars = dict(*args, **kwargs)
+    try:
+        rv = self.root_render_func(self.new_context(vars))
+        if hasattr(rv, '__aiter__'):
+            async for event in rv:
+                yield event
+        else:
+            for event in await rv:
+                yield event
+    except Exception:
+        exc_info = sys.exc_info()
+    else:
+        return
+    yield self.environment.handle_exception(exc_info, True)
+
+
+async def render_async(self, *args, **kwargs):
+    vars = dict(*args, **kwargs)
+    try:
+        return await concat_async(self.root_render_func(
+            self.new_context(vars)))
+    except Exception:
+        exc_info = sys.exc_info()
+    return self.environment.handle_exception(exc_info, True)
+
+
+def stream_async(self, *args, **kwargs):
+    return AsyncTemplateStream(self.generate_async(*args, **kwargs))
+
+
+async def make_module_async(self, vars=None, shared=False, locals=None):
+    context = self.new_context(vars, shared, locals)
+    body_stream = await collect_events(self.root_render_func(context))
+    return TemplateModule(self, context, body_stream)
+
+
+async def get_default_module_async(self):
+    if self._module is not None:
+        return self._module
+    self._module = rv = await self.make_module_async()
+    return rv
+
+
+def wrap_generate_func(original_generate):
+    def _convert_generator(self, loop, args, kwargs):
+        async_gen = self.generate_async(*args, **kwargs)
+        try:
+            while 1:
+                yield loop.run_until_complete(async_gen.__anext__())
+        except StopAsyncIteration:
+            pass
+
+    def generate(self, *args, **kwargs):
+        if not self.environment.is_async:
+            return original_generate(self, *args, **kwargs)
+        return _convert_generator(self, get_event_loop(), args, kwargs)
+    return update_wrapper(generate, original_generate)
+
+
+def wrap_render_func(original_render):
+    def render(self, *args, **kwargs):
+        if not self.environment.is_async:
+            return original_render(self, *args, **kwargs)
+        return get_event_loop().run_until_complete(
+            self.render_async(*args, **kwargs))
+    return update_wrapper(render, original_render)
+
+
+def wrap_module_func(original_func):
+    def func(self, *args, **kwargs):
+        if self.environment.is_async:
+            raise RuntimeError('Template module attribute is unavailable '
+                               'in async mode, use make_module_async')
+        return original_func(self, *args, **kwargs)
+    return update_wrapper(func, original_func)
+
+
+def wrap_block_reference_call(original_call):
+    @internalcode
+    async def async_call(self):
+        rv = await concat_async(self._stack[self._depth](self._context))
+        if self._context.eval_ctx.autoescape:
+            rv = Markup(rv)
+        return rv
+
+    @internalcode
+    def __call__(self):
+        if not self._context.environment.is_async:
+            return original_call(self)
+        return async_call(self)
+    return update_wrapper(__call__, original_call)
+
+
+def wrap_expression_call(original_call):
+    def __call__(self, *args, **kwargs):
+        if not self._template.environment.is_async:
+            return original_call(self, *args, **kwargs)
+        context = self._template.new_context(dict(*args, **kwargs))
+        get_event_loop().run_until_complete(
+            collect_events(self._template.root_render_func(context)))
+        rv = context.vars['result']
+        if self._undefined_to_none and isinstance(rv, Undefined):
+            rv = None
+        return rv
+    return update_wrapper(__call__, original_call)
+
+
+async def fragment_get_or_render_async(self, key, timeout, render,
+                                       templates=()):
+    rv = self.get(key)
+    if rv is not None:
+        self.hits += 1
+        return rv
+
+    # concurrent misses in the same event loop wait for the first render
+    flight_key = (get_event_loop(), key)
+    flight = self._async_flights.get(flight_key)
+    if flight is not None:
+        rv = await asyncio.shield(flight)
+        if rv is not None:
+            self.hits += 1
+            return rv
+        return await auto_await(render())
+
+    flight = self._async_flights[flight_key] = asyncio.Future()
+    self.misses += 1
+    rv = None
+    try:
+        rv = await auto_await(render())
+        self.set(key, rv, timeout)
+        self._remember_templates(key, templates)
+    finally:
+        del self._async_flights[flight_key]
+        flight.set_result(rv)
+    return rv
+
+
+def patch_template():
+    from jinja2 import Template
+    Template.generate = wrap_generate_func(Template.generate)
+    Template.generate_async = update_wrapper(
+        async_only(generate_async), Template.generate_async)
+    Template.render_async = update_wrapper(
+        async_only(render_async), Template.render_async)
+    Template.render = wrap_render_func(Template.render)
+    Template.stream_async = update_wrapper(
+        async_only(stream_async), Template.stream_async)
+    Template.make_module = wrap_module_func(Template.make_module)
+    Template._get_default_module = wrap_module_func(
+        Template._get_default_module)
+    Template.make_module_async = update_wrapper(
+        async_only(make_module_async), Template.make_module_async)
+    Template._get_default_module_async = get_default_module_async
+
+
+def patch_runtime():
+    BlockReference.__call__ = wrap_block_reference_call(
+        BlockReference.__call__)
+    TemplateExpression.__call__ = wrap_expression_call(
+        TemplateExpression.__call__)
+
+
+def patch_fragment_cache():
+    from jinja2.fragmentcache import FragmentCache
+    FragmentCache.get_or_render_async = update_wrapper(
+        fragment_get_or_render_async, FragmentCache.get_or_render_async)
+
+
+def patch_all():
+    patch_template()
+    patch_runtime()
+    patch_fragment_cache()
@@ -17,14 +17,26 @@
 from os import path, listdir
 import os
 import sys
+import mmap
 import stat
+import zlib
 import errno
+import struct
 import marshal
 import tempfile
 import fnmatch
 from hashlib import sha1
-from jinja2.utils import open_if_exists
-from jinja2._compat import BytesIO, pickle, PY2, text_type
+from threading import Lock
+from time import time
+from collections import OrderedDict
+from jinja2.utils import open_if_exists, ConcurrentLRUCache
+from jinja2._compat import BytesIO, pickle, PY2, text_type, range_type
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
 
 
 # marshal works better on 3.x, one hack less required
@@ -57,6 +69,48 @@ bc_magic = 'j2'.encode('ascii') + \
     pickle.dumps((sys.version_info[0] << 24) | sys.version_info[1])
 
 
+def get_environment_fingerprint(environment):
+    """Return a checksum of the environment settings that change the code
+    templates are compiled into: the syntax, the extensions, the compiler
+    options and the Jinja and Python versions.  Compiled templates can be
+    reused by environments with the same fingerprint.
+
+    .. versionadded:: 2.9
+    """
+    def qualname(obj):
+        return '%s.%s' % (obj.__module__, getattr(obj, '__name__', repr(obj)))
+
+    autoescape = environment.autoescape
+    if callable(autoescape):
+        autoescape = qualname(autoescape)
+    settings = (
+        bc_magic,
+        qualname(type(environment)),
+        qualname(environment.code_generator_class),
+        environment.block_start_string,
+        environment.block_end_string,
+        environment.variable_start_string,
+        environment.variable_end_string,
+        environment.comment_start_string,
+        environment.comment_end_string,
+        environment.line_statement_prefix,
+        environment.line_comment_prefix,
+        environment.trim_blocks,
+        environment.lstrip_blocks,
+        environment.newline_sequence,
+        environment.keep_trailing_newline,
+        environment.optimized,
+        environment.finalize is not None,
+        autoescape,
+        environment.render_mode,
+        environment.flatten_extends,
+        environment.is_async,
+        environment.section_executor is not None,
+        sorted(qualname(type(x)) for x in environment.iter_extensions()),
+    )
+    return sha1(repr(settings).encode('utf-8')).hexdigest()
+
+
 class Bucket(object):
     """Buckets are used to store the bytecode for one template.  It's created
     and initialized by the bytecode cache and passed to the loading functions.
@@ -141,8 +195,19 @@ class BytecodeCache(object):
 
     A more advanced version of a filesystem based bytecode cache is part of
     Jinja2.
+
+    Caches that can load many entries in one round trip can override
+    :meth:`load_many`.  If `prefetch` is `True` the loaders use it to load
+    the code of the templates a template extends, includes or imports with
+    a constant name together when the template is loaded.
     """
 
+    #: load the code of the dependencies of a template with
+    #: :meth:`load_many` when the template is loaded.
+    #:
+    #: .. versionadded:: 2.9
+    prefetch = False
+
     def load_bytecode(self, bucket):
         """Subclasses have to override this method to load bytecode into a
         bucket.  If they are not able to find code in the cache for the
@@ -150,6 +215,16 @@ class BytecodeCache(object):
         """
         raise NotImplementedError()
 
+    def load_many(self, buckets):
+        """Load the bytecode into a list of buckets.  The default
+        implementation calls :meth:`load_bytecode` for every bucket,
+        subclasses can override it to look up all buckets at once.
+
+        .. versionadded:: 2.9
+        """
+        for bucket in buckets:
+            self.load_bytecode(bucket)
+
     def dump_bytecode(self, bucket):
         """Subclasses have to override this method to write the bytecode
         from a bucket back to the cache.  If it unable to do so it must not
@@ -177,20 +252,124 @@ class BytecodeCache(object):
         """Returns a checksum for the source."""
         return sha1(source.encode('utf-8')).hexdigest()
 
+    def _get_bucket_key(self, environment, name, filename):
+        key = self.get_cache_key(name, filename)
+        # the code of templates compiled for async rendering, the section
+        # executor or the buffer render mode can't be used by other
+        # environments and the other way round.
+        if environment.is_async:
+            key += '-async'
+        elif environment.section_executor is not None:
+            key += '-sections'
+        if environment.render_mode == 'buffer':
+            key += '-buffer'
+        return key
+
+    def make_bucket(self, environment, name, filename, source):
+        """Return an empty cache bucket for the given template.  The code is
+        not loaded yet, see :meth:`get_bucket`.
+
+        .. versionadded:: 2.9
+        """
+        key = self._get_bucket_key(environment, name, filename)
+        checksum = self.get_source_checksum(source)
+        return Bucket(environment, key, checksum)
+
+    def make_version_bucket(self, environment, name, filename, version):
+        """Like :meth:`make_bucket` but the bucket is validated with the
+        version token of the loader (see
+        :meth:`~jinja2.BaseLoader.get_source_version`) instead of the
+        checksum of the source.  Caches that need the source return `None`.
+
+        .. versionadded:: 2.9
+        """
+        # versioned entries are kept apart from the ones validated with the
+        # source so that loaders with and without versions don't replace
+        # each other's code.
+        key = self._get_bucket_key(environment, name, filename) + '-version'
+        checksum = sha1(text_type(version).encode('utf-8')).hexdigest()
+        return Bucket(environment, key, checksum)
+
     def get_bucket(self, environment, name, filename, source):
         """Return a cache bucket for the given template.  All arguments are
         mandatory but filename may be `None`.
         """
-        key = self.get_cache_key(name, filename)
-        checksum = self.get_source_checksum(source)
-        bucket = Bucket(environment, key, checksum)
+        bucket = self.make_bucket(environment, name, filename, source)
         self.load_bytecode(bucket)
         return bucket
 
+    def get_version_bucket(self, environment, name, filename, version):
+        """Like :meth:`get_bucket` for :meth:`make_version_bucket`.
+
+        .. versionadded:: 2.9
+        """
+        bucket = self.make_version_bucket(environment, name, filename,
+                                          version)
+        if bucket is not None:
+            self.load_bytecode(bucket)
+        return bucket
+
     def set_bucket(self, bucket):
         """Put the bucket into the cache."""
         self.dump_bytecode(bucket)
 
+    def get_compile_lock(self, bucket):
+        """Return a context manager that is held while the code for the
+        bucket is compiled and stored, or `None` if the cache does not lock.
+        Caches shared by multiple processes can return a lock so that only
+        one of them compiles a template, the others load the bucket again
+        once they have the lock.
+
+        .. versionadded:: 2.9
+        """
+        return None
+
+
+def get_default_cache_dir():
+    """Return a private cache directory for the current user.  On Windows
+    the user's temp directory is used, on UNIX systems a directory is
+    created for the user in the system temp directory.
+    """
+    def _unsafe_dir():
+        raise RuntimeError('Cannot determine safe temp directory.  You '
+                           'need to explicitly provide one.')
+
+    tmpdir = tempfile.gettempdir()
+
+    # On windows the temporary directory is used specific unless
+    # explicitly forced otherwise.  We can just use that.
+    if os.name == 'nt':
+        return tmpdir
+    if not hasattr(os, 'getuid'):
+        _unsafe_dir()
+
+    dirname = '_jinja2-cache-%d' % os.getuid()
+    actual_dir = os.path.join(tmpdir, dirname)
+
+    try:
+        os.mkdir(actual_dir, stat.S_IRWXU)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    try:
+        os.chmod(actual_dir, stat.S_IRWXU)
+        actual_dir_stat = os.lstat(actual_dir)
+        if actual_dir_stat.st_uid != os.getuid() \
+           or not stat.S_ISDIR(actual_dir_stat.st_mode) \
+           or stat.S_IMODE(actual_dir_stat.st_mode) != stat.S_IRWXU:
+            _unsafe_dir()
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    actual_dir_stat = os.lstat(actual_dir)
+    if actual_dir_stat.st_uid != os.getuid() \
+       or not stat.S_ISDIR(actual_dir_stat.st_mode) \
+       or stat.S_IMODE(actual_dir_stat.st_mode) != stat.S_IRWXU:
+        _unsafe_dir()
+
+    return actual_dir
+
 
 class FileSystemBytecodeCache(BytecodeCache):
     """A bytecode cache that stores bytecode on the filesystem.  It accepts
@@ -207,55 +386,30 @@ class FileSystemBytecodeCache(BytecodeCache):
 
     >>> bcc = FileSystemBytecodeCache('/tmp/jinja_cache', '%s.cache')
 
+    If `lock_compiles` is `True`, processes that miss the cache for the same
+    template at the same time take turns with a lock file next to the cache
+    file.  The first one compiles the template, the others load its code
+    from the cache.  This avoids that all workers of an application server
+    compile the same templates after a deploy.  The lock files are kept so
+    that all processes lock the same file, :meth:`clear` removes them along
+    with the cache files.
+
     This bytecode cache supports clearing of the cache using the clear method.
+
+    .. versionadded:: 2.9
+       The `lock_compiles` parameter was added.
     """
 
-    def __init__(self, directory=None, pattern='__jinja2_%s.cache'):
+    def __init__(self, directory=None, pattern='__jinja2_%s.cache',
+                 lock_compiles=False):
         if directory is None:
             directory = self._get_default_cache_dir()
         self.directory = directory
         self.pattern = pattern
+        self.lock_compiles = lock_compiles
 
     def _get_default_cache_dir(self):
-        def _unsafe_dir():
-            raise RuntimeError('Cannot determine safe temp directory.  You '
-                               'need to explicitly provide one.')
-
-        tmpdir = tempfile.gettempdir()
-
-        # On windows the temporary directory is used specific unless
-        # explicitly forced otherwise.  We can just use that.
-        if os.name == 'nt':
-            return tmpdir
-        if not hasattr(os, 'getuid'):
-            _unsafe_dir()
-
-        dirname = '_jinja2-cache-%d' % os.getuid()
-        actual_dir = os.path.join(tmpdir, dirname)
-
-        try:
-            os.mkdir(actual_dir, stat.S_IRWXU)
-        except OSError as e:
-            if e.errno != errno.EEXIST:
-                raise
-        try:
-            os.chmod(actual_dir, stat.S_IRWXU)
-            actual_dir_stat = os.lstat(actual_dir)
-            if actual_dir_stat.st_uid != os.getuid() \
-               or not stat.S_ISDIR(actual_dir_stat.st_mode) \
-               or stat.S_IMODE(actual_dir_stat.st_mode) != stat.S_IRWXU:
-                _unsafe_dir()
-        except OSError as e:
-            if e.errno != errno.EEXIST:
-                raise
-
-        actual_dir_stat = os.lstat(actual_dir)
-        if actual_dir_stat.st_uid != os.getuid() \
-           or not stat.S_ISDIR(actual_dir_stat.st_mode) \
-           or stat.S_IMODE(actual_dir_stat.st_mode) != stat.S_IRWXU:
-            _unsafe_dir()
-
-        return actual_dir
+        return get_default_cache_dir()
 
     def _get_cache_filename(self, bucket):
         return path.join(self.directory, self.pattern % bucket.key)
@@ -269,18 +423,29 @@ class FileSystemBytecodeCache(BytecodeCache):
                 f.close()
 
     def dump_bytecode(self, bucket):
-        f = open(self._get_cache_filename(bucket), 'wb')
+        # the file is replaced atomically so that other processes never
+        # load partially written code.
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
         try:
-            bucket.write_bytecode(f)
-        finally:
-            f.close()
+            with os.fdopen(fd, 'wb') as f:
+                bucket.write_bytecode(f)
+            _replace_file(tmp, self._get_cache_filename(bucket))
+        except Exception:
+            _remove_file(tmp)
+            raise
+
+    def get_compile_lock(self, bucket):
+        if self.lock_compiles:
+            return _FileLock(self._get_cache_filename(bucket) + '.lock')
 
     def clear(self):
         # imported lazily here because google app-engine doesn't support
         # write access on the file system and the function does not exist
         # normally.
         from os import remove
-        files = fnmatch.filter(listdir(self.directory), self.pattern % '*')
+        files = listdir(self.directory)
+        files = fnmatch.filter(files, self.pattern % '*') + \
+            fnmatch.filter(files, self.pattern % '*' + '.lock')
         for filename in files:
             try:
                 remove(path.join(self.directory, filename))
@@ -322,9 +487,21 @@ class MemcachedBytecodeCache(BytecodeCache):
             Returns the value for the cache key.  If the item does not
             exist in the cache the return value must be `None`.
 
+    If the client also provides this method it is used to load many
+    templates in one round trip:
+
+        .. method:: get_multi(keys)
+
+            Returns a dict with the values of the given keys.  Keys that
+            do not exist in the cache are missing in the dict.
+
     The other arguments to the constructor are the prefix for all keys that
     is added before the actual cache key and the timeout for the bytecode in
-    the cache system.  We recommend a high (or no) timeout.
+    the cache system.  We recommend a high (or no) timeout.  If `prefetch`
+    is `True` the code of the templates a template includes, extends or
+    imports is loaded in one `get_multi` call per level of dependencies
+    when the template is loaded, which saves a round trip per template
+    while the cache is cold in this process.
 
     This bytecode cache does not support clearing of used items in the cache.
     The clear method is a no-operation function.
@@ -332,14 +509,18 @@ class MemcachedBytecodeCache(BytecodeCache):
     .. versionadded:: 2.7
        Added support for ignoring memcache errors through the
        `ignore_memcache_errors` parameter.
+
+    .. versionadded:: 2.9
+       The `prefetch` parameter was added.
     """
 
     def __init__(self, client, prefix='jinja2/bytecode/', timeout=None,
-                 ignore_memcache_errors=True):
+                 ignore_memcache_errors=True, prefetch=False):
         self.client = client
         self.prefix = prefix
         self.timeout = timeout
         self.ignore_memcache_errors = ignore_memcache_errors
+        self.prefetch = prefetch
 
     def load_bytecode(self, bucket):
         try:
@@ -351,6 +532,22 @@ class MemcachedBytecodeCache(BytecodeCache):
         if code is not None:
             bucket.bytecode_from_string(code)
 
+    def load_many(self, buckets):
+        get_multi = getattr(self.client, 'get_multi', None)
+        if get_multi is None or len(buckets) < 2:
+            return BytecodeCache.load_many(self, buckets)
+        keys = [self.prefix + bucket.key for bucket in buckets]
+        try:
+            values = get_multi(keys) or {}
+        except Exception:
+            if not self.ignore_memcache_errors:
+                raise
+            return
+        for key, bucket in zip(keys, buckets):
+            code = values.get(key)
+            if code is not None:
+                bucket.bytecode_from_string(code)
+
     def dump_bytecode(self, bucket):
         args = (self.prefix + bucket.key, bucket.bytecode_to_string())
         if self.timeout is not None:
@@ -360,3 +557,579 @@ class MemcachedBytecodeCache(BytecodeCache):
         except Exception:
             if not self.ignore_memcache_errors:
                 raise
+
+
+class MemoryBytecodeCache(BytecodeCache):
+    """Keeps the code of templates in memory.  The size of an entry is the
+    size of its marshalled bytecode.  If the entries take up more than
+    `max_bytes` bytes the least recently used ones are removed, their number
+    is counted in `evictions`.  This is usually the front tier of a
+    :class:`TieredBytecodeCache`.
+
+    .. versionadded:: 2.9
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def load_bytecode(self, bucket):
+        with self._lock:
+            entry = self._entries.pop(bucket.key, None)
+            if entry is None:
+                return
+            self._entries[bucket.key] = entry
+        if entry[0] == bucket.checksum:
+            bucket.code = entry[1]
+
+    def dump_bytecode(self, bucket):
+        size = len(marshal.dumps(bucket.code))
+        with self._lock:
+            old = self._entries.pop(bucket.key, None)
+            if old is not None:
+                self.size -= old[2]
+            if size > self.max_bytes:
+                return
+            self._entries[bucket.key] = (bucket.checksum, bucket.code, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.size -= self._entries.popitem(last=False)[1][2]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TieredBytecodeCache(BytecodeCache):
+    """Combines a fast `front` bytecode cache, usually a
+    :class:`MemoryBytecodeCache`, with a slower shared `back` cache such as
+    the :class:`FileSystemBytecodeCache` or :class:`MemcachedBytecodeCache`.
+    Lookups that miss the front cache are read from the back cache and
+    stored in the front cache, new code is written to both::
+
+        bcc = TieredBytecodeCache(MemoryBytecodeCache(32 * 1024 * 1024),
+                                  MemcachedBytecodeCache(client))
+
+    If the back cache has no code for a template or only code compiled from
+    another source, this is remembered for `negative_timeout` seconds and
+    the back cache is not asked again until new code for the template is
+    stored.  At most `negative_capacity` of these misses are remembered.
+
+    The cache counts the lookups answered by the front cache in `hits`, by
+    the back cache in `back_hits` and the remembered misses in
+    `negative_hits`.  `misses` are the lookups neither tier could answer.
+    Dependencies are prefetched if the back cache prefetches.
+
+    .. versionadded:: 2.9
+    """
+
+    def __init__(self, front, back, negative_timeout=60,
+                 negative_capacity=1000):
+        self.front = front
+        self.back = back
+        self.negative_timeout = negative_timeout
+        self.hits = 0
+        self.back_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._negative = ConcurrentLRUCache(negative_capacity)
+
+    @property
+    def prefetch(self):
+        return self.back.prefetch
+
+    def load_bytecode(self, bucket):
+        self.load_many([bucket])
+
+    def load_many(self, buckets):
+        self.front.load_many(buckets)
+        now = time()
+        pending = []
+        for bucket in buckets:
+            if bucket.code is not None:
+                self.hits += 1
+                continue
+            negative_key = (bucket.key, bucket.checksum)
+            expires = self._negative.get(negative_key)
+            if expires is not None:
+                if expires > now:
+                    self.negative_hits += 1
+                    continue
+                self._forget_miss(negative_key)
+            pending.append(bucket)
+        if not pending:
+            return
+
+        self.back.load_many(pending)
+        for bucket in pending:
+            if bucket.code is None:
+                self.misses += 1
+                self._negative[(bucket.key, bucket.checksum)] = \
+                    now + self.negative_timeout
+            else:
+                self.back_hits += 1
+                self.front.dump_bytecode(bucket)
+
+    def _forget_miss(self, negative_key):
+        try:
+            del self._negative[negative_key]
+        except KeyError:
+            pass
+
+    def get_compile_lock(self, bucket):
+        lock = self.back.get_compile_lock(bucket)
+        if lock is not None:
+            lock = _ForgetMissLock(self, lock, bucket)
+        return lock
+
+    def dump_bytecode(self, bucket):
+        self._forget_miss((bucket.key, bucket.checksum))
+        self.front.dump_bytecode(bucket)
+        self.back.dump_bytecode(bucket)
+
+    def clear(self):
+        self._negative.clear()
+        self.front.clear()
+        self.back.clear()
+
+
+class _ForgetMissLock(object):
+    """The compile lock of the back cache of a :class:`TieredBytecodeCache`.
+    The miss remembered for the bucket is forgotten once the lock is held so
+    that the bucket is loaded from the back cache again, another process
+    might have stored the code while we waited.
+    """
+
+    def __init__(self, cache, lock, bucket):
+        self.cache = cache
+        self.lock = lock
+        self.bucket = bucket
+
+    def __enter__(self):
+        self.lock.__enter__()
+        self.cache._forget_miss((self.bucket.key, self.bucket.checksum))
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return self.lock.__exit__(exc_type, exc_value, tb)
+
+
+class ContentAddressedBytecodeCache(BytecodeCache):
+    """A bytecode cache that stores the code of a template under a hash of
+    its name, its source and the fingerprint of the environment settings
+    (see :func:`get_environment_fingerprint`) instead of the name and the
+    filename.  Templates with the same name and source loaded by different
+    loaders, for example the same snippet in thousands of themes with one
+    loader each, share one entry in the `backend` cache and one code object
+    in memory.  Changing the environment settings never loads code compiled
+    for other settings.
+
+    The code objects of the `capacity` most recently used entries are kept
+    in memory, the `backend` is an optional other bytecode cache:
+
+    >>> bcc = ContentAddressedBytecodeCache(
+    ...     FileSystemBytecodeCache('/tmp/jinja_cache'), capacity=5000)
+
+    The name is part of the key because it is compiled into the code of the
+    template.  Templates compiled with `flatten_extends` are keyed by their
+    own source only, if they extend different parents they are compiled
+    again and replace the shared entry.  Dependencies are prefetched if the
+    `backend` prefetches.
+
+    .. versionadded:: 2.9
+    """
+
+    def __init__(self, backend=None, capacity=1000):
+        self.backend = backend
+        self.capacity = capacity
+        self._code = ConcurrentLRUCache(capacity)
+
+    def get_content_key(self, environment, name, checksum):
+        """Return the cache key for the template `name` with the source
+        `checksum` in the given environment.
+        """
+        key = '%s|%s|%s' % (get_environment_fingerprint(environment),
+                            checksum, name)
+        return sha1(key.encode('utf-8')).hexdigest()
+
+    @property
+    def prefetch(self):
+        return self.backend is not None and self.backend.prefetch
+
+    def make_bucket(self, environment, name, filename, source):
+        checksum = self.get_source_checksum(source)
+        key = self.get_content_key(environment, name, checksum)
+        return Bucket(environment, key, checksum)
+
+    def make_version_bucket(self, environment, name, filename, version):
+        # the key is computed from the source
+        return None
+
+    def load_bytecode(self, bucket):
+        self.load_many([bucket])
+
+    def load_many(self, buckets):
+        pending = []
+        for bucket in buckets:
+            code = self._code.get(bucket.key)
+            if code is not None:
+                bucket.code = code
+            else:
+                pending.append(bucket)
+        if self.backend is None or not pending:
+            return
+        self.backend.load_many(pending)
+        for bucket in pending:
+            if bucket.code is not None:
+                self._code[bucket.key] = bucket.code
+
+    def dump_bytecode(self, bucket):
+        self._code[bucket.key] = bucket.code
+        if self.backend is not None:
+            self.backend.dump_bytecode(bucket)
+
+    def get_compile_lock(self, bucket):
+        if self.backend is not None:
+            return self.backend.get_compile_lock(bucket)
+
+    def clear(self):
+        self._code.clear()
+        if self.backend is not None:
+            self.backend.clear()
+
+
+def _replace_file(src, dst):
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # windows does not replace existing files on rename
+        _remove_file(dst)
+        os.rename(src, dst)
+
+
+def _remove_file(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+class _FileLock(object):
+    """An exclusive lock on a local file that is shared by all processes."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._fd = None
+
+    def __enter__(self):
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        except Exception:
+            os.close(fd)
+            raise
+        self._fd = fd
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        fd, self._fd = self._fd, None
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, 0)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+
+class PackFileBytecodeCache(BytecodeCache):
+    """A bytecode cache that stores the bytecode of all templates in a single
+    append-only pack file in `directory`, instead of one file per template.
+    The entries are found with a hash index that is memory mapped by all
+    processes using the cache, so a lookup does not open any files and the
+    bytecode is unmarshalled straight from the mapped pack file.
+
+    Writers append the entry to the pack file before they update the index,
+    so readers never see partially written entries.  Writers are serialized
+    by a lock file, readers do not take any locks.  Once replaced entries
+    take up more than half of the pack file (and at least `compact_size`
+    bytes), or the index is half full, the live entries are copied into a
+    new pack file and a new index atomically replaces the old one.  Readers
+    notice that and switch over, so the cache can be compacted while it is
+    in use.
+
+    If no directory is given the default cache directory of the
+    :class:`FileSystemBytecodeCache` is used.  `capacity` is the initial
+    number of slots in the index.
+
+    >>> bcc = PackFileBytecodeCache('/tmp/jinja_cache')
+
+    .. versionadded:: 2.9
+    """
+
+    _index_header = struct.Struct('>4sB3xQQQQ')
+    _index_magic = b'J2IX'
+    _slot = struct.Struct('>QQI4x')
+    _pack_header = struct.Struct('>4sI')
+    _pack_magic = b'J2PK'
+    _pack_version = 1
+    _record_header = struct.Struct('>HHII')
+
+    def __init__(self, directory=None, prefix='__jinja2_bytecode',
+                 capacity=1024, compact_size=1 << 20):
+        if directory is None:
+            directory = get_default_cache_dir()
+        self.directory = directory
+        self.prefix = prefix
+        self.capacity = capacity
+        self.compact_size = compact_size
+        self._lock = Lock()
+        self._index = None
+        self._pack = None
+
+    def _get_filename(self, suffix):
+        return path.join(self.directory, self.prefix + suffix)
+
+    def _get_pack_filename(self, generation):
+        return self._get_filename('-%d.pack' % generation)
+
+    def _file_lock(self):
+        return _FileLock(self._get_filename('.lock'))
+
+    def _get_key(self, bucket):
+        # code compiled by other Python versions is stored under other keys
+        return bc_magic + bucket.key.encode('utf-8')
+
+    def _hash(self, key):
+        return struct.unpack('>Q', sha1(key).digest()[:8])[0] or 1
+
+    def _open(self):
+        """Map the current index.  It is created if it does not exist."""
+        filename = self._get_filename('.idx')
+        for attempt in 0, 1:
+            try:
+                f = open(filename, 'r+b')
+            except IOError as e:
+                if e.errno != errno.ENOENT or attempt:
+                    raise
+                with self._file_lock():
+                    if not path.exists(filename):
+                        self._write_generation(1, self.capacity, ())
+                continue
+            with f:
+                index = mmap.mmap(f.fileno(), 0)
+            magic = self._index_header.unpack_from(index)[0]
+            if magic != self._index_magic:
+                raise IOError('%r is not a bytecode index' % filename)
+            self._index = index
+            self._pack = None
+            return index
+
+    def _current_index(self):
+        index = self._index
+        if index is None or index[4:5] != b'\x00':
+            with self._lock:
+                if self._index is index:
+                    self._open()
+                index = self._index
+        return index
+
+    def _get_pack(self, generation, size):
+        """Return the mapped pack file, mapped again if it grew."""
+        pack = self._pack
+        if pack is None or pack[0] != generation or len(pack[1]) < size:
+            with open(self._get_pack_filename(generation), 'rb') as f:
+                pack = (generation, mmap.mmap(f.fileno(), 0,
+                                              access=mmap.ACCESS_READ))
+            self._pack = pack
+        return pack[1]
+
+    def _find_slot(self, index, capacity, key_hash):
+        """Return the position of the slot for the key and whether the slot
+        is in use.
+        """
+        header_size = self._index_header.size
+        slot_size = self._slot.size
+        slot = key_hash % capacity
+        for _ in range_type(capacity):
+            pos = header_size + slot * slot_size
+            slot_hash = self._slot.unpack_from(index, pos)[0]
+            if slot_hash == key_hash:
+                return pos, True
+            elif slot_hash == 0:
+                return pos, False
+            slot = (slot + 1) % capacity
+        return None, False
+
+    def _read_record(self, pack, offset, length, key, checksum):
+        key_length, checksum_length, payload_length, crc = \
+            self._record_header.unpack_from(pack, offset)
+        start = offset + self._record_header.size
+        end = start + key_length + checksum_length + payload_length
+        if end != offset + length or end > len(pack) or \
+           pack[start:start + key_length] != key:
+            return None
+        start += key_length
+        if pack[start:start + checksum_length] != checksum:
+            return None
+        if PY2:
+            data = pack[start:end]
+            if zlib.crc32(data) & 0xffffffff != crc:
+                return None
+            return marshal.loads(data[checksum_length:])
+        with memoryview(pack) as view:
+            if zlib.crc32(view[start:end]) & 0xffffffff != crc:
+                return None
+            return marshal.loads(view[start + checksum_length:end])
+
+    def load_bytecode(self, bucket):
+        key = self._get_key(bucket)
+        checksum = bucket.checksum.encode('ascii')
+        try:
+            index = self._current_index()
+            generation, capacity = self._index_header.unpack_from(index)[2:4]
+            pos, found = self._find_slot(index, capacity, self._hash(key))
+            if not found:
+                return
+            offset, length = self._slot.unpack_from(index, pos)[1:3]
+            pack = self._get_pack(generation, offset + length)
+            code = self._read_record(pack, offset, length, key, checksum)
+        except (EnvironmentError, ValueError, TypeError, EOFError,
+                struct.error):
+            return
+        if code is not None:
+            bucket.code = code
+
+    def dump_bytecode(self, bucket):
+        key = self._get_key(bucket)
+        key_hash = self._hash(key)
+        checksum = bucket.checksum.encode('ascii')
+        data = checksum + marshal.dumps(bucket.code)
+        record = self._record_header.pack(
+            len(key), len(checksum), len(data) - len(checksum),
+            zlib.crc32(data) & 0xffffffff) + key + data
+
+        with self._lock:
+            with self._file_lock():
+                index = self._index
+                if index is None or index[4:5] != b'\x00':
+                    index = self._open()
+                generation, capacity, count, live = \
+                    self._index_header.unpack_from(index)[2:]
+                pos, found = self._find_slot(index, capacity, key_hash)
+                if not found and (count + 1) * 2 > capacity:
+                    index = self._compact(capacity * 2)
+                    generation, capacity, count, live = \
+                        self._index_header.unpack_from(index)[2:]
+                    pos, found = self._find_slot(index, capacity, key_hash)
+
+                with open(self._get_pack_filename(generation), 'ab') as f:
+                    f.seek(0, 2)
+                    offset = f.tell()
+                    f.write(record)
+
+                # the index is updated with slice assignments because
+                # `pack_into` clears the target first, which concurrent
+                # readers could see.  the hash is written last so that
+                # they either find the new or the old entry.
+                old_length = 0
+                if found:
+                    old_length = self._slot.unpack_from(index, pos)[2]
+                index[pos + 8:pos + 20] = struct.pack('>QI', offset,
+                                                      len(record))
+                index[pos:pos + 8] = struct.pack('>Q', key_hash)
+                live += len(record) - old_length
+                index[24:40] = struct.pack('>QQ', count + (not found), live)
+
+                size = offset + len(record)
+                if size > self.compact_size and size > live * 2:
+                    self._compact(capacity)
+
+    def _write_generation(self, generation, capacity, records):
+        """Write a pack file with the records and an index for it and make it
+        the current one.  Has to be called with the file lock held.
+        """
+        slots = bytearray(capacity * self._slot.size)
+        live = 0
+        with open(self._get_pack_filename(generation), 'wb') as f:
+            f.write(self._pack_header.pack(self._pack_magic,
+                                           self._pack_version))
+            for key_hash, record in records:
+                slot = key_hash % capacity
+                while self._slot.unpack_from(slots,
+                                             slot * self._slot.size)[0]:
+                    slot = (slot + 1) % capacity
+                self._slot.pack_into(slots, slot * self._slot.size,
+                                     key_hash, f.tell(), len(record))
+                f.write(record)
+                live += len(record)
+        header = self._index_header.pack(self._index_magic, 0, generation,
+                                         capacity, len(records), live)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header)
+                f.write(bytes(slots))
+            _replace_file(tmp, self._get_filename('.idx'))
+        except (IOError, OSError):
+            _remove_file(tmp)
+            raise
+
+    def _compact(self, capacity):
+        """Copy the live entries into a new pack file.  Has to be called with
+        both locks held.
+        """
+        index = self._index
+        generation, old_capacity, count = \
+            self._index_header.unpack_from(index)[2:5]
+        records = []
+        with open(self._get_pack_filename(generation), 'rb') as f:
+            for slot in range_type(old_capacity):
+                pos = self._index_header.size + slot * self._slot.size
+                key_hash, offset, length = self._slot.unpack_from(index, pos)
+                if key_hash:
+                    f.seek(offset)
+                    records.append((key_hash, f.read(length)))
+        self._replace_generation(generation, capacity, records)
+        return self._index
+
+    def _replace_generation(self, generation, capacity, records):
+        old_index = self._index
+        self._write_generation(generation + 1, capacity, records)
+        # tell the other processes that the index was replaced
+        old_index[4:5] = b'\x01'
+        _remove_file(self._get_pack_filename(generation))
+        self._open()
+
+    def compact(self):
+        """Copy the live entries into a new pack file.  This happens
+        automatically, but can be forced with this method.
+        """
+        with self._lock:
+            with self._file_lock():
+                index = self._index
+                if index is None or index[4:5] != b'\x00':
+                    self._open()
+                self._compact(self._index_header.unpack_from(
+                    self._index)[3])
+
+    def clear(self):
+        with self._lock:
+            with self._file_lock():
+                index = self._index
+                if index is None or index[4:5] != b'\x00':
+                    index = self._open()
+                generation = self._index_header.unpack_from(index)[2]
+                self._replace_generation(generation, self.capacity, ())
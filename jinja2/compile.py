@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""
+    jinja2.compile
+    ~~~~~~~~~~~~~~
+
+    Compiles the templates of a loader ahead of time into byte-compiled
+    modules for the :class:`~jinja2.ModuleLoader`.  The templates are
+    compiled in parallel by forked worker processes and a manifest in the
+    target folder remembers the checksums of the sources and the
+    dependencies between the templates, so that only changed templates and
+    the templates depending on them are compiled again::
+
+        $ python -m jinja2.compile -x liquid -j 8 theme/ compiled/
+
+    :copyright: (c) 2010 by the Jinja Team.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import sys
+import json
+import marshal
+import tempfile
+from time import time
+
+from jinja2.environment import Environment
+from jinja2.bccache import get_environment_fingerprint
+from jinja2.exceptions import TemplateNotFound, TemplateSyntaxError
+from jinja2.loaders import ModuleLoader, FileSystemLoader
+from jinja2.meta import find_template_dependencies
+from jinja2.utils import import_string, fork_pool, template_checksum
+from jinja2._compat import PY2, text_type, iteritems
+
+
+#: the name of the manifest in the target folder
+MANIFEST_FILENAME = 'jinja2-manifest.json'
+
+# the environment, target folder and pyc header in the worker processes
+_compile_job = None
+
+
+def get_pyc_header():
+    """Return the header of the ``.pyc`` files for the running interpreter.
+    The compiled templates have no source file so the timestamp in the
+    header is never checked.
+    """
+    if PY2:
+        import imp
+        return imp.get_magic() + b'\0' * 4
+    from importlib.util import MAGIC_NUMBER
+    if sys.version_info >= (3, 7):
+        return MAGIC_NUMBER + b'\0' * 12
+    return MAGIC_NUMBER + b'\0' * 8
+
+
+def get_module_path(target, name):
+    """Return the path of the byte-compiled module of the template."""
+    return os.path.join(target, ModuleLoader.get_module_filename(name) + 'c')
+
+
+class CompileResult(object):
+    """The result of :func:`compile_templates`.  `compiled` is the list of
+    the compiled templates, `unchanged` the list of the skipped templates
+    and `removed` the list of the templates that no longer exist.  `errors`
+    maps the names of the templates that could not be compiled to the
+    error message.
+
+    .. versionadded:: 2.9
+    """
+
+    def __init__(self, compiled, unchanged, removed, errors, seconds):
+        self.compiled = compiled
+        self.unchanged = unchanged
+        self.removed = removed
+        self.errors = errors
+        self.seconds = seconds
+
+    def __repr__(self):
+        return '<%s %d compiled, %d unchanged, %d removed, %d errors>' % (
+            self.__class__.__name__,
+            len(self.compiled),
+            len(self.unchanged),
+            len(self.removed),
+            len(self.errors)
+        )
+
+
+def load_manifest(target):
+    """Load the manifest from the target folder.  Returns an empty manifest
+    if there is none or it cannot be read.
+    """
+    try:
+        with open(os.path.join(target, MANIFEST_FILENAME)) as f:
+            manifest = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if not isinstance(manifest, dict):
+        return {}
+    return manifest
+
+
+def _write_file(target, filename, data, mode='wb'):
+    fd, tmp = tempfile.mkstemp(dir=target, suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(data)
+        _replace(tmp, filename)
+    except (IOError, OSError):
+        _remove(tmp)
+        raise
+
+
+def _replace(src, dst):
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # windows does not replace existing files on rename
+        _remove(dst)
+        os.rename(src, dst)
+
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+def _remove_module(target, name):
+    filename = get_module_path(target, name)
+    _remove(filename)
+    # a module written by `Environment.compile_templates` would be
+    # preferred over the byte-compiled one.
+    _remove(filename[:-1])
+
+
+def _compile_template(name, job):
+    """Compile a template into the target folder and return its manifest
+    entry.  If the template cannot be compiled the entry has an ``error``.
+    """
+    environment, target, pyc_header = job
+    entry = {}
+    try:
+        source, filename = environment.loader.get_source(environment,
+                                                         name)[:2]
+        entry['checksum'] = template_checksum(source)
+        ast = environment.parse(source, name, filename)
+        dependencies = set()
+        dynamic = False
+        for template_name in find_template_dependencies(ast):
+            if template_name is None:
+                dynamic = True
+            else:
+                dependencies.add(environment.join_path(template_name, name))
+        entry['dependencies'] = sorted(dependencies)
+        entry['dynamic'] = dynamic
+        code = environment.compile(ast, name, filename, defer_init=True)
+    except (TemplateNotFound, TemplateSyntaxError) as e:
+        entry['error'] = text_type(e)
+        _remove_module(target, name)
+        return name, entry
+
+    _write_file(target, get_module_path(target, name),
+                pyc_header + marshal.dumps(code))
+    _remove(get_module_path(target, name)[:-1])
+    return name, entry
+
+
+def _init_compile_worker(job):
+    global _compile_job
+    _compile_job = job
+
+
+def _compile_worker(name):
+    return _compile_template(name, _compile_job)
+
+
+def find_outdated_templates(environment, names, manifest):
+    """Return the set of templates that have to be compiled again.  These are
+    the templates that are not in the manifest or changed since and the
+    templates that depend on them or on removed templates.  If one of these
+    templates changed, templates with dynamic dependencies are compiled
+    again too.
+    """
+    entries = manifest.get('templates', {})
+    outdated = set()
+    for name in names:
+        entry = entries.get(name)
+        if entry is None:
+            outdated.add(name)
+            continue
+        source = environment.loader.get_source(environment, name)[0]
+        if entry.get('checksum') != template_checksum(source):
+            outdated.add(name)
+
+    dependents = {}
+    dynamic = set()
+    for name, entry in iteritems(entries):
+        for dependency in entry.get('dependencies', ()):
+            dependents.setdefault(dependency, set()).add(name)
+        if entry.get('dynamic'):
+            dynamic.add(name)
+
+    names = set(names)
+    changed = outdated | (set(entries) - names)
+    pending = list(changed)
+    while pending:
+        for name in dependents.get(pending.pop(), ()):
+            if name in names and name not in outdated:
+                outdated.add(name)
+                pending.append(name)
+    if changed:
+        outdated.update(dynamic & names)
+    return outdated
+
+
+def compile_templates(environment, target, names=None, extensions=None,
+                      filter_func=None, workers=None, force=False,
+                      log_function=None):
+    """Compile the templates of the environment's loader into byte-compiled
+    modules in the `target` folder that can be loaded with the
+    :class:`~jinja2.ModuleLoader`.  If no `names` are given the templates
+    returned by :meth:`~jinja2.Environment.list_templates` are compiled,
+    `extensions` and `filter_func` are passed to it.
+
+    Templates that did not change since the last run, and whose
+    dependencies did not change either, are skipped unless `force` is
+    `True`.  Changing the settings of the environment compiles all
+    templates again.  The templates are compiled by `workers` forked
+    processes, per default one per CPU.
+
+    Returns a :class:`CompileResult`.
+
+    .. versionadded:: 2.9
+    """
+    if log_function is None:
+        log_function = lambda x: None
+    if not os.path.isdir(target):
+        os.makedirs(target)
+    started = time()
+
+    if names is None:
+        names = environment.list_templates(extensions, filter_func)
+    names = list(names)
+    fingerprint = get_environment_fingerprint(environment)
+    manifest = load_manifest(target)
+    if force or manifest.get('fingerprint') != fingerprint:
+        manifest = {}
+    entries = manifest.get('templates', {})
+
+    outdated = find_outdated_templates(environment, names, manifest)
+    for name in names:
+        if name not in outdated and 'error' not in entries[name] and \
+           not os.path.isfile(get_module_path(target, name)):
+            outdated.add(name)
+    removed = sorted(set(entries) - set(names))
+    for name in removed:
+        _remove_module(target, name)
+        log_function('Removed "%s"' % name)
+
+    job = (environment, target, get_pyc_header())
+    if workers is None:
+        from multiprocessing import cpu_count
+        workers = cpu_count()
+    pool = None
+    if workers > 1 and len(outdated) > 1:
+        pool = fork_pool(min(workers, len(outdated)), _init_compile_worker,
+                         (job,))
+    if pool is None:
+        results = (_compile_template(name, job) for name in sorted(outdated))
+    else:
+        results = pool.imap_unordered(_compile_worker, sorted(outdated))
+
+    new_entries = dict((name, entries[name]) for name in names
+                       if name in entries and name not in outdated)
+    compiled = []
+    errors = dict((name, entry['error']) for name, entry
+                  in iteritems(new_entries) if 'error' in entry)
+    for name, error in sorted(iteritems(errors)):
+        log_function('Could not compile "%s": %s' % (name, error))
+    try:
+        for name, entry in results:
+            new_entries[name] = entry
+            if 'error' in entry:
+                errors[name] = entry['error']
+                log_function('Could not compile "%s": %s' %
+                             (name, entry['error']))
+            else:
+                compiled.append(name)
+                log_function('Compiled "%s"' % name)
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        _write_file(target, os.path.join(target, MANIFEST_FILENAME),
+                    json.dumps({'fingerprint': fingerprint,
+                                'templates': new_entries},
+                               indent=1, sort_keys=True), 'w')
+
+    rv = CompileResult(sorted(compiled),
+                       sorted(set(names) - outdated - set(errors)), removed,
+                       errors, time() - started)
+    log_function('Finished compiling templates in %.2fs: %r' %
+                 (rv.seconds, rv))
+    return rv
+
+
+def main(args=None):
+    """The entry point of ``python -m jinja2.compile``."""
+    from argparse import ArgumentParser
+    parser = ArgumentParser(prog='python -m jinja2.compile',
+                            description='Compile templates ahead of time '
+                            'for the ModuleLoader.  Only templates that '
+                            'changed since the last run and the templates '
+                            'depending on them are compiled.')
+    parser.add_argument('source', nargs='?',
+                        help='the template folder, defaults to the loader '
+                        'of the environment')
+    parser.add_argument('target', help='the folder for the compiled modules')
+    parser.add_argument('-e', '--environment', metavar='IMPORT',
+                        help='import path of the environment or of a '
+                        'function returning it, e.g. myapp.templating:env')
+    parser.add_argument('-x', '--extension', action='append',
+                        dest='extensions', metavar='EXT',
+                        help='only compile templates with this file '
+                        'extension, can be given multiple times')
+    parser.add_argument('-j', '--jobs', type=int, metavar='N',
+                        help='number of worker processes, defaults to the '
+                        'number of CPUs')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='compile all templates')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='only report errors')
+    args = parser.parse_args(args)
+
+    if args.environment is not None:
+        environment = import_string(args.environment)
+        if callable(environment):
+            environment = environment()
+        if args.source is not None:
+            environment = environment.overlay(
+                loader=FileSystemLoader(args.source))
+    elif args.source is not None:
+        environment = Environment(loader=FileSystemLoader(args.source))
+    else:
+        parser.error('either a source folder or an environment is required')
+    if environment.loader is None:
+        parser.error('the environment has no loader')
+
+    def log_function(message):
+        if not args.quiet or message.startswith('Could not compile'):
+            sys.stderr.write(message + '\n')
+
+    rv = compile_templates(environment, args.target,
+                           extensions=args.extensions, workers=args.jobs,
+                           force=args.force, log_function=log_function)
+    return rv.errors and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
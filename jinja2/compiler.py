@@ -14,8 +14,11 @@ from keyword import iskeyword as is_python_keyword
 from jinja2 import nodes
 from jinja2.nodes import EvalContext
 from jinja2.visitor import NodeVisitor
-from jinja2.exceptions import TemplateAssertionError
-from jinja2.utils import Markup, concat, escape
+from jinja2.exceptions import TemplateAssertionError, TemplateNotFound, \
+     TemplateSyntaxError
+from jinja2.optimizer import optimize
+from jinja2.defaults import SNIPPET_TEMPLATE_FORMAT, SECTION_TEMPLATE_FORMAT
+from jinja2.utils import Markup, concat, escape, template_checksum
 from jinja2._compat import range_type, text_type, string_types, \
      iteritems, NativeStringIO, imap
 
@@ -31,6 +34,12 @@ operators = {
     'notin':    'not in'
 }
 
+# top level nodes that may follow an extends tag in templates that are
+# flattened by the `flatten_extends` environment option.
+flattenable_nodes = (nodes.Output, nodes.Block, nodes.Assign,
+                     nodes.AssignBlock, nodes.Macro, nodes.Import,
+                     nodes.FromImport)
+
 # what method to iterate over items do we want to use for dict iteration
 # in generated code?  on 2.x let's go with iteritems, on 3.x with items
 if hasattr(dict, 'iteritems'):
@@ -64,6 +73,13 @@ def generate(node, environment, name, filename, stream=None,
         return generator.stream.getvalue()
 
 
+def template_lookup_key(node):
+    """Return the key under which the template of an include or section
+    with a constant template name is looked up in the frame.
+    """
+    return node.__class__.__name__, repr(node.template.value)
+
+
 def has_safe_repr(value):
     """Does the node have a safe representation?"""
     if value is None or value is NotImplemented or value is Ellipsis:
@@ -164,6 +180,15 @@ class Frame(object):
         # the name of the block we're in, otherwise None.
         self.block = parent and parent.block or None
 
+        # maps includes with a constant template name to the identifier
+        # that holds the resolved template in the current python function.
+        # See `CodeGenerator.pull_template_lookups`.
+        self.template_lookups = parent and parent.template_lookups or {}
+
+        # the name of the dict that memoizes the output of render tags in
+        # the current function or `None`.
+        self.render_cache = parent and parent.render_cache or None
+
         # a set of actually assigned names
         self.assigned_names = set()
 
@@ -247,6 +272,41 @@ class DependencyFinderVisitor(NodeVisitor):
         """Stop visiting at blocks."""
 
 
+class TemplateLookupFinderVisitor(NodeVisitor):
+    """A visitor that collects includes and sections with a constant
+    template name.  It only walks the nodes that end up in the same python
+    function, so it stops at nodes that are compiled into functions of
+    their own.
+    """
+
+    def __init__(self):
+        self.includes = []
+        self.renders = False
+
+    def visit_Include(self, node):
+        if isinstance(node.template, nodes.Const):
+            self.includes.append(node)
+
+    visit_Section = visit_Include
+
+    def visit_Render(self, node):
+        self.renders = True
+        self.visit_Include(node)
+
+    def visit_For(self, node):
+        if not node.recursive:
+            self.generic_visit(node)
+
+    def visit_Macro(self, node):
+        """Stop visiting at macros."""
+
+    def visit_CallBlock(self, node):
+        """Stop visiting at call blocks."""
+
+    def visit_Block(self, node):
+        """Stop visiting at blocks."""
+
+
 class UndeclaredNameVisitor(NodeVisitor):
     """A visitor that checks if a name is accessed without being
     declared.  This is different from the frame visitor as it will
@@ -388,6 +448,17 @@ class CodeGenerator(NodeVisitor):
         # the number of extends statements so far
         self.extends_so_far = 0
 
+        # the names and source checksums of the parent templates that were
+        # compiled into this template by `flatten_extends`
+        self.inlined_templates = []
+
+        # true if sections and render tags are submitted to the section
+        # executor.  The buffers of the template level render functions are
+        # tracked because the deferred output may only be written there.
+        self.defer_sections = environment.section_executor is not None and \
+            not environment.is_async
+        self.render_buffers = set()
+
         # some templates have a rootlevel extends.  In this case we
         # can safely assume that we're a child template and do some
         # more optimizations.
@@ -431,6 +502,16 @@ class CodeGenerator(NodeVisitor):
         self._last_identifier += 1
         return 't_%d' % self._last_identifier
 
+    def choose_async(self, async_value='async ', sync_value=''):
+        """Return `async_value` if the templates are compiled for async
+        rendering, `sync_value` otherwise.
+        """
+        return self.environment.is_async and async_value or sync_value
+
+    def func(self, name):
+        """Return the start of a function definition."""
+        return '%sdef %s' % (self.choose_async(), name)
+
     def buffer(self, frame):
         """Enable buffering for the frame from that point onwards."""
         frame.buffer = self.temporary_identifier()
@@ -478,6 +559,68 @@ class CodeGenerator(NodeVisitor):
         self.write(s)
         self.end_write(frame)
 
+    def render_function_buffer(self, frame):
+        """Return the extra parameter for the signature of a template level
+        render function (the root render function or a block).  In buffered
+        render mode these functions append to a list that is passed down the
+        call chain instead of yielding their output.  The list is returned
+        at the end of the function so that callers can still iterate over it.
+        """
+        if self.environment.render_mode != 'buffer':
+            return ''
+        frame.buffer = self.temporary_identifier()
+        self.render_buffers.add(frame.buffer)
+        return ', %s=None' % frame.buffer
+
+    def start_render_function(self, frame):
+        """Create the buffer of a template level render function if the
+        caller didn't pass one.
+        """
+        if frame.buffer is not None:
+            self.writeline('if %s is None:' % frame.buffer)
+            self.indent()
+            self.writeline('%s = []' % frame.buffer)
+            self.outdent()
+
+    def end_render_function(self, frame):
+        """Return the buffer of a template level render function."""
+        if frame.buffer is not None:
+            self.writeline('return %s' % frame.buffer)
+
+    def write_render_call(self, func, args, frame, node=None):
+        """Call a template level render function and write its output into
+        the frame.  In buffered render mode the function appends into the
+        buffer of the frame itself, otherwise the events are passed through.
+        """
+        if self.environment.render_mode == 'buffer' and \
+           frame.buffer is not None and \
+           (not self.defer_sections or self.is_render_stream(frame)):
+            self.writeline('%s%s(%s, %s)' % (self.choose_async('await '),
+                                             func, args, frame.buffer), node)
+            return
+        events = '%s(%s)' % (func, args)
+        if self.defer_sections and not self.is_render_stream(frame):
+            events = 'resolve_events(%s)' % events
+        self.writeline('%sfor event in %s:' % (self.choose_async(), events),
+                       node)
+        self.indent()
+        self.simple_write('event', frame)
+        self.outdent()
+
+    def is_render_stream(self, frame):
+        """Check if the output written into the frame ends up directly in
+        the output of the template level render function and not in the
+        buffer of a macro, call block or assignment.  Only there the
+        deferred output of sections may appear.
+        """
+        return frame.buffer is None or frame.buffer in self.render_buffers
+
+    def can_defer(self, frame):
+        """Check if a section or render tag in the frame is rendered by the
+        section executor.
+        """
+        return self.defer_sections and self.is_render_stream(frame)
+
     def blockvisit(self, nodes, frame):
         """Visit a list of nodes as block in a frame.  If the current frame
         is no buffer a dummy ``if 0: yield None`` is written automatically
@@ -591,6 +734,31 @@ class CodeGenerator(NodeVisitor):
                 self.writeline('%s = environment.%s[%r]' %
                                (mapping[name], dependency, name))
 
+    def pull_template_lookups(self, nodes, frame):
+        """Reserve an identifier for every include and section with a
+        constant template name in the python function that is written
+        next.  The template is then looked up the first time the include
+        is executed and reused for all further executions in the same call,
+        which saves the loader and cache roundtrip in loops.  If the nodes
+        contain render tags the dict that memoizes their output is created
+        here as well.
+        """
+        visitor = TemplateLookupFinderVisitor()
+        for node in nodes:
+            visitor.visit(node)
+        frame.template_lookups = lookups = {}
+        for node in visitor.includes:
+            key = template_lookup_key(node)
+            if key not in lookups:
+                lookups[key] = self.temporary_identifier()
+        if lookups:
+            self.writeline(' = '.join(sorted(lookups.values())) +
+                           ' = missing')
+        frame.render_cache = None
+        if visitor.renders:
+            frame.render_cache = self.temporary_identifier()
+            self.writeline('%s = {}' % frame.render_cache)
+
     def unoptimize_scope(self, frame):
         """Disable Python optimizations for the frame."""
         # XXX: this is not that nice but it has no real overhead.  It
@@ -723,10 +891,12 @@ class CodeGenerator(NodeVisitor):
         # and assigned.
         if 'forloop' in frame.identifiers.declared:
             args = args + ['l_forloop=l_forloop']
-        self.writeline('def macro(%s):' % ', '.join(args), node)
+        self.writeline('%s(%s):' % (self.func('macro'), ', '.join(args)),
+                       node)
         self.indent()
         self.buffer(frame)
         self.pull_locals(frame)
+        self.pull_template_lookups(node.body, frame)
         self.blockvisit(node.body, frame)
         self.return_buffer_contents(frame)
         self.outdent()
@@ -756,6 +926,23 @@ class CodeGenerator(NodeVisitor):
             rv += ' in ' + repr(self.name)
         return rv
 
+    def find_dependencies(self, node):
+        """Return a tuple with the names of the templates the template
+        extends, imports, includes, renders or loads as section with a
+        constant name.
+        """
+        from jinja2.meta import find_template_dependencies
+        rv = []
+        for template_name in find_template_dependencies(node):
+            if template_name is None:
+                continue
+            if self.name is not None:
+                template_name = self.environment.join_path(template_name,
+                                                           self.name)
+            if template_name not in rv:
+                rv.append(template_name)
+        return tuple(rv)
+
     # -- Statement Visitors
 
     def visit_Template(self, node, frame=None):
@@ -765,6 +952,9 @@ class CodeGenerator(NodeVisitor):
         from jinja2.runtime import __all__ as exported
         self.writeline('from __future__ import division')
         self.writeline('from jinja2.runtime import ' + ', '.join(exported))
+        if self.environment.is_async:
+            self.writeline('from jinja2.asyncsupport import auto_await, '
+                           'auto_to_seq, concat_async')
         if not unoptimize_before_dead_code:
             self.writeline('dummy = lambda *x: None')
 
@@ -772,18 +962,33 @@ class CodeGenerator(NodeVisitor):
         # environment into a local name
         envenv = not self.defer_init and ', environment=environment' or ''
 
+        # if the template extends a chain of constant parent templates we
+        # can compile the whole chain into this module.
+        flattened = None
+        if self.environment.flatten_extends:
+            flattened = self.flatten_extends(node, self.name, (self.name,))
+        if flattened is not None:
+            body, block_chains, self.inlined_templates = flattened
+        else:
+            body = node.body
+            block_chains = {}
+            for block in node.find_all(nodes.Block):
+                if block.name in block_chains:
+                    self.fail('block %r defined twice' % block.name,
+                              block.lineno)
+                block_chains[block.name] = [block]
+        for name, block_chain in iteritems(block_chains):
+            self.blocks[name] = block_chain[0]
+
         # do we have an extends tag at all?  If not, we can save some
         # overhead by just not processing any inheritance code.
-        have_extends = node.find(nodes.Extends) is not None
-
-        # find all blocks
-        for block in node.find_all(nodes.Block):
-            if block.name in self.blocks:
-                self.fail('block %r defined twice' % block.name, block.lineno)
-            self.blocks[block.name] = block
+        have_extends = flattened is None and \
+            node.find(nodes.Extends) is not None
 
         # find all imports and import them
-        for import_ in node.find_all(nodes.ImportedName):
+        imports = chain(body, *block_chains.values())
+        for import_ in chain.from_iterable(x.find_all(nodes.ImportedName)
+                                           for x in imports):
             if import_.importname not in self.import_aliases:
                 imp = import_.importname
                 self.import_aliases[imp] = alias = self.temporary_identifier()
@@ -794,60 +999,56 @@ class CodeGenerator(NodeVisitor):
                 else:
                     self.writeline('import %s as %s' % (imp, alias))
 
-        # add the load name
+        # add the load name and the templates this template is known to
+        # load, the loaders can prefetch their code.
         self.writeline('name = %r' % self.name)
+        dependencies = self.find_dependencies(node)
+        if dependencies:
+            self.writeline('dependencies = %r' % (dependencies,))
 
         # generate the root render function.
-        self.writeline('def root(context%s):' % envenv, extra=1)
+        frame = Frame(eval_ctx)
+        buffer_arg = self.render_function_buffer(frame)
+        self.writeline('%s(context%s%s):' % (self.func('root'), buffer_arg,
+                                             envenv), extra=1)
 
         # process the root
-        frame = Frame(eval_ctx)
-        frame.inspect(node.body)
+        frame.inspect(body)
         frame.toplevel = frame.rootlevel = True
         frame.require_output_check = have_extends and not self.has_known_extends
         self.indent()
+        self.start_render_function(frame)
         if have_extends:
             self.writeline('parent_template = None')
-        if 'self' in find_undeclared(node.body, ('self',)):
+        if 'self' in find_undeclared(body, ('self',)):
             frame.identifiers.add_special('self')
             self.writeline('l_self = TemplateReference(context)')
         self.pull_locals(frame)
-        self.pull_dependencies(node.body)
-        self.blockvisit(node.body, frame)
-        self.outdent()
+        self.pull_dependencies(body)
+        self.pull_template_lookups(body, frame)
+        self.blockvisit(body, frame)
 
         # make sure that the parent root is called.
         if have_extends:
             if not self.has_known_extends:
-                self.indent()
                 self.writeline('if parent_template is not None:')
-            self.indent()
-            self.writeline('for event in parent_template.'
-                           'root_render_func(context):')
-            self.indent()
-            self.writeline('yield event')
-            self.outdent(2 + (not self.has_known_extends))
-
-        # at this point we now have the blocks collected and can visit them too.
-        for name, block in iteritems(self.blocks):
-            block_frame = Frame(eval_ctx)
-            block_frame.inspect(block.body)
-            block_frame.block = name
-            self.writeline('def block_%s(context%s):' % (name, envenv),
-                           block, 1)
-            self.indent()
-            undeclared = find_undeclared(block.body, ('self', 'super'))
-            if 'self' in undeclared:
-                block_frame.identifiers.add_special('self')
-                self.writeline('l_self = TemplateReference(context)')
-            if 'super' in undeclared:
-                block_frame.identifiers.add_special('super')
-                self.writeline('l_super = context.super(%r, '
-                               'block_%s)' % (name, name))
-            self.pull_locals(block_frame)
-            self.pull_dependencies(block.body)
-            self.blockvisit(block.body, block_frame)
-            self.outdent()
+                self.indent()
+            self.write_render_call('parent_template.root_render_func',
+                                   'context', frame)
+            if not self.has_known_extends:
+                self.outdent()
+        self.end_render_function(frame)
+        self.outdent()
+
+        # at this point we now have the blocks collected and can visit them
+        # too.  Blocks of inlined parent templates are compiled into extra
+        # functions that the super() of the more derived block points to.
+        for name, block_chain in iteritems(block_chains):
+            funcs = ['block_%s' % name]
+            funcs.extend(self.temporary_identifier() for x in block_chain[1:])
+            for level, block in enumerate(block_chain):
+                self.block_function(name, block, funcs, level, eval_ctx,
+                                    envenv, flattened is not None)
 
         self.writeline('blocks = {%s}' % ', '.join('%r: block_%s' % (x, x)
                                                    for x in self.blocks),
@@ -857,6 +1058,109 @@ class CodeGenerator(NodeVisitor):
         self.writeline('debug_info = %r' % '&'.join('%s=%s' % x for x
                                                     in self.debug_info))
 
+        # remember which templates were inlined for the reload checks
+        if self.inlined_templates:
+            self.writeline('inlined_templates = %r' %
+                           (tuple(self.inlined_templates),))
+
+    def block_function(self, name, block, funcs, level, eval_ctx, envenv,
+                       flattened):
+        """Write the render function for one level of a block."""
+        block_frame = Frame(eval_ctx)
+        block_frame.inspect(block.body)
+        block_frame.block = name
+        buffer_arg = self.render_function_buffer(block_frame)
+        self.writeline('%s(context%s%s):' % (self.func(funcs[level]),
+                                             buffer_arg, envenv), block, 1)
+        self.indent()
+        self.start_render_function(block_frame)
+        undeclared = find_undeclared(block.body, ('self', 'super'))
+        if 'self' in undeclared:
+            block_frame.identifiers.add_special('self')
+            self.writeline('l_self = TemplateReference(context)')
+        if 'super' in undeclared:
+            block_frame.identifiers.add_special('super')
+            if not flattened:
+                self.writeline('l_super = context.super(%r, '
+                               'block_%s)' % (name, name))
+            elif level + 1 < len(funcs):
+                self.writeline('l_super = BlockReference(%r, context, '
+                               '(%s,), %d)' % (name, ', '.join(funcs),
+                                               level + 1))
+            else:
+                self.writeline('l_super = environment.undefined(%r, '
+                               'name=\'super\')' %
+                               ('there is no parent block called %r.' % name))
+        self.pull_locals(block_frame)
+        self.pull_dependencies(block.body)
+        self.pull_template_lookups(block.body, block_frame)
+        self.blockvisit(block.body, block_frame)
+        self.end_render_function(block_frame)
+        self.outdent()
+
+    def flatten_extends(self, node, name, seen):
+        """Resolve the chain of constant ``{% extends %}`` tags of a template
+        at compile time.  Returns a ``(body, block_chains, inlined)`` tuple
+        where `body` is the root body of the topmost template with the
+        top level code of the children before it, `block_chains` maps the
+        block names to the block nodes of all levels (most derived first)
+        and `inlined` is a list of ``(name, checksum)`` tuples for the parent
+        templates.  If the chain cannot be resolved `None` is returned and
+        the template is compiled as usual.
+        """
+        block_chains = {}
+        for block in node.find_all(nodes.Block):
+            if block.name in block_chains:
+                return None
+            block_chains[block.name] = [block]
+
+        all_extends = list(node.find_all(nodes.Extends))
+        if not all_extends:
+            return node.body, block_chains, []
+        extends = all_extends[0]
+        for idx, child in enumerate(node.body):
+            if child is extends:
+                break
+        else:
+            return None
+
+        # only templates that extend exactly one constant parent on the top
+        # level and that don't have any code after the extends tag that
+        # would be evaluated in the parent's context can be flattened.
+        before = node.body[:idx]
+        after = node.body[idx + 1:]
+        if len(all_extends) != 1 or \
+           not isinstance(extends.template, nodes.Const) or \
+           not isinstance(extends.template.value, string_types) or \
+           any(x.find(nodes.Block) is not None for x in before) or \
+           not all(isinstance(x, flattenable_nodes) for x in after):
+            return None
+
+        parent = extends.template.value
+        if name is not None:
+            parent = self.environment.join_path(parent, name)
+        loader = self.environment.loader
+        if loader is None or parent in seen:
+            return None
+        try:
+            source, filename, _ = loader.get_source(self.environment, parent)
+            parent_node = self.environment._parse(source, parent, filename)
+        except (TemplateNotFound, TemplateSyntaxError):
+            return None
+        if self.environment.optimized:
+            parent_node = optimize(parent_node, self.environment)
+
+        rv = self.flatten_extends(parent_node, parent, seen + (parent,))
+        if rv is None:
+            return None
+        parent_body, parent_chains, inlined = rv
+        for block_name, block_chain in iteritems(parent_chains):
+            block_chains.setdefault(block_name, []).extend(block_chain)
+        body = before + [x for x in after if not
+                         isinstance(x, (nodes.Output, nodes.Block))]
+        inlined.insert(0, (parent, template_checksum(source)))
+        return body + parent_body, block_chains, inlined
+
     def visit_Block(self, node, frame):
         """Call a block and register it for the template."""
         level = 1
@@ -870,11 +1174,14 @@ class CodeGenerator(NodeVisitor):
                 self.indent()
                 level += 1
         context = node.scoped and 'context.derived(locals())' or 'context'
-        self.writeline('for event in context.blocks[%r][0](%s):' % (
-                       node.name, context), node)
-        self.indent()
-        self.simple_write('event', frame)
-        self.outdent(level)
+        func = 'context.blocks[%r][0]' % node.name
+        # flattened templates call their own blocks directly unless they
+        # are rendered as the parent of a template extending them.
+        if self.inlined_templates and self.name is not None:
+            func = '(block_%s if context.name == name else %s)' % (
+                node.name, func)
+        self.write_render_call(func, context, frame, node)
+        self.outdent(level - 1)
 
     def visit_Extends(self, node, frame):
         """Calls the extender."""
@@ -923,14 +1230,64 @@ class CodeGenerator(NodeVisitor):
         # and now we have one more
         self.extends_so_far += 1
 
-    def _visit_Include(self, node, frame, fmt=None):
-        """Handles includes."""
+    def _visit_Include(self, node, frame, fmt=None, defer=False):
+        """Handles includes.  If `defer` is set, includes with context are
+        submitted to the section executor.
+        """
         if node.with_context:
             self.unoptimize_scope(frame)
         if node.ignore_missing:
             self.writeline('try:')
             self.indent()
 
+        self.write_template_lookup(node, frame, fmt)
+        if node.ignore_missing:
+            self.outdent()
+            self.writeline('except TemplateNotFound:')
+            self.indent()
+            self.writeline('pass')
+            self.outdent()
+            self.writeline('else:')
+            self.indent()
+
+        if node.with_context and defer:
+            self.simple_write('submit_section(environment, template, '
+                              'template.new_context(context.parent, True, '
+                              'locals()))', frame)
+        elif node.with_context:
+            self.write_render_call('template.root_render_func',
+                                   'template.new_context(context.parent, '
+                                   'True, locals())', frame)
+        elif frame.buffer is not None:
+            self.writeline('%s.extend(%s._body_stream)' %
+                           (frame.buffer, self.template_module('template')))
+        else:
+            self.writeline('for event in %s._body_stream:' %
+                           self.template_module('template'))
+            self.indent()
+            self.simple_write('event', frame)
+            self.outdent()
+
+        if node.ignore_missing:
+            self.outdent()
+
+    def template_module(self, template, context_args=None):
+        """Return the expression for the module of a template.  If
+        `context_args` are given, a new module is created with them.
+        """
+        if context_args is not None:
+            return '%s%s.make_module%s(%s)%s' % (
+                self.choose_async('(await '), template,
+                self.choose_async('_async'), context_args,
+                self.choose_async(')'))
+        if self.environment.is_async:
+            return '(await %s._get_default_module_async())' % template
+        return '%s.module' % template
+
+    def write_template_lookup(self, node, frame, fmt=None):
+        """Write the code that loads the template of an include-like node
+        into the `template` variable.
+        """
         func_name = 'get_or_select_template'
         if isinstance(node.template, nodes.Const):
             if isinstance(node.template.value, string_types):
@@ -940,55 +1297,94 @@ class CodeGenerator(NodeVisitor):
         elif isinstance(node.template, (nodes.Tuple, nodes.List)):
             func_name = 'select_template'
 
-        self.writeline('template = environment.%s(' % func_name, node)
+        # includes with a constant template name are only looked up the
+        # first time they are executed in the current function call.
+        lookup = None
+        if isinstance(node.template, nodes.Const):
+            lookup = frame.template_lookups.get(template_lookup_key(node))
+        if lookup is not None:
+            self.writeline('if %s is missing:' % lookup, node)
+            self.indent()
+            self.writeline('%s = environment.%s(' % (lookup, func_name))
+        else:
+            self.writeline('template = environment.%s(' % func_name, node)
         self.visit(node.template, frame)
         if fmt is not None:
             self.write(', %r, fmt="%s")' % (self.name, fmt))
         else:
             self.write(', %r)' % self.name)
-        if node.ignore_missing:
-            self.outdent()
-            self.writeline('except TemplateNotFound:')
-            self.indent()
-            self.writeline('pass')
+        if lookup is not None:
             self.outdent()
-            self.writeline('else:')
-            self.indent()
+            self.writeline('template = %s' % lookup)
 
-        if node.with_context:
-            self.writeline('for event in template.root_render_func('
-                           'template.new_context(context.parent, True, '
-                           'locals())):')
-        else:
-            self.writeline('for event in template.module._body_stream:')
+    def visit_Include(self, node, frame):
+        self._visit_Include(node, frame, fmt=SNIPPET_TEMPLATE_FORMAT)
 
-        self.indent()
-        self.simple_write('event', frame)
-        self.outdent()
+    def visit_Section(self, node, frame):
+        self._visit_Include(node, frame, fmt=SECTION_TEMPLATE_FORMAT,
+                            defer=self.can_defer(frame))
 
-        if node.ignore_missing:
-            self.outdent()
+    def visit_Render(self, node, frame):
+        """Renders a snippet in a new context that only contains the
+        globals and the arguments passed to the tag.  If all arguments are
+        immutable the output is memoized for the current function call.
+        """
+        self.write_template_lookup(node, frame, fmt=SNIPPET_TEMPLATE_FORMAT)
+        arguments = self.temporary_identifier()
+        self.writeline('%s = {' % arguments)
+        for idx, argument in enumerate(node.arguments):
+            if idx:
+                self.write(', ')
+            self.write('%r: ' % argument.key)
+            self.visit(argument.value, frame)
+        self.write('}')
 
-    def visit_Include(self, node, frame):
-        self._visit_Include(node, frame, fmt='snippets/{}.liquid')
+        output = self.temporary_identifier()
+        if self.can_defer(frame):
+            render = 'submit_section(environment, template, ' \
+                     'template.new_context(%s))' % arguments
+        elif self.defer_sections:
+            render = 'concat(resolve_events(template.root_render_func(' \
+                     'template.new_context(%s))))' % arguments
+        else:
+            render = '%s(template.root_render_func(template.new_context' \
+                     '(%s)))' % (self.choose_async('await concat_async',
+                                                   'concat'), arguments)
+        if frame.render_cache is None:
+            self.writeline('%s = %s' % (output, render))
+            self.simple_write(output, frame)
+            return
 
-    def visit_Section(self, node, frame):
-        self._visit_Include(node, frame, fmt='sections/{}.liquid')
+        key = self.temporary_identifier()
+        self.writeline('%s = make_render_key(template, %s)' %
+                       (key, arguments))
+        self.writeline('if %s in %s:' % (key, frame.render_cache))
+        self.indent()
+        self.simple_write('%s[%s]' % (frame.render_cache, key), frame)
+        self.outdent()
+        self.writeline('else:')
+        self.indent()
+        self.writeline('%s = %s' % (output, render))
+        self.writeline('if %s is not None:' % key)
+        self.indent()
+        self.writeline('%s[%s] = %s' % (frame.render_cache, key, output))
+        self.outdent()
+        self.simple_write(output, frame)
+        self.outdent()
 
     def visit_Import(self, node, frame):
         """Visit regular imports."""
         if node.with_context:
             self.unoptimize_scope(frame)
-        self.writeline('l_%s = ' % node.target, node)
+        self.writeline('template = environment.get_template(', node)
+        self.visit(node.template, frame)
+        self.write(', %r)' % self.name)
+        self.writeline('l_%s = ' % node.target)
         if frame.toplevel:
             self.write('context.vars[%r] = ' % node.target)
-        self.write('environment.get_template(')
-        self.visit(node.template, frame)
-        self.write(', %r).' % self.name)
-        if node.with_context:
-            self.write('make_module(context.parent, True, locals())')
-        else:
-            self.write('module')
+        self.write(self.template_module('template', node.with_context and
+                                        'context.parent, True, locals()' or
+                                        None))
         if frame.toplevel and not node.target.startswith('_'):
             self.writeline('context.exported_vars.discard(%r)' % node.target)
         frame.assigned_names.add(node.target)
@@ -998,11 +1394,10 @@ class CodeGenerator(NodeVisitor):
         self.newline(node)
         self.write('included_template = environment.get_template(')
         self.visit(node.template, frame)
-        self.write(', %r).' % self.name)
-        if node.with_context:
-            self.write('make_module(context.parent, True)')
-        else:
-            self.write('module')
+        self.write(', %r)' % self.name)
+        self.writeline('included_template = %s' % self.template_module(
+            'included_template', node.with_context and
+            'context.parent, True' or None))
 
         var_names = []
         discarded_names = []
@@ -1072,9 +1467,14 @@ class CodeGenerator(NodeVisitor):
 
         # otherwise we set up a buffer and add a function def
         else:
-            self.writeline('def loop(reciter, loop_render_func, depth=0):', node)
+            self.writeline('%s(reciter, loop_render_func, depth=0):' %
+                           self.func('loop'), node)
             self.indent()
+            if self.environment.is_async:
+                self.writeline('reciter = await auto_to_seq(reciter)')
             self.buffer(loop_frame)
+            self.pull_template_lookups(chain(node.body, node.else_),
+                                       loop_frame)
             aliases = {}
 
         # make sure the forloop variable is a special one and raise a template
@@ -1109,9 +1509,10 @@ class CodeGenerator(NodeVisitor):
         self.write(extended_loop and ', l_forloop in LoopContext(' or ' in ')
 
         # if we have an extened loop and a node test, we filter in the
-        # "outer frame".
+        # "outer frame".  In async mode the test can contain awaits which
+        # generator expressions do not support, a list is built instead.
         if extended_loop and node.test is not None:
-            self.write('(')
+            self.write(self.choose_async('[', '('))
             self.visit(node.target, loop_frame)
             self.write(' for ')
             self.visit(node.target, loop_frame)
@@ -1119,16 +1520,16 @@ class CodeGenerator(NodeVisitor):
             if node.recursive:
                 self.write('reciter')
             else:
-                self.visit(node.iter, loop_frame)
+                self.visit_loop_iter(node, loop_frame)
             self.write(' if (')
             test_frame = loop_frame.copy()
             self.visit(node.test, test_frame)
-            self.write('))')
+            self.write(self.choose_async(')]', '))'))
 
         elif node.recursive:
             self.write('reciter')
         else:
-            self.visit(node.iter, loop_frame)
+            self.visit_loop_iter(node, loop_frame)
 
         if node.recursive:
             self.write(', loop_render_func, depth):')
@@ -1167,11 +1568,22 @@ class CodeGenerator(NodeVisitor):
             self.return_buffer_contents(loop_frame)
             self.outdent()
             self.start_write(frame, node)
-            self.write('loop(')
+            self.write(self.choose_async('await loop(', 'loop('))
             self.visit(node.iter, frame)
             self.write(', loop)')
             self.end_write(frame)
 
+    def visit_loop_iter(self, node, frame):
+        """Write the iterable of a loop.  Async iterables are turned into
+        lists first in async mode.
+        """
+        if self.environment.is_async:
+            self.write('(await auto_to_seq(')
+            self.visit(node.iter, frame)
+            self.write('))')
+        else:
+            self.visit(node.iter, frame)
+
     def visit_If(self, node, frame):
         if_frame = frame.soft()
         self.writeline('if is_truthy(', node)
@@ -1539,9 +1951,11 @@ class CodeGenerator(NodeVisitor):
         self.visit(node.expr, frame)
 
     def visit_Getattr(self, node, frame):
+        self.write(self.choose_async('(await auto_await('))
         self.write('environment.getattr(')
         self.visit(node.node, frame)
         self.write(', %r)' % node.attr)
+        self.write(self.choose_async('))'))
 
     def visit_Getitem(self, node, frame):
         # slices bypass the environment getitem method.
@@ -1551,11 +1965,13 @@ class CodeGenerator(NodeVisitor):
             self.visit(node.arg, frame)
             self.write(']')
         else:
+            self.write(self.choose_async('(await auto_await('))
             self.write('environment.getitem(')
             self.visit(node.node, frame)
             self.write(', ')
             self.visit(node.arg, frame)
             self.write(')')
+            self.write(self.choose_async('))'))
 
     def visit_Slice(self, node, frame):
         if node.start is not None:
@@ -1568,6 +1984,7 @@ class CodeGenerator(NodeVisitor):
             self.visit(node.step, frame)
 
     def visit_Filter(self, node, frame):
+        self.write(self.choose_async('(await auto_await('))
         self.write(self.filters[node.name] + '(')
         func = self.environment.filters.get(node.name)
         if func is None:
@@ -1593,6 +2010,7 @@ class CodeGenerator(NodeVisitor):
             self.write('concat(%s)' % frame.buffer)
         self.signature(node, frame)
         self.write(')')
+        self.write(self.choose_async('))'))
 
     def visit_Test(self, node, frame):
         self.write(self.tests[node.name] + '(')
@@ -1619,6 +2037,7 @@ class CodeGenerator(NodeVisitor):
         self.write(')')
 
     def visit_Call(self, node, frame, forward_caller=False):
+        self.write(self.choose_async('(await auto_await('))
         if self.environment.sandboxed:
             self.write('environment.call(context, ')
         else:
@@ -1627,6 +2046,7 @@ class CodeGenerator(NodeVisitor):
         extra_kwargs = forward_caller and {'caller': 'caller'} or None
         self.signature(node, frame, extra_kwargs)
         self.write(')')
+        self.write(self.choose_async('))'))
 
     def visit_Keyword(self, node, frame):
         self.write(node.key + '=')
@@ -27,6 +27,11 @@ NEWLINE_SEQUENCE = '\n'
 KEEP_TRAILING_NEWLINE = False
 
 
+# template names used by the liquid tags that load other templates
+SNIPPET_TEMPLATE_FORMAT = 'snippets/{}.liquid'
+SECTION_TEMPLATE_FORMAT = 'sections/{}.liquid'
+
+
 # default filters, tests and namespace
 from jinja2.filters import FILTERS as DEFAULT_FILTERS
 from jinja2.tests import TESTS as DEFAULT_TESTS
@@ -8,9 +8,11 @@
     :copyright: (c) 2010 by the Jinja Team.
     :license: BSD, see LICENSE for more details.
 """
+import gc
 import os
 import sys
 import weakref
+from time import time
 from functools import reduce, partial
 from jinja2 import nodes
 from jinja2.defaults import BLOCK_START_STRING, \
@@ -24,11 +26,12 @@ from jinja2.parser import Parser
 from jinja2.nodes import EvalContext
 from jinja2.optimizer import optimize
 from jinja2.compiler import generate, CodeGenerator
-from jinja2.runtime import Undefined, new_context, Context
+from jinja2.runtime import Undefined, new_context, Context, resolve_events
 from jinja2.exceptions import TemplateSyntaxError, TemplateNotFound, \
      TemplatesNotFound, TemplateRuntimeError
-from jinja2.utils import import_string, LRUCache, Markup, missing, \
-     concat, consume, internalcode
+from jinja2.utils import import_string, LRUCache, ConcurrentLRUCache, \
+     Markup, missing, concat, consume, internalcode, have_async_gen, \
+     fork_pool, SingleFlight
 from jinja2._compat import imap, ifilter, string_types, iteritems, \
      text_type, reraise, implements_iterator, implements_to_string, \
      encode_filename, PY2, PYPY
@@ -41,6 +44,10 @@ _spontaneous_environments = LRUCache(10)
 # imported on the first exception in the exception handler.
 _make_traceback = None
 
+# the environment, template name and sink of `Environment.render_many` in
+# the worker processes.
+_render_many_job = None
+
 
 def get_spontaneous_environment(*args):
     """Return a new spontaneous environment.  A spontaneous environment is an
@@ -64,7 +71,7 @@ def create_cache(size):
         return None
     if size < 0:
         return {}
-    return LRUCache(size)
+    return ConcurrentLRUCache(size)
 
 
 def copy_cache(cache):
@@ -73,7 +80,7 @@ def copy_cache(cache):
         return None
     elif type(cache) is dict:
         return {}
-    return LRUCache(cache.capacity)
+    return cache.__class__(cache.capacity)
 
 
 def load_extensions(environment, extensions):
@@ -98,6 +105,8 @@ def _environment_sanity_check(environment):
         'start strings must be different'
     assert environment.newline_sequence in ('\r', '\r\n', '\n'), \
         'newline_sequence set to unknown line ending string.'
+    assert environment.render_mode in ('generator', 'buffer'), \
+        'render_mode set to unknown mode.'
     return environment
 
 
@@ -217,6 +226,62 @@ class Environment(object):
             have to be parsed if they were not changed.
 
             See :ref:`bytecode-cache` for more information.
+
+        `render_mode`
+            Controls how templates are compiled.  Per default (``'generator'``)
+            every render function is a generator and the output of blocks,
+            includes and sections is yielded again by every function that
+            calls them.  If set to ``'buffer'`` all render functions append
+            to one list that is passed down the call chain and joined once
+            by :meth:`Template.render`.  This is faster for deeply nested
+            layouts, but :meth:`Template.generate` and
+            :meth:`Template.stream` only start producing output after the
+            whole template was rendered.  Templates precompiled for the
+            :class:`ModuleLoader` must use the same mode.
+
+            .. versionadded:: 2.9
+
+        `flatten_extends`
+            If set to ``True`` templates that extend a chain of parent
+            templates with constant names are compiled into a single module
+            together with their parents.  The parents are no longer loaded
+            at render time and blocks are called directly.  Auto reloading
+            checks all templates of the chain.  Tracebacks for errors in
+            the inlined parents report the file name of the child template.
+            If the chain can't be resolved at compile time (for example
+            because the name of a parent is a variable) the template is
+            compiled as usual.
+
+            .. versionadded:: 2.9
+
+        `enable_async`
+            If set to ``True`` the templates are compiled into coroutines
+            and can be rendered with :meth:`Template.render_async`.  Calls,
+            filters and attribute lookups that return awaitables are awaited
+            and loops accept async iterables.  This requires Python 3.6 or
+            later, on older versions the flag is ignored.
+
+            .. versionadded:: 2.9
+
+        `section_executor`
+            An executor from :mod:`concurrent.futures` (or any object with a
+            compatible `submit` method).  If set, sections and render tags
+            are submitted to the executor when they are reached and the
+            template continues to render.  Their output is put back in place
+            when the template output is joined, exceptions are raised when
+            the failed section is reached in document order.  Sections
+            inside of macros, call blocks and captures as well as sections
+            reached by a section are rendered in place.  The data passed to
+            the templates must be safe to use from multiple threads.  This
+            is ignored in async mode.
+
+            .. versionadded:: 2.9
+
+        `section_concurrency`
+            The maximum number of sections a render submits to the
+            `section_executor` at the same time.  ``None`` means no limit.
+
+            .. versionadded:: 2.9
     """
 
     #: if this environment is sandboxed.  Modifying this variable won't make
@@ -268,7 +333,12 @@ class Environment(object):
                  loader=None,
                  cache_size=400,
                  auto_reload=True,
-                 bytecode_cache=None):
+                 bytecode_cache=None,
+                 render_mode='generator',
+                 flatten_extends=False,
+                 enable_async=False,
+                 section_executor=None,
+                 section_concurrency=None):
         # !!Important notice!!
         #   The constructor accepts quite a few arguments that should be
         #   passed by keyword rather than position.  However it's important to
@@ -299,6 +369,12 @@ class Environment(object):
         self.optimized = optimized
         self.finalize = finalize
         self.autoescape = autoescape
+        self.render_mode = render_mode
+        self.flatten_extends = flatten_extends
+        self.enable_async = enable_async
+        self.is_async = enable_async and have_async_gen
+        self.section_executor = section_executor
+        self.section_concurrency = section_concurrency
 
         # defaults
         self.filters = DEFAULT_FILTERS.copy()
@@ -310,6 +386,7 @@ class Environment(object):
         self.cache = create_cache(cache_size)
         self.bytecode_cache = bytecode_cache
         self.auto_reload = auto_reload
+        self._load_flights = SingleFlight()
 
         # load extensions
         self.extensions = load_extensions(self, extensions)
@@ -340,7 +417,9 @@ class Environment(object):
                 extensions=missing, optimized=missing,
                 undefined=missing, finalize=missing, autoescape=missing,
                 loader=missing, cache_size=missing, auto_reload=missing,
-                bytecode_cache=missing):
+                bytecode_cache=missing, render_mode=missing,
+                flatten_extends=missing, enable_async=missing,
+                section_executor=missing, section_concurrency=missing):
         """Create a new overlay environment that shares all the data with the
         current environment except for cache and the overridden attributes.
         Extensions cannot be removed for an overlayed environment.  An overlayed
@@ -363,11 +442,14 @@ class Environment(object):
         for key, value in iteritems(args):
             if value is not missing:
                 setattr(rv, key, value)
+        if enable_async is not missing:
+            rv.is_async = enable_async and have_async_gen
 
         if cache_size is not missing:
             rv.cache = create_cache(cache_size)
         else:
             rv.cache = copy_cache(self.cache)
+        rv._load_flights = SingleFlight()
 
         rv.extensions = {}
         for key, value in iteritems(self.extensions):
@@ -470,6 +552,24 @@ class Environment(object):
         """Internal parsing function used by `parse` and `compile`."""
         return Parser(self, source, name, encode_filename(filename)).parse()
 
+    def parse_incremental(self, source, name=None, filename=None):
+        """Parse the sourcecode like :meth:`parse` but return a
+        :class:`~jinja2.incremental.TemplateDocument` with the abstract
+        syntax tree as :attr:`~jinja2.incremental.TemplateDocument.ast`.
+        Edits of the document only tokenize and parse the changed parts of
+        the template again, which keeps the live preview of large templates
+        in an editor fast.
+
+        .. versionadded:: 2.9
+        """
+        from jinja2.incremental import TemplateDocument
+        try:
+            return TemplateDocument(self, source, name,
+                                    encode_filename(filename))
+        except TemplateSyntaxError:
+            exc_info = sys.exc_info()
+        self.handle_exception(exc_info, source_hint=source)
+
     def lex(self, source, name=None, filename=None):
         """Lex the given sourcecode and return a generator that yields
         tokens as tuples in the form ``(lineno, token_type, value)``.
@@ -610,6 +710,77 @@ class Environment(object):
         template = self.from_string(nodes.Template(body, lineno=1))
         return TemplateExpression(template, undefined_to_none)
 
+    def render_many(self, name, contexts, workers=None, chunksize=64,
+                    ordered=True, sink=None, encoding='utf-8'):
+        """Render the template `name` once for every dict in the iterable
+        `contexts` and return an iterator over the results.  The template
+        and all templates it includes, extends or imports are compiled
+        first, then `workers` processes (per default one per CPU) are forked
+        that share the compiled code with the current process.  The contexts
+        are sent to the workers in chunks of `chunksize` contexts, they must
+        be picklable.
+
+        Per default the rendered strings are returned in the order of the
+        contexts.  If `ordered` is `False` they are returned as soon as they
+        are ready as ``(index, output)`` tuples.
+
+        If a `sink` is given the workers write the output into files
+        instead of sending it back.  The sink is called with the index and
+        the context and returns the filename, the results are the filenames
+        then.  The files are written with the given `encoding`.
+
+        >>> contexts = ({'user': user} for user in users)
+        >>> for filename in env.render_many('mail.html', contexts,
+        ...     sink=lambda idx, ctx: 'out/%d.html' % idx):
+        ...     pass
+
+        On platforms without ``fork`` or with a single worker the templates
+        are rendered in the current process.
+
+        .. versionadded:: 2.9
+        """
+        from jinja2.meta import DependencyGraph
+        self.get_template(name)
+        for template_name in DependencyGraph(self).closure(name):
+            try:
+                self.get_template(template_name)
+            except TemplateNotFound:
+                pass
+        if workers is None:
+            from multiprocessing import cpu_count
+            workers = cpu_count()
+        job = (self, name, sink, encoding)
+        return self._render_many(job, contexts, workers, chunksize, ordered)
+
+    def _render_many(self, job, contexts, workers, chunksize, ordered):
+        # the workers are forked when the iteration starts so that they are
+        # always terminated when the iterator is closed or collected.
+        pool = None
+        if workers > 1:
+            pool = fork_pool(workers, _init_render_many_worker, (job,))
+        if pool is None:
+            for item in enumerate(contexts):
+                rv = _render_many_item(item, job)
+                if ordered:
+                    yield rv
+                else:
+                    yield item[0], rv
+            return
+        try:
+            if ordered:
+                for index, rv in pool.imap(_render_many_worker,
+                                           enumerate(contexts), chunksize):
+                    yield rv
+            else:
+                for item in pool.imap_unordered(_render_many_worker,
+                                                enumerate(contexts),
+                                                chunksize):
+                    yield item
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
     def compile_templates(self, target, extensions=None, filter_func=None,
                           zip='deflated', log_function=None,
                           ignore_errors=True, py_compile=False):
@@ -732,6 +903,123 @@ class Environment(object):
             x = list(ifilter(filter_func, x))
         return x
 
+    def build_dependency_graph(self, extensions=None, filter_func=None):
+        """Returns a :class:`~jinja2.meta.DependencyGraph` of the templates
+        returned by :meth:`list_templates`, the arguments are the same.  The
+        graph knows which templates have to be compiled again if a template
+        changed and :meth:`~jinja2.meta.DependencyGraph.invalidate` only
+        removes these templates from the cache:
+
+        >>> graph = env.build_dependency_graph(extensions=['liquid'])
+        >>> sorted(graph.invalidate('snippets/price.liquid'))
+        ['product.liquid', 'snippets/price.liquid']
+
+        .. versionadded:: 2.9
+        """
+        from jinja2.meta import DependencyGraph
+        return DependencyGraph(self).build(
+            self.list_templates(extensions, filter_func))
+
+    def preload(self, names=None, extensions=None, filter_func=None,
+                freeze=True, ignore_errors=True, log_function=None,
+                trace_memory=False):
+        """Compiles the templates with the given `names` into the template
+        cache so that worker processes forked afterwards share the compiled
+        code instead of compiling it again.  If no names are given all the
+        templates returned by :meth:`list_templates` are loaded, `extensions`
+        and `filter_func` are passed to it.  The template cache is enlarged
+        if it cannot hold all the templates.
+
+        If `freeze` is `True` (the default) the garbage collector is run and
+        all objects are moved into the permanent generation with
+        :func:`gc.freeze` where available (Python 3.7 and later) so that the
+        collector in the forked workers does not touch and copy their pages.
+
+        If `trace_memory` is `True` the memory allocated for the templates
+        is measured with :mod:`tracemalloc` (Python 3.4 and later).  Tracing
+        slows the compilation down considerably, so it is off by default and
+        the memory is only reported if tracing was started before.
+
+        Templates with syntax errors are skipped and logged to the
+        `log_function` unless `ignore_errors` is `False`.  Loaded templates
+        that are no longer in the template cache afterwards, because the
+        cache evicted them, are logged as well.  Returns a
+        :class:`PreloadReport`:
+
+        >>> report = env.preload(extensions=['liquid'], trace_memory=True)
+        >>> report
+        <PreloadReport 120 templates, 0 errors, 0.84s, 14.2MB>
+
+        .. versionadded:: 2.9
+        """
+        if log_function is None:
+            log_function = lambda x: None
+        if names is None:
+            names = self.list_templates(extensions, filter_func)
+        names = list(names)
+
+        size = len(names)
+        if self.cache is not None:
+            size += len(self.cache)
+        if self.cache is None or getattr(self.cache, 'capacity', size) < size:
+            cache = ConcurrentLRUCache(size)
+            if self.cache is not None:
+                for key, value in reversed(self.cache.items()):
+                    cache[key] = value
+            self.cache = cache
+            log_function('Resized template cache to %d templates' % size)
+
+        try:
+            import tracemalloc
+        except ImportError:
+            tracemalloc = None
+        else:
+            if not trace_memory and not tracemalloc.is_tracing():
+                tracemalloc = None
+        tracing = tracemalloc is not None and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        try:
+            memory = None
+            if tracemalloc is not None:
+                memory = tracemalloc.get_traced_memory()[0]
+            started = time()
+            templates = []
+            errors = {}
+            for name in names:
+                try:
+                    self.get_template(name)
+                except (TemplateSyntaxError, TemplateNotFound) as e:
+                    if not ignore_errors:
+                        raise
+                    log_function('Could not load "%s": %s' % (name, e))
+                    errors[name] = e
+                else:
+                    templates.append(name)
+            seconds = time() - started
+            if tracemalloc is not None:
+                memory = tracemalloc.get_traced_memory()[0] - memory
+        finally:
+            if tracing:
+                tracemalloc.stop()
+
+        evicted = [name for name in templates
+                   if (weakref.ref(self.loader), name) not in self.cache]
+        if evicted:
+            log_function('%d preloaded templates were evicted from the '
+                         'template cache' % len(evicted))
+
+        frozen = False
+        if freeze:
+            gc.collect()
+            if hasattr(gc, 'freeze'):
+                gc.freeze()
+                frozen = True
+        rv = PreloadReport(templates, errors, seconds, memory, frozen,
+                           evicted)
+        log_function('Finished preloading templates: %r' % rv)
+        return rv
+
     def handle_exception(self, exc_info=None, rendered=False, source_hint=None):
         """Exception handling helper.  This is used internally to either raise
         rewritten exceptions or return a rendered traceback for the template.
@@ -770,14 +1058,31 @@ class Environment(object):
     def _load_template(self, name, globals):
         if self.loader is None:
             raise TypeError('no loader for this environment specified')
+        if self.cache is None:
+            return self.loader.load(self, name, globals)
         cache_key = (weakref.ref(self.loader), name)
-        if self.cache is not None:
-            template = self.cache.get(cache_key)
-            if template is not None and (not self.auto_reload or
-                                         template.is_up_to_date):
-                return template
-        template = self.loader.load(self, name, globals)
-        if self.cache is not None:
+        template = self._get_cached_template(cache_key)
+        if template is not None:
+            return template
+
+        # threads that miss the cache at the same time wait for the first
+        # one to load the template instead of compiling it too.
+        return self._load_flights.do(
+            cache_key, partial(self._load_uncached_template, cache_key,
+                               name, globals))
+
+    def _get_cached_template(self, cache_key):
+        template = self.cache.get(cache_key)
+        if template is not None and (not self.auto_reload or
+                                     template.is_up_to_date):
+            return template
+
+    def _load_uncached_template(self, cache_key, name, globals):
+        # a flight that just finished might have cached the template after
+        # this thread missed the cache.
+        template = self._get_cached_template(cache_key)
+        if template is None:
+            template = self.loader.load(self, name, globals)
             self.cache[cache_key] = template
         return template
 
@@ -866,6 +1171,66 @@ class Environment(object):
         return dict(self.globals, **d)
 
 
+class PreloadReport(object):
+    """The result of :meth:`Environment.preload`.  `templates` is the list
+    of loaded template names and `errors` maps the names of the templates
+    that could not be loaded to the exception.  `seconds` is the time it took
+    to compile the templates and `memory` the number of bytes allocated for
+    them (`None` if memory was not traced).  `frozen` tells if
+    the objects were moved into the permanent generation of the garbage
+    collector.  `evicted` is the list of loaded templates that were evicted
+    from the template cache again.
+
+    .. versionadded:: 2.9
+    """
+
+    def __init__(self, templates, errors, seconds, memory, frozen,
+                 evicted=()):
+        self.templates = templates
+        self.errors = errors
+        self.seconds = seconds
+        self.memory = memory
+        self.frozen = frozen
+        self.evicted = list(evicted)
+
+    def __repr__(self):
+        memory = ''
+        if self.memory is not None:
+            memory = ', %.1fMB' % (self.memory / 1048576.0)
+        return '<%s %d templates, %d errors, %.2fs%s>' % (
+            self.__class__.__name__,
+            len(self.templates),
+            len(self.errors),
+            self.seconds,
+            memory
+        )
+
+
+def _render_many_item(item, job):
+    """Render one context of :meth:`Environment.render_many`."""
+    environment, name, sink, encoding = job
+    index, context = item
+    rv = environment.get_template(name).render(context)
+    if sink is None:
+        return rv
+    filename = sink(index, context)
+    with open(filename, 'wb') as f:
+        f.write(rv.encode(encoding))
+    return filename
+
+
+def _init_render_many_worker(job):
+    global _render_many_job
+    _render_many_job = job
+
+
+def _render_many_worker(item):
+    """The function the worker processes of :meth:`Environment.render_many`
+    run.  The job was inherited from the parent process.
+    """
+    return item[0], _render_many_item(item, _render_many_job)
+
+
 class Template(object):
     """The central template object.  This class represents a compiled template
     and is used to evaluate it.
@@ -913,24 +1278,35 @@ class Template(object):
                 optimized=True,
                 undefined=Undefined,
                 finalize=None,
-                autoescape=False):
+                autoescape=False,
+                render_mode='generator',
+                enable_async=False):
         env = get_spontaneous_environment(
             block_start_string, block_end_string, variable_start_string,
             variable_end_string, comment_start_string, comment_end_string,
             line_statement_prefix, line_comment_prefix, trim_blocks,
             lstrip_blocks, newline_sequence, keep_trailing_newline,
             frozenset(extensions), optimized, undefined, finalize, autoescape,
-            None, 0, False, None)
+            None, 0, False, None, render_mode, False, enable_async)
         return env.from_string(source, template_class=cls)
 
     @classmethod
-    def from_code(cls, environment, code, globals, uptodate=None):
+    def from_code(cls, environment, code, globals, uptodate=None,
+                  filename=None):
         """Creates a template object from compiled code and the globals.  This
         is used by the loaders and environment to create a template object.
+        The `filename` defaults to the filename the code was compiled with.
+
+        .. versionchanged:: 2.9
+           The `filename` parameter was added.
         """
+        if filename is None:
+            filename = code.co_filename
+        else:
+            filename = encode_filename(filename)
         namespace = {
             'environment':  environment,
-            '__file__':     code.co_filename
+            '__file__':     filename
         }
         exec(code, namespace)
         rv = cls._from_namespace(environment, namespace, globals)
@@ -955,6 +1331,11 @@ class Template(object):
         t.filename = namespace['__file__']
         t.blocks = namespace['blocks']
 
+        # the parent templates compiled into this one by flatten_extends
+        # and the templates it loads with a constant name
+        t.inlined_templates = namespace.get('inlined_templates', ())
+        t.dependencies = namespace.get('dependencies', ())
+
         # render function and module
         t.root_render_func = namespace['root']
         t._module = None
@@ -981,11 +1362,29 @@ class Template(object):
         """
         vars = dict(*args, **kwargs)
         try:
-            return concat(self.root_render_func(self.new_context(vars)))
+            events = self.root_render_func(self.new_context(vars))
+            if self.environment.section_executor is not None:
+                events = resolve_events(events, new_render=True)
+            return concat(events)
         except Exception:
             exc_info = sys.exc_info()
         return self.environment.handle_exception(exc_info, True)
 
+    def render_async(self, *args, **kwargs):
+        """This works similar to :meth:`render` but returns a coroutine
+        that when awaited returns the entire rendered template string.  This
+        requires the async feature to be enabled.
+
+        Example usage::
+
+            await template.render_async(knights='that say nih; asynchronously')
+
+        .. versionadded:: 2.9
+        """
+        # see asyncsupport for the actual implementation
+        raise NotImplementedError('This feature is not available for this '
+                                  'version of Python')
+
     def stream(self, *args, **kwargs):
         """Works exactly like :meth:`generate` but returns a
         :class:`TemplateStream`.
@@ -1002,7 +1401,10 @@ class Template(object):
         """
         vars = dict(*args, **kwargs)
         try:
-            for event in self.root_render_func(self.new_context(vars)):
+            events = self.root_render_func(self.new_context(vars))
+            if self.environment.section_executor is not None:
+                events = resolve_events(events, new_render=True)
+            for event in events:
                 yield event
         except Exception:
             exc_info = sys.exc_info()
@@ -1010,6 +1412,27 @@ class Template(object):
             return
         yield self.environment.handle_exception(exc_info, True)
 
+    def generate_async(self, *args, **kwargs):
+        """An async version of :meth:`generate`.  Works very similarly but
+        returns an async iterator instead.
+
+        .. versionadded:: 2.9
+        """
+        # see asyncsupport for the actual implementation
+        raise NotImplementedError('This feature is not available for this '
+                                  'version of Python')
+
+    def stream_async(self, *args, **kwargs):
+        """An async version of :meth:`stream`.  Returns an
+        :class:`~jinja2.asyncsupport.AsyncTemplateStream` that is iterated
+        with ``async for``.
+
+        .. versionadded:: 2.9
+        """
+        # see asyncsupport for the actual implementation
+        raise NotImplementedError('This feature is not available for this '
+                                  'version of Python')
+
     def new_context(self, vars=None, shared=False, locals=None):
         """Create a new :class:`Context` for this template.  The vars
         provided will be passed to the template.  Per default the globals
@@ -1030,6 +1453,24 @@ class Template(object):
         """
         return TemplateModule(self, self.new_context(vars, shared, locals))
 
+    def make_module_async(self, vars=None, shared=False, locals=None):
+        """As template module creation can invoke template code for
+        asynchronous exections this method must be used instead of the
+        normal :meth:`make_module` one.  Likewise the module attribute
+        becomes unavailable in async mode.
+
+        .. versionadded:: 2.9
+        """
+        # see asyncsupport for the actual implementation
+        raise NotImplementedError('This feature is not available for this '
+                                  'version of Python')
+
+    def _get_default_module(self):
+        if self._module is not None:
+            return self._module
+        self._module = rv = self.make_module()
+        return rv
+
     @property
     def module(self):
         """The template as module.  This is used for imports in the
@@ -1041,11 +1482,10 @@ class Template(object):
         '23'
         >>> t.module.foo() == u'42'
         True
+
+        This attribute is not available if async mode is enabled.
         """
-        if self._module is not None:
-            return self._module
-        self._module = rv = self.make_module()
-        return rv
+        return self._get_default_module()
 
     def get_corresponding_lineno(self, lineno):
         """Return the source line number of a line number in the
@@ -1084,8 +1524,13 @@ class TemplateModule(object):
     converting it into an unicode- or bytestrings renders the contents.
     """
 
-    def __init__(self, template, context):
-        self._body_stream = list(template.root_render_func(context))
+    def __init__(self, template, context, body_stream=None):
+        if body_stream is None:
+            body_stream = template.root_render_func(context)
+            if template.environment.section_executor is not None:
+                body_stream = resolve_events(body_stream)
+            body_stream = list(body_stream)
+        self._body_stream = body_stream
         self.__dict__.update(context.get_exported())
         self.__name__ = template.name
 
@@ -57,6 +57,9 @@ class TemplateNotFound(IOError, LookupError, TemplateError):
         self.name = name
         self.templates = [name]
 
+    def __reduce__(self):
+        return self.__class__, (self.name, self.message)
+
     def __str__(self):
         return self.message
 
@@ -76,6 +79,9 @@ class TemplatesNotFound(TemplateNotFound):
         TemplateNotFound.__init__(self, names and names[-1] or None, message)
         self.templates = list(names)
 
+    def __reduce__(self):
+        return self.__class__, (self.templates, self.message)
+
 
 @implements_to_string
 class TemplateSyntaxError(TemplateError):
@@ -92,6 +98,12 @@ class TemplateSyntaxError(TemplateError):
         # function translated the syntax error into a new traceback
         self.translated = False
 
+    def __reduce__(self):
+        # exceptions are pickled when they are sent back by the worker
+        # processes of `Environment.render_many`.
+        return self.__class__, (self.message, self.lineno, self.name,
+                                self.filename), self.__dict__
+
     def __str__(self):
         # for translated errors we only return the message
         if self.translated:
@@ -19,8 +19,9 @@ from jinja2.defaults import BLOCK_START_STRING, \
 from jinja2.environment import Environment
 from jinja2.runtime import concat
 from jinja2.exceptions import TemplateAssertionError, TemplateSyntaxError
+from jinja2.fragmentcache import MemoryFragmentCache
 from jinja2.utils import contextfunction, import_string, Markup
-from jinja2._compat import with_metaclass, string_types, iteritems
+from jinja2._compat import with_metaclass, string_types, iteritems, text_type
 
 
 # the only real useful gettext functions for a Jinja template.  Note
@@ -445,6 +446,50 @@ class AutoEscapeExtension(Extension):
         return nodes.Scope([node])
 
 
+class FragmentCacheExtension(Extension):
+    """Adds a ``{% cache key, timeout %}`` tag that caches the rendered
+    body under the given key.  The timeout in seconds is optional.  The
+    fragments are stored in the `fragment_cache` attribute of the
+    environment, per default a
+    :class:`~jinja2.fragmentcache.MemoryFragmentCache` with room for 1000
+    fragments.  The `fragment_cache_prefix` is put in front of every key.
+
+    .. versionadded:: 2.9
+    """
+    tags = set(['cache'])
+
+    def __init__(self, environment):
+        Extension.__init__(self, environment)
+        environment.extend(
+            fragment_cache_prefix='',
+            fragment_cache=MemoryFragmentCache()
+        )
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [nodes.Const(parser.name), nodes.ContextReference(),
+                parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache_support', args),
+                               [], [], body).set_lineno(lineno)
+
+    def _cache_support(self, name, context, key, timeout, caller):
+        """Return the cached fragment or render it with `caller`.  The key
+        is remembered for the template that contains the tag and the one
+        that is rendered, blocks of the latter can end up in the fragment.
+        """
+        key = self.environment.fragment_cache_prefix + text_type(key)
+        templates = set(x for x in (name, context.name) if x is not None)
+        cache = self.environment.fragment_cache
+        if self.environment.is_async:
+            return cache.get_or_render_async(key, timeout, caller, templates)
+        return cache.get_or_render(key, timeout, caller, templates)
+
+
 def extract_from_ast(node, gettext_functions=GETTEXT_FUNCTIONS,
                      babel_style=True):
     """Extract localizable strings from the given template node.  Per
@@ -634,3 +679,4 @@ do = ExprStmtExtension
 loopcontrols = LoopControlExtension
 with_ = WithExtension
 autoescape = AutoEscapeExtension
+cache = FragmentCacheExtension
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""
+    jinja2.fragmentcache
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Storage backends for the ``{% cache %}`` tag of the
+    :class:`~jinja2.ext.FragmentCacheExtension`.  A fragment cache stores
+    rendered parts of templates under a key for a limited time.
+
+    :copyright: (c) 2010 by the Jinja Team.
+    :license: BSD.
+"""
+from os import path, listdir
+import os
+import struct
+import fnmatch
+import tempfile
+from hashlib import sha1
+from threading import Event, Lock
+from time import time
+from jinja2.bccache import get_default_cache_dir
+from jinja2.utils import ConcurrentLRUCache, Markup, open_if_exists
+from jinja2._compat import text_type
+
+
+class _Flight(object):
+    """A fragment that is currently rendered by one of the threads."""
+    __slots__ = ('done', 'value')
+
+    def __init__(self):
+        self.done = Event()
+        self.value = None
+
+
+class FragmentCache(object):
+    """Baseclass for fragment caches.  Subclasses have to implement
+    :meth:`get` and :meth:`set` and can implement :meth:`delete` and
+    :meth:`clear`.
+
+    The cache keeps track of the number of hits and misses in the `hits`
+    and `misses` attributes.  If multiple threads miss the same key at the
+    same time only one of them renders the fragment, the others wait for
+    the result.  The keys of the stored fragments are remembered per
+    template so that :meth:`delete_templates` can remove the fragments of
+    changed templates.  Subclasses call :meth:`forget` for fragments they
+    remove, the keys of fragments that disappear otherwise, for example
+    because they were evicted, are dropped from time to time.
+
+    .. versionadded:: 2.9
+    """
+
+    def __init__(self, default_timeout=None):
+        self.default_timeout = default_timeout
+        self.hits = 0
+        self.misses = 0
+        self._flights = {}
+        self._flights_lock = Lock()
+        self._template_keys = {}
+        self._key_templates = {}
+        self._check_keys_at = 64
+        self._async_flights = {}
+
+    def get(self, key):
+        """Return the fragment stored under `key` or `None` if there is no
+        fragment or it expired.
+        """
+        raise NotImplementedError()
+
+    def set(self, key, value, timeout=None):
+        """Store a fragment for `timeout` seconds.  If the timeout is `None`
+        the default timeout of the cache is used, if that is `None` too the
+        fragment does not expire.
+        """
+        raise NotImplementedError()
+
+    def delete(self, key):
+        """Remove the fragment stored under `key`."""
+
+    def contains(self, key):
+        """Check if a fragment is stored under `key`.  Used to drop the
+        keys of evicted fragments.
+        """
+        return self.get(key) is not None
+
+    def clear(self):
+        """Remove all fragments from the cache."""
+        with self._flights_lock:
+            self._template_keys.clear()
+            self._key_templates.clear()
+
+    def _get_expiry(self, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        if timeout is None:
+            return None
+        return time() + timeout
+
+    def delete_templates(self, names):
+        """Remove the fragments rendered by the templates with the given
+        names.  Only fragments rendered by this process are known.
+        """
+        with self._flights_lock:
+            keys = set()
+            for name in names:
+                keys.update(self._template_keys.pop(name, ()))
+        for key in keys:
+            self.delete(key)
+
+    def _remember_templates(self, key, templates):
+        """Remember the templates of a fragment that was just stored."""
+        if not templates:
+            return
+        with self._flights_lock:
+            known = self._key_templates.get(key, ())
+            new = tuple(x for x in templates if x not in known)
+            if new:
+                self._key_templates[key] = known + new
+                for name in new:
+                    self._template_keys.setdefault(name, set()).add(key)
+            check = len(self._key_templates) >= self._check_keys_at
+        if check:
+            self.forget([key for key in list(self._key_templates)
+                         if not self.contains(key)])
+            with self._flights_lock:
+                self._check_keys_at = max(2 * len(self._key_templates), 64)
+
+    def forget(self, keys):
+        """Drop the remembered templates of fragments that were removed."""
+        with self._flights_lock:
+            for key in keys:
+                for name in self._key_templates.pop(key, ()):
+                    template_keys = self._template_keys.get(name)
+                    if template_keys is not None:
+                        template_keys.discard(key)
+                        if not template_keys:
+                            del self._template_keys[name]
+
+    def get_or_render(self, key, timeout, render, templates=()):
+        """Return the fragment for `key` or call `render` to create it and
+        store the result.  `templates` are the names of the templates the
+        fragment is rendered by.
+        """
+        rv = self.get(key)
+        if rv is not None:
+            self.hits += 1
+            return rv
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        # another thread is already rendering the fragment, wait for it.
+        # if it fails we try on our own.
+        if not leader:
+            flight.done.wait()
+            if flight.value is not None:
+                self.hits += 1
+                return flight.value
+            return render()
+
+        self.misses += 1
+        try:
+            rv = render()
+            self.set(key, rv, timeout)
+            self._remember_templates(key, templates)
+            flight.value = rv
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.done.set()
+        return rv
+
+    def get_or_render_async(self, key, timeout, render, templates=()):
+        """Like :meth:`get_or_render` but returns a coroutine.  `render` may
+        return an awaitable.  Requires the async support of Jinja2.
+        """
+        # see asyncsupport for the actual implementation
+        raise NotImplementedError('This feature is not available for this '
+                                  'version of Python')
+
+
+class MemoryFragmentCache(FragmentCache):
+    """Stores fragments in memory.  At most `capacity` fragments are kept,
+    if more are added the least recently used ones are removed.  Expired
+    fragments are removed when they are accessed.
+
+    >>> cache = MemoryFragmentCache(capacity=1000, default_timeout=300)
+
+    .. versionadded:: 2.9
+    """
+
+    def __init__(self, capacity=1000, default_timeout=None):
+        FragmentCache.__init__(self, default_timeout)
+        self.capacity = capacity
+        self._cache = ConcurrentLRUCache(capacity)
+
+    def get(self, key):
+        item = self._cache.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires is not None and expires <= time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, timeout=None):
+        self._cache[key] = (self._get_expiry(timeout), value)
+
+    def delete(self, key):
+        try:
+            del self._cache[key]
+        except KeyError:
+            pass
+        self.forget([key])
+
+    def contains(self, key):
+        return key in self._cache
+
+    def clear(self):
+        FragmentCache.clear(self)
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+
+class FileSystemFragmentCache(FragmentCache):
+    """Stores fragments as files in a directory so that they are shared by
+    all processes using the same directory, for example the forked workers
+    of an application server.  Files are replaced atomically so readers
+    never see partially written fragments.
+
+    If no directory is given the default cache directory of the
+    :class:`~jinja2.FileSystemBytecodeCache` is used.  The `pattern` works
+    like the one of the bytecode cache, ``%s`` is replaced with a hash of
+    the key.  Once more than `threshold` fragments and a margin of ten
+    percent are stored, the expired and then the oldest fragments are
+    removed until ten percent less than `threshold` are left.  The
+    directory is only counted every tenth of `threshold` writes, so most
+    writes don't touch the other files.
+
+    >>> cache = FileSystemFragmentCache('/tmp/fragments', threshold=5000)
+
+    .. versionadded:: 2.9
+    """
+
+    _header = struct.Struct('>d?')
+
+    def __init__(self, directory=None, default_timeout=None,
+                 pattern='__jinja2_fragment_%s.cache', threshold=1000):
+        FragmentCache.__init__(self, default_timeout)
+        if directory is None:
+            directory = get_default_cache_dir()
+        self.directory = directory
+        self.pattern = pattern
+        self.threshold = threshold
+        self._writes = 0
+
+    def _get_cache_filename(self, key):
+        if isinstance(key, text_type):
+            key = key.encode('utf-8')
+        return path.join(self.directory,
+                         self.pattern % sha1(key).hexdigest())
+
+    def _read(self, filename, header_only=False):
+        f = open_if_exists(filename)
+        if f is None:
+            return None, None
+        try:
+            data = f.read(header_only and self._header.size or -1)
+        finally:
+            f.close()
+        if len(data) < self._header.size:
+            return None, None
+        expires, markup = self._header.unpack_from(data)
+        if header_only:
+            return expires, None
+        value = data[self._header.size:].decode('utf-8')
+        if markup:
+            value = Markup(value)
+        return expires, value
+
+    def get(self, key):
+        filename = self._get_cache_filename(key)
+        try:
+            expires, value = self._read(filename)
+        except (IOError, OSError, struct.error, UnicodeDecodeError):
+            return None
+        if expires and expires <= time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, timeout=None):
+        filename = self._get_cache_filename(key)
+        expires = self._get_expiry(timeout) or 0.0
+        data = self._header.pack(expires, hasattr(value, '__html__')) + \
+            text_type(value).encode('utf-8')
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            self._replace(tmp, filename)
+        except (IOError, OSError):
+            self._remove(tmp)
+            raise
+        self._prune()
+
+    def delete(self, key):
+        self._remove(self._get_cache_filename(key))
+        self.forget([key])
+
+    def contains(self, key):
+        return path.isfile(self._get_cache_filename(key))
+
+    def clear(self):
+        FragmentCache.clear(self)
+        for filename in self._list():
+            self._remove(filename)
+
+    def _list(self):
+        return [path.join(self.directory, x) for x in
+                fnmatch.filter(listdir(self.directory), self.pattern % '*')]
+
+    def _replace(self, src, dst):
+        try:
+            os.rename(src, dst)
+        except OSError:
+            # windows does not replace existing files on rename
+            self._remove(dst)
+            os.rename(src, dst)
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+    def _prune(self):
+        margin = self.threshold // 10
+        self._writes += 1
+        if self._writes < max(1, margin):
+            return
+        self._writes = 0
+        files = self._list()
+        if len(files) <= self.threshold + margin:
+            return
+        now = time()
+        entries = []
+        for filename in files:
+            try:
+                expires = self._read(filename, header_only=True)[0]
+                mtime = path.getmtime(filename)
+            except (IOError, OSError, struct.error, UnicodeDecodeError):
+                continue
+            if expires and expires <= now:
+                self._remove(filename)
+            else:
+                entries.append((mtime, filename))
+        entries.sort()
+        for mtime, filename in entries[:len(entries) - self.threshold +
+                                       margin]:
+            self._remove(filename)
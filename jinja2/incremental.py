@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""
+    jinja2.incremental
+    ~~~~~~~~~~~~~~~~~~
+
+    Parses templates incrementally, for example for the live preview of a
+    template editor.  A :class:`TemplateDocument` remembers the tokens and
+    the top-level statements of a template.  After an edit only the tokens
+    between the directives around the edit are tokenized again and only the
+    top-level statements that contain them are parsed again::
+
+        document = env.parse_incremental(source, 'sections/header.liquid')
+        document = document.edit(120, 4, u'{{ shop.name }}')
+        template = env.from_string(document.ast)
+
+    The syntax tree of the new document shares the unchanged statements
+    with the old one.
+
+    :copyright: (c) 2010 by the Jinja Team.
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+from bisect import bisect_left, bisect_right
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from jinja2.lexer import TokenStream, line_break_re
+from jinja2.parser import Parser
+from jinja2.exceptions import TemplateSyntaxError
+from jinja2._compat import text_type, reraise
+
+
+# tokens that start and end directives in the template data
+_begin_tokens = frozenset(['block_begin', 'variable_begin', 'comment_begin',
+                           'raw_begin', 'linestatement_begin',
+                           'linecomment_begin'])
+_end_tokens = frozenset(['block_end', 'variable_end', 'comment_end',
+                         'raw_end', 'linestatement_end', 'linecomment_end'])
+
+
+def supports_incremental_parsing(environment):
+    """Check if the templates of the environment can be parsed
+    incrementally.  Extensions that preprocess the source or filter the
+    token stream need to see the whole template, documents of environments
+    with such extensions are parsed completely after every edit.
+    """
+    for extension in environment.iter_extensions():
+        cls = extension.__class__
+        if cls.preprocess != Extension.preprocess or \
+           cls.filter_stream != Extension.filter_stream:
+            return False
+    return True
+
+
+def _lex(lexer, source, source_length, name, filename, pos, lineno):
+    """Tokenize the source from `pos` on and yield the tokens in the form
+    ``(pos, lineno, type, value, root)``.  `root` is true for tokens the
+    lexer starts in the root state, the tokens of the template data and the
+    beginnings of directives.  Tokenizing can start again at these tokens.
+    """
+    in_root = True
+    for lineno, token, value in lexer.tokeniter_from(
+            source, source_length, name, filename, None, pos, lineno):
+        yield pos, lineno, token, value, in_root
+        if token in _begin_tokens:
+            in_root = False
+        elif token in _end_tokens:
+            in_root = True
+        pos += len(value)
+
+
+def _shift_lineno(node, delta):
+    """Return a copy of a node, or of a list or tuple of nodes, with the
+    line numbers moved by `delta`.
+    """
+    if isinstance(node, nodes.Node):
+        rv = object.__new__(node.__class__)
+        for key in node.fields:
+            setattr(rv, key, _shift_lineno(getattr(node, key), delta))
+        for key in node.attributes:
+            if hasattr(node, key):
+                setattr(rv, key, getattr(node, key))
+        if getattr(node, 'lineno', None) is not None:
+            rv.lineno = node.lineno + delta
+        return rv
+    elif isinstance(node, list):
+        return [_shift_lineno(x, delta) for x in node]
+    elif isinstance(node, tuple):
+        return tuple(_shift_lineno(x, delta) for x in node)
+    return node
+
+
+class _Unit(object):
+    """A top-level statement or the output between two statements.  The
+    line numbers of the nodes are moved by `line_delta` when the syntax tree
+    is built, so that several edits move them only once.
+    """
+    __slots__ = ('start', 'is_output', 'nodes', 'line_delta')
+
+    def __init__(self, start, is_output, nodes, line_delta=0):
+        self.start = start
+        self.is_output = is_output
+        self.nodes = nodes
+        self.line_delta = line_delta
+
+    def get_nodes(self):
+        if self.line_delta:
+            self.nodes = _shift_lineno(self.nodes, self.line_delta)
+            self.line_delta = 0
+        return self.nodes
+
+
+class TemplateDocument(object):
+    """The source of a template together with its tokens and syntax tree.
+    Use :meth:`~jinja2.Environment.parse_incremental` to create a document
+    and :meth:`edit` to change it.  Documents are never modified, every edit
+    returns a new document.
+
+    The line breaks of the `source` are normalized to ``\\n`` and the
+    offsets of the edits refer to it.  The :attr:`ast` is the same a
+    :meth:`~jinja2.Environment.parse` of the source returns, except that
+    free identifiers created by extensions may have other numbers.
+
+    .. versionadded:: 2.9
+    """
+
+    def __init__(self, environment, source, name=None, filename=None):
+        self.environment = environment
+        self.name = name
+        self.filename = filename
+        source = self._set_source(source)
+        if not supports_incremental_parsing(environment):
+            self._units = None
+            self._ast = environment._parse(source, name, filename)
+            return
+
+        self._tokens = []
+        self._boundaries = []
+        try:
+            for pos, lineno, token, value, root in _lex(
+                    environment.lexer, source, self._source_length, name,
+                    filename, 0, 1):
+                if root:
+                    self._boundaries.append(len(self._tokens))
+                self._tokens.append((pos, lineno, token, value))
+        except TemplateSyntaxError:
+            # the parser stops at the first error while the template is
+            # only partially tokenized, report the same error.
+            exc_info = sys.exc_info()
+            environment._parse(source, name, filename)
+            reraise(*exc_info)
+        self._boundary_offsets = [self._tokens[x][0]
+                                  for x in self._boundaries]
+
+        self._units, stop, self._last_identifier = \
+            self._parse_units(self._tokens, 0, 0)
+        self._ast = None
+
+    def _set_source(self, source):
+        self.source, self._source_length = \
+            self.environment.lexer.prepare_source(source)
+        return self.source
+
+    @property
+    def ast(self):
+        """The :class:`~jinja2.nodes.Template` node of the source."""
+        if self._ast is None:
+            body = []
+            for unit in self._units:
+                body.extend(unit.get_nodes())
+            self._ast = nodes.Template(body, lineno=1)
+            self._ast.environment = self.environment
+        return self._ast
+
+    def _parse_units(self, tokens, start, last_identifier, can_stop=None):
+        """Parse the top-level statements starting at the token with the
+        index `start` until the end of the template or until `can_stop`
+        returns the index of an old statement to continue with.  Works like
+        :meth:`~jinja2.parser.Parser.subparse` of the template body.
+        """
+        environment = self.environment
+        parser = Parser(environment, u'', self.name, self.filename)
+        parser._last_identifier = last_identifier
+        positions = {}
+        wrapped = []
+
+        def generate():
+            wrap = environment.lexer.wrap
+            for index in range(start, len(tokens)):
+                pos, lineno, token, value = tokens[index]
+                for token in wrap([(lineno, token, value)], self.name,
+                                  self.filename):
+                    positions[id(token)] = index
+                    wrapped.append(token)
+                    yield token
+
+        stream = parser.stream = TokenStream(generate(), self.name,
+                                             self.filename)
+        units = []
+        data_buffer = []
+        data_start = None
+        stop = None
+
+        while stream:
+            token = stream.current
+            index = positions.get(id(token), len(tokens))
+            if token.type in ('data', 'variable_begin'):
+                if data_start is None:
+                    if can_stop is not None:
+                        stop = can_stop(index)
+                        if stop is not None:
+                            break
+                    data_start = index
+                if token.type == 'data':
+                    if token.value:
+                        data_buffer.append(nodes.TemplateData(
+                            token.value, lineno=token.lineno))
+                    next(stream)
+                else:
+                    next(stream)
+                    data_buffer.append(parser.parse_tuple(
+                        with_condexpr=True))
+                    stream.expect('variable_end')
+            elif token.type == 'block_begin':
+                if data_start is not None:
+                    if data_buffer:
+                        units.append(self._make_unit(data_start, True, [
+                            nodes.Output(data_buffer,
+                                         lineno=data_buffer[0].lineno)]))
+                    data_buffer = []
+                    data_start = None
+                if can_stop is not None:
+                    stop = can_stop(index)
+                    if stop is not None:
+                        break
+                next(stream)
+                rv = parser.parse_statement()
+                if not isinstance(rv, list):
+                    rv = [rv]
+                stream.expect('block_end')
+                units.append(self._make_unit(index, False, rv))
+            else:
+                raise AssertionError('internal parsing error')
+
+        if data_buffer:
+            units.append(self._make_unit(data_start, True, [nodes.Output(
+                data_buffer, lineno=data_buffer[0].lineno)]))
+        return units, stop, parser._last_identifier
+
+    def _make_unit(self, start, is_output, unit_nodes):
+        for node in unit_nodes:
+            node.set_environment(self.environment)
+        return _Unit(start, is_output, unit_nodes)
+
+    def edit(self, offset, removed, inserted):
+        """Return a new document with `removed` characters at `offset`
+        replaced by the `inserted` text.  Raises a
+        :exc:`~jinja2.TemplateSyntaxError` if the new source is invalid.
+        """
+        inserted = text_type(inserted)
+        if line_break_re.search(inserted) is not None:
+            inserted = line_break_re.sub('\n', inserted)
+        if offset < 0 or removed < 0 or offset + removed > len(self.source):
+            raise ValueError('edit outside of the source')
+        source = self.source[:offset] + inserted + \
+            self.source[offset + removed:]
+        if self._units is None:
+            return self.environment.parse_incremental(source, self.name,
+                                                      self.filename)
+        try:
+            return self._edit(source, offset, removed, len(inserted))
+        except TemplateSyntaxError:
+            # parse the template again to report the same error as a full
+            # parse, which can stop before the tokens with errors.
+            pass
+        return self.environment.parse_incremental(source, self.name,
+                                                  self.filename)
+
+    def _edit(self, source, offset, removed, inserted):
+        rv = object.__new__(self.__class__)
+        rv.environment = self.environment
+        rv.name = self.name
+        rv.filename = self.filename
+        source = rv._set_source(source)
+        delta = inserted - removed
+        edit_end = offset + inserted
+
+        # tokenizing starts again at the root state boundary before the one
+        # in front of the edit.  directives can start with whitespace in
+        # the template data before them, and end with whitespace after them.
+        old_tokens = self._tokens
+        old_boundaries = self._boundaries
+        old_offsets = self._boundary_offsets
+        boundary = bisect_left(old_offsets, offset) - 2
+        if boundary < 0:
+            boundary = 0
+            first, pos, lineno = 0, 0, 1
+        else:
+            first = old_boundaries[boundary]
+            pos, lineno = old_tokens[first][:2]
+
+        # tokenize until a boundary after the edit is a boundary of the old
+        # document, the old tokens after it do not change.
+        tokens = old_tokens[:first]
+        boundaries = old_boundaries[:boundary]
+        sync = None
+        for pos, lineno, token, value, root in _lex(
+                self.environment.lexer, source, rv._source_length,
+                self.name, self.filename, pos, lineno):
+            if root and pos > edit_end:
+                old_boundary = bisect_left(old_offsets, pos - delta)
+                if old_boundary < len(old_offsets) and \
+                   old_offsets[old_boundary] == pos - delta:
+                    sync = old_boundary, lineno
+                    break
+            if root:
+                boundaries.append(len(tokens))
+            tokens.append((pos, lineno, token, value))
+
+        index_delta = line_delta = 0
+        resume = len(tokens)
+        if sync is not None:
+            old_boundary, lineno = sync
+            old_first = old_boundaries[old_boundary]
+            index_delta = resume - old_first
+            line_delta = lineno - old_tokens[old_first][1]
+            if delta or line_delta:
+                tokens.extend((pos + delta, lineno + line_delta, token, value)
+                              for pos, lineno, token, value
+                              in old_tokens[old_first:])
+            else:
+                tokens.extend(old_tokens[old_first:])
+            boundaries.extend(x + index_delta
+                              for x in old_boundaries[old_boundary:])
+        rv._tokens = tokens
+        rv._boundaries = boundaries
+        rv._boundary_offsets = [tokens[x][0] for x in boundaries]
+
+        # parse again from the statement that contains the first new token.
+        # output directly before a statement is parsed again as well because
+        # it is merged with new output in front of the statement.
+        old_units = self._units
+        unit_starts = [x.start for x in old_units]
+        unit = max(bisect_right(unit_starts, first) - 1, 0)
+        if unit > 0 and not old_units[unit].is_output and \
+           old_units[unit - 1].is_output:
+            unit -= 1
+        start = old_units and old_units[unit].start or 0
+
+        def can_stop(index):
+            if sync is None or index < resume:
+                return None
+            old_index = index - index_delta
+            rv = bisect_left(unit_starts, old_index)
+            if rv < len(unit_starts) and unit_starts[rv] == old_index:
+                return rv
+
+        units, stop, rv._last_identifier = self._parse_units(
+            tokens, min(start, first), self._last_identifier, can_stop)
+        units = old_units[:unit] + units
+        if stop is not None:
+            if index_delta or line_delta:
+                units.extend(_Unit(x.start + index_delta, x.is_output,
+                                   x.nodes, x.line_delta + line_delta)
+                             for x in old_units[stop:])
+            else:
+                units.extend(old_units[stop:])
+        rv._units = units
+        rv._ast = None
+        return rv
+
+    def __repr__(self):
+        return '<%s %s>' % (
+            self.__class__.__name__,
+            self.name is None and 'memory:%x' % id(self) or repr(self.name)
+        )
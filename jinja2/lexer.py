@@ -47,6 +47,8 @@ else:
 
 float_re = re.compile(r'(?<!\.)\d+\.\d+')
 newline_re = re.compile(r'(\r\n|\r|\n)')
+# the line breaks other than "\n" known to `unicode.splitlines`
+line_break_re = re.compile(u'\r\n|[\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
 
 # internal the tokens and keep references to them
 TOKEN_ADD = intern('add')
@@ -140,6 +142,9 @@ ignored_tokens = frozenset([TOKEN_COMMENT_BEGIN, TOKEN_COMMENT,
                             TOKEN_LINECOMMENT])
 ignore_if_empty = frozenset([TOKEN_WHITESPACE, TOKEN_DATA,
                              TOKEN_COMMENT, TOKEN_LINECOMMENT])
+# tokens that only end a tag if braces and parentheses are balanced
+balanced_tokens = frozenset([TOKEN_VARIABLE_END, TOKEN_BLOCK_END,
+                             TOKEN_LINESTATEMENT_END])
 
 
 def _describe_token_type(token_type):
@@ -209,6 +214,37 @@ def compile_rules(environment):
     return [x[1:] for x in sorted(rules, reverse=True)]
 
 
+def compile_state_rules(rules, skip_tokens=()):
+    """Combines the rules of a lexer state into one regular expression with
+    a named group per rule so that the next token is found with a single
+    match.  The alternatives are tried in the order of the rules, just like
+    the rules themselves.  Rules for the given `skip_tokens` are left out.
+
+    Returns the regular expression and a dict that maps the names of the
+    rule groups to a tuple in the form ``(regex, tokens, new_state, offset,
+    named_groups)`` where `offset` is the index of the rule group and
+    `named_groups` are the names and indexes of the named groups of the
+    rule.
+    """
+    patterns = []
+    rule_groups = {}
+    flags = 0
+    offset = 1
+    for idx, (regex, tokens, new_state) in enumerate(rules):
+        if tokens in skip_tokens:
+            continue
+        group = '_rule%d' % idx
+        patterns.append('(?P<%s>%s)' % (group, regex.pattern))
+        named_groups = sorted((index + offset, name) for name, index
+                              in iteritems(regex.groupindex))
+        rule_groups[group] = (regex, tokens, new_state, offset,
+                              [(name, index) for index, name
+                               in named_groups])
+        flags |= regex.flags
+        offset += regex.groups + 1
+    return re.compile('|'.join(patterns), flags), rule_groups
+
+
 class Failure(object):
     """Class that raises a `TemplateSyntaxError` if called.
     Used by the `Lexer` to specify known errors.
@@ -492,20 +528,24 @@ class Lexer(object):
         self.newline_sequence = environment.newline_sequence
         self.keep_trailing_newline = environment.keep_trailing_newline
 
+        # the directives in template data
+        tag_re = '|'.join(
+            [r'(?P<raw_begin>(?:\s*%s\-|%s)\s*raw\s*(?:\-%s\s*|%s))' % (
+                e(environment.block_start_string),
+                block_prefix_re,
+                e(environment.block_end_string),
+                e(environment.block_end_string)
+            )] + [
+                r'(?P<%s_begin>\s*%s\-|%s)' % (n, r, prefix_re.get(n,r))
+                for n, r in root_tag_rules
+            ])
+
         # global lexing rules
         self.rules = {
             'root': [
                 # directives
-                (c('(.*?)(?:%s)' % '|'.join(
-                    [r'(?P<raw_begin>(?:\s*%s\-|%s)\s*raw\s*(?:\-%s\s*|%s))' % (
-                        e(environment.block_start_string),
-                        block_prefix_re,
-                        e(environment.block_end_string),
-                        e(environment.block_end_string)
-                    )] + [
-                        r'(?P<%s_begin>\s*%s\-|%s)' % (n, r, prefix_re.get(n,r))
-                        for n, r in root_tag_rules
-                    ])), (TOKEN_DATA, '#bygroup'), '#bygroup'),
+                (c('(.*?)(?:%s)' % tag_re), (TOKEN_DATA, '#bygroup'),
+                 '#bygroup'),
                 # data
                 (c('.+'), TOKEN_DATA, None)
             ],
@@ -555,8 +595,62 @@ class Lexer(object):
             ]
         }
 
+        # the rules of every state combined into one regular expression.
+        # while braces are open the end of a tag is lexed as operator, so
+        # the end rules are left out of the second expression.
+        self.state_regexes = {}
+        for state, rules in iteritems(self.rules):
+            self.state_regexes[state] = (
+                compile_state_rules(rules),
+                compile_state_rules(rules, balanced_tokens)
+            )
+
+        # every directive is optional whitespace followed by one of the
+        # start strings, so template data is searched for the first
+        # characters of the start strings instead of trying the directive
+        # rules at every position.
+        start_strings = [x for x in (environment.block_start_string,
+                                     environment.variable_start_string,
+                                     environment.comment_start_string,
+                                     environment.line_statement_prefix,
+                                     environment.line_comment_prefix)
+                         if x is not None]
+        self.tag_re = self.tag_start_re = None
+        if all(x and not x[0].isspace() for x in start_strings):
+            self.tag_re = c(tag_re)
+            self.tag_start_re = c('[%s]' % ''.join(
+                sorted(set(e(x[0]) for x in start_strings))))
+
+    def _find_tag(self, source, pos, endpos):
+        """Return the match of the next directive in the template data
+        starting at `pos` or `None` if there is none.  The directive starts
+        at the same position the lazy data group of the root rule stops.
+        """
+        search = self.tag_start_re.search
+        match = self.tag_re.match
+        while 1:
+            m = search(source, pos, endpos)
+            if m is None:
+                return None
+            start = m.start()
+            # the directive may begin with whitespace, try each position of
+            # it and the start string itself.
+            begin = start
+            while begin > pos and source[begin - 1].isspace():
+                begin -= 1
+            for begin in range(begin, start + 1):
+                m = match(source, begin, endpos)
+                if m is not None:
+                    return m
+            pos = start + 1
+
     def _normalize_newlines(self, value):
         """Called for strings and template data to normalize it to unicode."""
+        # the data from `tokeniter` only contains "\n" line breaks
+        if '\r' not in value:
+            if self.newline_sequence == '\n':
+                return value
+            return value.replace('\n', self.newline_sequence)
         return newline_re.sub(self.newline_sequence, value)
 
     def tokenize(self, source, name=None, filename=None, state=None):
@@ -611,140 +705,90 @@ class Lexer(object):
                 token = operators[value]
             yield Token(lineno, token, value)
 
+    def prepare_source(self, source):
+        """Return the source with all line breaks replaced by ``\\n`` and
+        the length up to which it is tokenized.
+
+        .. versionadded:: 2.9
+        """
+        source = text_type(source)
+        # all line breaks become "\n" in a single pass, the source is only
+        # copied if it contains other line breaks.  the final line break is
+        # ignored by matching up to `source_length` unless trailing
+        # newlines are kept.
+        keep_newline = self.keep_trailing_newline and \
+            source.endswith(('\r', '\n'))
+        if line_break_re.search(source) is not None:
+            source = line_break_re.sub('\n', source)
+        source_length = len(source)
+        if not keep_newline and source.endswith('\n'):
+            source_length -= 1
+        return source, source_length
+
     def tokeniter(self, source, name, filename=None, state=None):
         """This method tokenizes the text and returns the tokens in a
         generator.  Use this method if you just want to tokenize a template.
         """
-        source = text_type(source)
-        lines = source.splitlines()
-        if self.keep_trailing_newline and source:
-            for newline in ('\r\n', '\r', '\n'):
-                if source.endswith(newline):
-                    lines.append('')
-                    break
-        source = '\n'.join(lines)
-        pos = 0
-        lineno = 1
+        source, source_length = self.prepare_source(source)
+        return self.tokeniter_from(source, source_length, name, filename,
+                                   state)
+
+    def tokeniter_from(self, source, source_length, name, filename=None,
+                       state=None, pos=0, lineno=1):
+        """Like :meth:`tokeniter` but for a source returned by
+        :meth:`prepare_source`.  Tokenizing starts at `pos` which has to be
+        a position at which the lexer is in the `state`, usually the start
+        of a token of the template data or of a directive, and `lineno` is
+        the line number at that position.  The values of the tokens cover
+        the source without gaps, so the position of every token is known.
+
+        .. versionadded:: 2.9
+        """
         stack = ['root']
         if state is not None and state != 'root':
             assert state in ('variable', 'block'), 'invalid state'
             stack.append(state + '_begin')
         else:
             state = 'root'
-        statetokens = self.rules[stack[-1]]
-        source_length = len(source)
+        state_regexes = self.state_regexes[stack[-1]]
+        root_regexes = None
+        if self.tag_re is not None:
+            root_regexes = self.state_regexes['root']
 
         balancing_stack = []
 
         while 1:
-            # tokenizer loop
-            for regex, tokens, new_state in statetokens:
-                m = regex.match(source, pos)
-                # if no match we try again with the next rule
+            # template data up to the next directive
+            if state_regexes is root_regexes:
+                m = self._find_tag(source, pos, source_length)
+                end = source_length
+                if m is not None:
+                    end = m.start()
+                if pos < end:
+                    data = source[pos:end]
+                    yield lineno, TOKEN_DATA, data
+                    lineno += data.count('\n')
                 if m is None:
-                    continue
-
-                # we only match blocks and variables if braces / parentheses
-                # are balanced. continue parsing with the lower rule which
-                # is the operator rule. do this only if the end tags look
-                # like operators
-                if balancing_stack and \
-                   tokens in ('variable_end', 'block_end',
-                              'linestatement_end'):
-                    continue
-
-                # tuples support more options
-                if isinstance(tokens, tuple):
-                    for idx, token in enumerate(tokens):
-                        # failure group
-                        if token.__class__ is Failure:
-                            raise token(lineno, filename)
-                        # bygroup is a bit more complex, in that case we
-                        # yield for the current token the first named
-                        # group that matched
-                        elif token == '#bygroup':
-                            for key, value in iteritems(m.groupdict()):
-                                if value is not None:
-                                    yield lineno, key, value
-                                    lineno += value.count('\n')
-                                    break
-                            else:
-                                raise RuntimeError('%r wanted to resolve '
-                                                   'the token dynamically'
-                                                   ' but no group matched'
-                                                   % regex)
-                        # normal group
-                        else:
-                            data = m.group(idx + 1)
-                            if data or token not in ignore_if_empty:
-                                yield lineno, token, data
-                            lineno += data.count('\n')
+                    return
+                for key, value in iteritems(m.groupdict()):
+                    if value is not None:
+                        yield lineno, key, value
+                        lineno += value.count('\n')
+                        stack.append(key)
+                        break
+                state_regexes = self.state_regexes[stack[-1]]
+                pos = m.end()
+                continue
 
-                # strings as token just are yielded as it.
-                else:
-                    data = m.group()
-                    # update brace/parentheses balance
-                    if tokens == 'operator':
-                        if data == '{':
-                            balancing_stack.append('}')
-                        elif data == '(':
-                            balancing_stack.append(')')
-                        elif data == '[':
-                            balancing_stack.append(']')
-                        elif data in ('}', ')', ']'):
-                            if not balancing_stack:
-                                raise TemplateSyntaxError('unexpected \'%s\'' %
-                                                          data, lineno, name,
-                                                          filename)
-                            expected_op = balancing_stack.pop()
-                            if expected_op != data:
-                                raise TemplateSyntaxError('unexpected \'%s\', '
-                                                          'expected \'%s\'' %
-                                                          (data, expected_op),
-                                                          lineno, name,
-                                                          filename)
-                    # yield items
-                    if data or tokens not in ignore_if_empty:
-                        yield lineno, tokens, data
-                    lineno += data.count('\n')
+            # tokenizer loop.  we only match blocks and variables if
+            # braces / parentheses are balanced, otherwise the end tags are
+            # lexed with the lower rules such as the operator rule.
+            state_regex, rule_groups = state_regexes[bool(balancing_stack)]
+            m = state_regex.match(source, pos, source_length)
 
-                # fetch new position into new variable so that we can check
-                # if there is a internal parsing error which would result
-                # in an infinite loop
-                pos2 = m.end()
-
-                # handle state changes
-                if new_state is not None:
-                    # remove the uppermost state
-                    if new_state == '#pop':
-                        stack.pop()
-                    # resolve the new state by group checking
-                    elif new_state == '#bygroup':
-                        for key, value in iteritems(m.groupdict()):
-                            if value is not None:
-                                stack.append(key)
-                                break
-                        else:
-                            raise RuntimeError('%r wanted to resolve the '
-                                               'new state dynamically but'
-                                               ' no group matched' %
-                                               regex)
-                    # direct state name given
-                    else:
-                        stack.append(new_state)
-                    statetokens = self.rules[stack[-1]]
-                # we are still at the same position and no stack change.
-                # this means a loop without break condition, avoid that and
-                # raise error
-                elif pos2 == pos:
-                    raise RuntimeError('%r yielded empty string without '
-                                       'stack change' % regex)
-                # publish new function and start again
-                pos = pos2
-                break
-            # if loop terminated without break we haven't found a single match
-            # either we are at the end of the file or we have a problem
-            else:
+            # if there is no match either we are at the end of the file or
+            # we have a problem
+            if m is None:
                 # end of text
                 if pos >= source_length:
                     return
@@ -752,3 +796,96 @@ class Lexer(object):
                 raise TemplateSyntaxError('unexpected char %r at %d' %
                                           (source[pos], pos), lineno,
                                           name, filename)
+
+            regex, tokens, new_state, offset, named_groups = \
+                rule_groups[m.lastgroup]
+
+            # tuples support more options
+            if isinstance(tokens, tuple):
+                for idx, token in enumerate(tokens):
+                    # failure group
+                    if token.__class__ is Failure:
+                        raise token(lineno, filename)
+                    # bygroup is a bit more complex, in that case we
+                    # yield for the current token the first named
+                    # group that matched
+                    elif token == '#bygroup':
+                        for key, group in named_groups:
+                            value = m.group(group)
+                            if value is not None:
+                                yield lineno, key, value
+                                lineno += value.count('\n')
+                                break
+                        else:
+                            raise RuntimeError('%r wanted to resolve '
+                                               'the token dynamically'
+                                               ' but no group matched'
+                                               % regex)
+                    # normal group
+                    else:
+                        data = m.group(offset + idx + 1)
+                        if data or token not in ignore_if_empty:
+                            yield lineno, token, data
+                        lineno += data.count('\n')
+
+            # strings as token just are yielded as it.
+            else:
+                data = m.group()
+                # update brace/parentheses balance
+                if tokens == 'operator':
+                    if data == '{':
+                        balancing_stack.append('}')
+                    elif data == '(':
+                        balancing_stack.append(')')
+                    elif data == '[':
+                        balancing_stack.append(']')
+                    elif data in ('}', ')', ']'):
+                        if not balancing_stack:
+                            raise TemplateSyntaxError('unexpected \'%s\'' %
+                                                      data, lineno, name,
+                                                      filename)
+                        expected_op = balancing_stack.pop()
+                        if expected_op != data:
+                            raise TemplateSyntaxError('unexpected \'%s\', '
+                                                      'expected \'%s\'' %
+                                                      (data, expected_op),
+                                                      lineno, name,
+                                                      filename)
+                # yield items
+                if data or tokens not in ignore_if_empty:
+                    yield lineno, tokens, data
+                lineno += data.count('\n')
+
+            # fetch new position into new variable so that we can check
+            # if there is a internal parsing error which would result
+            # in an infinite loop
+            pos2 = m.end()
+
+            # handle state changes
+            if new_state is not None:
+                # remove the uppermost state
+                if new_state == '#pop':
+                    stack.pop()
+                # resolve the new state by group checking
+                elif new_state == '#bygroup':
+                    for key, group in named_groups:
+                        if m.group(group) is not None:
+                            stack.append(key)
+                            break
+                    else:
+                        raise RuntimeError('%r wanted to resolve the '
+                                           'new state dynamically but'
+                                           ' no group matched' %
+                                           regex)
+                # direct state name given
+                else:
+                    stack.append(new_state)
+                state_regexes = self.state_regexes[stack[-1]]
+            # we are still at the same position and no stack change.
+            # this means a loop without break condition, avoid that and
+            # raise error
+            elif pos2 == pos:
+                raise RuntimeError('%r yielded empty string without '
+                                   'stack change' % regex)
+            # publish new function and start again
+            pos = pos2
@@ -10,13 +10,29 @@
 """
 import os
 import sys
+import stat
+import select
+import struct
 import weakref
+from threading import Event, Lock, Thread
 from types import ModuleType
 from os import path
 from hashlib import sha1
 from jinja2.exceptions import TemplateNotFound
-from jinja2.utils import open_if_exists, internalcode
-from jinja2._compat import string_types, iteritems
+from jinja2.utils import open_if_exists, internalcode, template_checksum
+from jinja2._compat import string_types, iteritems, text_type, PY2
+
+
+class _NoLock(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+_no_lock = _NoLock()
 
 
 def split_template_path(template):
@@ -90,6 +106,25 @@ class BaseLoader(object):
                                self.__class__.__name__)
         raise TemplateNotFound(template)
 
+    def get_source_version(self, environment, template):
+        """Get a version token, the filename and the reload helper of a
+        template without loading its source.  The token has to change
+        whenever the source changes, for example the modification time and
+        size of a file or the row version of a database record.  The token
+        can be a string or any other value with a stable string form, like
+        an integer.  Returns a tuple in the form
+        ``(version, filename, uptodate)`` or raises a `TemplateNotFound`
+        error.
+
+        If a bytecode cache is used, the cached code is validated with the
+        version so the source is only loaded if the template has to be
+        compiled.  Loaders that cannot tell the version cheaply return
+        `None`, which is the default.
+
+        .. versionadded:: 2.9
+        """
+        return None
+
     def list_templates(self):
         """Iterates over all templates.  If the loader does not support that
         it should raise a :exc:`TypeError` which is the default behavior.
@@ -104,35 +139,397 @@ class BaseLoader(object):
         loaders (such as :class:`PrefixLoader` or :class:`ChoiceLoader`)
         will not call this method but `get_source` directly.
         """
-        code = None
+        code = bucket = source = None
         if globals is None:
             globals = {}
 
-        # first we try to get the source for this template together
-        # with the filename and the uptodate function.
-        source, filename, uptodate = self.get_source(environment, name)
-
-        # try to load the code from the bytecode cache if there is a
-        # bytecode cache configured.
+        # if the loader can tell the version of the template without
+        # loading it, the bytecode cache is asked with the version and the
+        # source is only loaded if the template has to be compiled.
         bcc = environment.bytecode_cache
         if bcc is not None:
-            bucket = bcc.get_bucket(environment, name, filename, source)
+            rv = self.get_source_version(environment, name)
+            if rv is not None:
+                version, filename, uptodate = rv
+                bucket = bcc.get_version_bucket(environment, name, filename,
+                                                version)
+
+        # otherwise we get the source for this template together with the
+        # filename and the uptodate function and try to load the code from
+        # the bytecode cache if there is a bytecode cache configured.
+        if bucket is None:
+            source, filename, uptodate = self.get_source(environment, name)
+            if bcc is not None:
+                bucket = bcc.get_bucket(environment, name, filename, source)
+        if bucket is not None:
             code = bucket.code
+        cached = code is not None
 
         # if we don't have code so far (not cached, no longer up to
-        # date) etc. we compile the template
+        # date) etc. we compile the template.  If the bytecode cache locks
+        # compiles, another process might have stored the code while we
+        # waited for the lock.
         if code is None:
-            code = environment.compile(source, name, filename)
+            lock = None
+            if bucket is not None:
+                lock = bcc.get_compile_lock(bucket)
+            with lock or _no_lock:
+                if lock is not None:
+                    bcc.load_bytecode(bucket)
+                    code = bucket.code
+                if code is None:
+                    if source is None:
+                        source, filename, uptodate = self.get_source(
+                            environment, name)
+                        # don't store the code under the version if the
+                        # template changed in the meantime.
+                        rv = self.get_source_version(environment, name)
+                        if rv is None or rv[0] != version:
+                            bucket = None
+                    code = environment.compile(source, name, filename)
+
+                    # if the bytecode cache is available we give the
+                    # bucket the new code and put it back to the cache.
+                    if bucket is not None:
+                        bucket.code = code
+                        bcc.set_bucket(bucket)
+
+        # the code might have been compiled for a template with the same
+        # source in another file if the bytecode cache shares it.
+        rv = environment.template_class.from_code(environment, code,
+                                                  globals, uptodate, filename)
+
+        # templates compiled with `flatten_extends` contain the code of
+        # their parent templates.  If one of the parents changed since the
+        # code was cached we have to compile the template again, and auto
+        # reloading has to check all of them.
+        if rv.inlined_templates:
+            parents = self._get_inlined_uptodate(environment, rv)
+            if parents is None:
+                if source is None:
+                    source = self.get_source(environment, name)[0]
+                code = environment.compile(source, name, filename)
+                if bucket is not None:
+                    bucket.code = code
+                    bcc.set_bucket(bucket)
+                rv = environment.template_class.from_code(
+                    environment, code, globals, uptodate, filename)
+                parents = self._get_inlined_uptodate(environment, rv) or []
+            checks = [x for x in [uptodate] + parents if x is not None]
+            rv._uptodate = lambda: all(check() for check in checks)
+
+        # load the templates this one is going to load with one round trip
+        # to the bytecode cache per level of dependencies.  If the template
+        # was not cached its dependencies are most likely not cached either.
+        if cached and bcc.prefetch and rv.dependencies:
+            self._prefetch(environment, rv.dependencies)
+
+        return rv
+
+    def _make_bucket(self, environment, name):
+        """Return the empty bytecode cache bucket, the filename and the
+        `uptodate` function of a template.
+        """
+        bcc = environment.bytecode_cache
+        rv = self.get_source_version(environment, name)
+        if rv is not None:
+            version, filename, uptodate = rv
+            bucket = bcc.make_version_bucket(environment, name, filename,
+                                             version)
+            if bucket is not None:
+                return bucket, filename, uptodate
+        source, filename, uptodate = self.get_source(environment, name)
+        return (bcc.make_bucket(environment, name, filename, source),
+                filename, uptodate)
+
+    def _prefetch(self, environment, names):
+        """Load the code of the given templates and of the templates they
+        depend on with :meth:`~jinja2.BytecodeCache.load_many` and put the
+        templates into the template cache of the environment.  Templates
+        that are not cached are left to :meth:`load`.
+        """
+        cache = environment.cache
+        if cache is None or environment.loader is not self:
+            return
+        loader_ref = weakref.ref(self)
+        seen = set()
+        while names:
+            pending = []
+            for name in names:
+                if name in seen or cache.get((loader_ref, name)) is not None:
+                    continue
+                seen.add(name)
+                try:
+                    pending.append((name,) +
+                                   self._make_bucket(environment, name))
+                except TemplateNotFound:
+                    pass
+            environment.bytecode_cache.load_many([x[1] for x in pending])
+
+            names = []
+            for name, bucket, filename, uptodate in pending:
+                if bucket.code is None:
+                    continue
+                template = environment.template_class.from_code(
+                    environment, bucket.code, environment.make_globals(None),
+                    uptodate, filename)
+                # the parents of flattened templates have to be checked
+                if template.inlined_templates:
+                    continue
+                cache[(loader_ref, name)] = template
+                names.extend(template.dependencies)
+
+    def _get_inlined_uptodate(self, environment, template):
+        """Return the `uptodate` functions of the parent templates that
+        were compiled into `template` or `None` if one of them changed.
+        """
+        rv = []
+        for name, checksum in template.inlined_templates:
+            try:
+                source, _, uptodate = environment.loader.get_source(
+                    environment, name)
+            except TemplateNotFound:
+                return None
+            if template_checksum(source) != checksum:
+                return None
+            rv.append(uptodate)
+        return rv
+
+
+def _mtime_uptodate(filename, mtime):
+    def uptodate():
+        try:
+            return path.getmtime(filename) == mtime
+        except OSError:
+            return False
+    return uptodate
+
+
+class _WatchedFile(object):
+    """The `uptodate` callable handed out by a watching loader.  It does
+    not touch the file system, it just reports a flag that the watcher
+    clears once the file changes.
+    """
+    __slots__ = ('filename', 'mtime', 'valid')
+
+    def __init__(self, filename, mtime):
+        self.filename = filename
+        self.mtime = mtime
+        self.valid = True
+
+    def __call__(self):
+        return self.valid
+
+
+class PollingWatcher(object):
+    """Watches template files by checking their modification time from a
+    background thread every `interval` seconds.  This works everywhere but
+    still issues one stat call per watched file and interval.  Unlike the
+    default `uptodate` check this happens off the rendering path though.
+
+    .. versionadded:: 2.9
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._files = {}
+        self._lock = Lock()
+        self._stopped = Event()
+        self._thread = None
+
+    def watch(self, filename, mtime):
+        """Return an `uptodate` callable for the file at `filename` that was
+        loaded when it had the given modification time.
+        """
+        with self._lock:
+            if self._stopped.is_set():
+                return _mtime_uptodate(filename, mtime)
+            entry = self._files.get(filename)
+            if entry is not None and entry.valid and entry.mtime == mtime:
+                return entry
+            if entry is not None:
+                entry.valid = False
+            entry = self._files[filename] = _WatchedFile(filename, mtime)
+            if not self._subscribe(entry):
+                del self._files[filename]
+                return _mtime_uptodate(filename, mtime)
+            if self._thread is None:
+                self._thread = Thread(target=self._run,
+                                      name='jinja2-template-watcher')
+                self._thread.daemon = True
+                self._thread.start()
+        return entry
+
+    def invalidate(self, filename):
+        """Mark the file at `filename` as changed."""
+        with self._lock:
+            entry = self._files.pop(filename, None)
+        if entry is not None:
+            entry.valid = False
+
+    def _expire(self, entry):
+        with self._lock:
+            if self._files.get(entry.filename) is entry:
+                del self._files[entry.filename]
+        entry.valid = False
+
+    def stop(self):
+        """Stop the background thread.  Files that are already watched are
+        marked as changed so that they are checked again on the next load.
+        """
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+        self._close()
+        with self._lock:
+            entries = list(self._files.values())
+            self._files.clear()
+        for entry in entries:
+            entry.valid = False
+
+    def _subscribe(self, entry):
+        return True
+
+    def _close(self):
+        pass
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.check()
+
+    def check(self):
+        """Compare the modification times of all watched files against the
+        time they had when they were loaded.
+        """
+        with self._lock:
+            entries = list(self._files.values())
+        for entry in entries:
+            try:
+                if path.getmtime(entry.filename) == entry.mtime:
+                    continue
+            except OSError:
+                pass
+            self._expire(entry)
+
 
-        # if the bytecode cache is available and the bucket doesn't
-        # have a code so far, we give the bucket the new code and put
-        # it back to the bytecode cache.
-        if bcc is not None and bucket.code is None:
-            bucket.code = code
-            bcc.set_bucket(bucket)
+class InotifyWatcher(PollingWatcher):
+    """Watches the directories of loaded templates with the Linux inotify
+    API and marks templates as changed as soon as the kernel reports an
+    event for them.  Use :func:`create_watcher` to get this watcher where
+    it's available and a :class:`PollingWatcher` otherwise.
 
-        return environment.template_class.from_code(environment, code,
-                                                    globals, uptodate)
+    .. versionadded:: 2.9
+    """
+
+    # modify, attrib, close_write, moved_from, moved_to, create, delete,
+    # delete_self and move_self
+    _mask = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200 | 0x400 | 0x800
+    _dir_gone = 0x400 | 0x800 | 0x8000
+    _overflow = 0x4000
+    _event = struct.Struct('iIII')
+
+    def __init__(self, interval=1.0):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None,
+                           use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p,
+                                    ctypes.c_uint32)
+        fd = libc.inotify_init()
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        self._fd = fd
+        self._directories = {}
+        self._descriptors = {}
+        PollingWatcher.__init__(self, interval)
+
+    def _subscribe(self, entry):
+        directory = path.dirname(entry.filename)
+        if directory not in self._directories:
+            wd = self._add_watch(self._fd, _fs_encode(directory), self._mask)
+            if wd < 0:
+                return False
+            self._directories[directory] = wd
+            self._descriptors[wd] = directory
+        # the file could have changed between loading it and subscribing
+        # to its directory, so we have to check it once more.
+        try:
+            if path.getmtime(entry.filename) != entry.mtime:
+                entry.valid = False
+        except OSError:
+            entry.valid = False
+        return True
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if select.select([self._fd], [], [], self.interval)[0]:
+                self._handle_events(os.read(self._fd, 65536))
+
+    def _close(self):
+        os.close(self._fd)
+
+    def _handle_events(self, data):
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self._event.unpack_from(data, offset)
+            offset += self._event.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & self._overflow:
+                with self._lock:
+                    filenames = list(self._files)
+                for filename in filenames:
+                    self.invalidate(filename)
+                continue
+            directory = self._descriptors.get(wd)
+            if directory is None:
+                continue
+            if mask & self._dir_gone:
+                self._forget_directory(wd, directory)
+            elif name:
+                self.invalidate(path.join(directory, _fs_decode(name)))
+
+    def _forget_directory(self, wd, directory):
+        with self._lock:
+            self._descriptors.pop(wd, None)
+            self._directories.pop(directory, None)
+            filenames = [x for x in self._files
+                         if path.dirname(x) == directory]
+        for filename in filenames:
+            self.invalidate(filename)
+
+    def check(self):
+        pass
+
+
+if PY2:
+    def _fs_encode(filename):
+        if isinstance(filename, text_type):
+            return filename.encode(sys.getfilesystemencoding() or 'utf-8')
+        return filename
+    _fs_decode = lambda x: x
+else:
+    _fs_encode = os.fsencode
+    _fs_decode = os.fsdecode
+
+
+def create_watcher(interval=1.0):
+    """Return an :class:`InotifyWatcher` if the platform supports inotify,
+    otherwise a :class:`PollingWatcher` that checks the files every
+    `interval` seconds.
+
+    .. versionadded:: 2.9
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(interval)
+        except (ImportError, OSError, AttributeError):
+            pass
+    return PollingWatcher(interval)
 
 
 class FileSystemLoader(BaseLoader):
@@ -153,16 +550,32 @@ class FileSystemLoader(BaseLoader):
 
     >>> loader = FileSystemLoader('/path/to/templates', followlinks=True)
 
+    With auto reloading enabled every cache hit checks the modification
+    time of the template.  If *watch* is set to ``True`` the loader
+    subscribes to changes of the loaded files instead (using inotify where
+    available, a polling thread otherwise) and the check is a flag lookup.
+    A watcher instance such as :class:`PollingWatcher` can be passed as
+    well.  Call :meth:`close` to stop watching::
+
+    >>> loader = FileSystemLoader('/path/to/templates', watch=True)
+
     .. versionchanged:: 2.8+
        The *followlinks* parameter was added.
+
+    .. versionchanged:: 2.9
+       The *watch* parameter was added.
     """
 
-    def __init__(self, searchpath, encoding='utf-8', followlinks=False):
+    def __init__(self, searchpath, encoding='utf-8', followlinks=False,
+                 watch=False):
         if isinstance(searchpath, string_types):
             searchpath = [searchpath]
         self.searchpath = list(searchpath)
         self.encoding = encoding
         self.followlinks = followlinks
+        if watch is True:
+            watch = create_watcher()
+        self.watcher = watch or None
 
     def get_source(self, environment, template):
         pieces = split_template_path(template)
@@ -177,15 +590,38 @@ class FileSystemLoader(BaseLoader):
                 f.close()
 
             mtime = path.getmtime(filename)
+            return contents, filename, self._get_uptodate(filename, mtime)
+        raise TemplateNotFound(template)
 
-            def uptodate():
-                try:
-                    return path.getmtime(filename) == mtime
-                except OSError:
-                    return False
-            return contents, filename, uptodate
+    def get_source_version(self, environment, template):
+        pieces = split_template_path(template)
+        for searchpath in self.searchpath:
+            filename = path.join(searchpath, *pieces)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            version = '%r:%d:%d:%s' % (
+                getattr(st, 'st_mtime_ns', st.st_mtime), st.st_size,
+                st.st_ino, self.encoding)
+            return version, filename, self._get_uptodate(filename,
+                                                         st.st_mtime)
         raise TemplateNotFound(template)
 
+    def _get_uptodate(self, filename, mtime):
+        if self.watcher is not None:
+            return self.watcher.watch(path.abspath(filename), mtime)
+        return _mtime_uptodate(filename, mtime)
+
+    def close(self):
+        """Stop watching the template files if a watcher is used."""
+        watcher = self.watcher
+        if watcher is not None:
+            self.watcher = None
+            watcher.stop()
+
     def list_templates(self):
         found = set()
         for searchpath in self.searchpath:
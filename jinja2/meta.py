@@ -9,9 +9,14 @@
     :copyright: (c) 2010 by the Jinja Team, see AUTHORS for more details.
     :license: BSD, see LICENSE for more details.
 """
+import weakref
 from jinja2 import nodes
 from jinja2.compiler import CodeGenerator
-from jinja2._compat import string_types
+from jinja2.defaults import SNIPPET_TEMPLATE_FORMAT, SECTION_TEMPLATE_FORMAT
+from jinja2.exceptions import TemplateNotFound, TemplateSyntaxError
+from jinja2.utils import missing
+from jinja2.visitor import NodeVisitor
+from jinja2._compat import string_types, iteritems, itervalues
 
 
 class TrackingCodeGenerator(CodeGenerator):
@@ -71,33 +76,431 @@ def find_referenced_templates(ast):
     """
     for node in ast.find_all((nodes.Extends, nodes.FromImport, nodes.Import,
                               nodes.Include)):
-        if not isinstance(node.template, nodes.Const):
-            # a tuple with some non consts in there
-            if isinstance(node.template, (nodes.Tuple, nodes.List)):
-                for template_name in node.template.items:
-                    # something const, only yield the strings and ignore
-                    # non-string consts that really just make no sense
-                    if isinstance(template_name, nodes.Const):
-                        if isinstance(template_name.value, string_types):
-                            yield template_name.value
-                    # something dynamic in there
-                    else:
-                        yield None
-            # something dynamic we don't know about here
-            else:
-                yield None
-            continue
-        # constant is a basestring, direct template name
-        if isinstance(node.template.value, string_types):
-            yield node.template.value
-        # a tuple or list (latter *should* not happen) made of consts,
-        # yield the consts that are strings.  We could warn here for
-        # non string values
-        elif isinstance(node, nodes.Include) and \
-             isinstance(node.template.value, (tuple, list)):
-            for template_name in node.template.value:
-                if isinstance(template_name, string_types):
-                    yield template_name
-        # something else we don't care about, we could warn here
+        for template_name in _iter_template_names(node):
+            yield template_name
+
+
+def _iter_template_names(node):
+    """Yields the template names referenced by an include-like node, `None`
+    for the ones that are not known at compile time.
+    """
+    if not isinstance(node.template, nodes.Const):
+        # a tuple with some non consts in there
+        if isinstance(node.template, (nodes.Tuple, nodes.List)):
+            for template_name in node.template.items:
+                # something const, only yield the strings and ignore
+                # non-string consts that really just make no sense
+                if isinstance(template_name, nodes.Const):
+                    if isinstance(template_name.value, string_types):
+                        yield template_name.value
+                # something dynamic in there
+                else:
+                    yield None
+        # something dynamic we don't know about here
         else:
             yield None
+        return
+    # constant is a basestring, direct template name
+    if isinstance(node.template.value, string_types):
+        yield node.template.value
+    # a tuple or list (latter *should* not happen) made of consts,
+    # yield the consts that are strings.  We could warn here for
+    # non string values
+    elif isinstance(node, (nodes.Include, nodes.Section, nodes.Render)) and \
+         isinstance(node.template.value, (tuple, list)):
+        for template_name in node.template.value:
+            if isinstance(template_name, string_types):
+                yield template_name
+    # something else we don't care about, we could warn here
+    else:
+        yield None
+
+
+#: the name formats the liquid tags apply to the template names
+_template_formats = {
+    nodes.Include:  SNIPPET_TEMPLATE_FORMAT,
+    nodes.Render:   SNIPPET_TEMPLATE_FORMAT,
+    nodes.Section:  SECTION_TEMPLATE_FORMAT
+}
+
+
+def find_template_dependencies(ast):
+    """Like :func:`find_referenced_templates` but also finds sections and
+    render tags and yields the names the templates are actually loaded
+    with.  Includes and renders are looked up in the ``snippets`` folder,
+    sections in the ``sections`` folder.
+
+    >>> from jinja2 import Environment, meta
+    >>> env = Environment()
+    >>> ast = env.parse('{% extends "layout.html" %}{% section "header" %}')
+    >>> list(meta.find_template_dependencies(ast))
+    ['layout.html', 'sections/header.liquid']
+
+    .. versionadded:: 2.9
+    """
+    for node in ast.find_all((nodes.Extends, nodes.FromImport, nodes.Import,
+                              nodes.Include, nodes.Section, nodes.Render)):
+        fmt = _template_formats.get(type(node))
+        for template_name in _iter_template_names(node):
+            if template_name is not None and fmt is not None:
+                template_name = fmt.format(template_name)
+            yield template_name
+
+
+class DependencyGraph(object):
+    """The graph of the templates that extend, import, include, render or
+    load as section other templates.  It is created for all templates of
+    the loader with :meth:`Environment.build_dependency_graph` and kept up
+    to date by calling :meth:`update` or :meth:`invalidate` whenever a
+    template changes.
+
+    `dependencies` maps template names to the set of templates they
+    reference, `dependents` is the reverse mapping.  Templates that load
+    other templates by names only known at runtime are in `dynamic`, they
+    are considered to depend on every template.
+
+    .. versionadded:: 2.9
+    """
+
+    def __init__(self, environment):
+        self.environment = environment
+        self.dependencies = {}
+        self.dependents = {}
+        self.dynamic = set()
+
+    def build(self, names):
+        """Add the templates with the given names to the graph."""
+        for name in names:
+            self.update(name)
+        return self
+
+    def update(self, name):
+        """Scan the template again after it was changed, added or removed.
+        Templates that cannot be loaded or parsed have no dependencies.
+        """
+        for dependency in self.dependencies.pop(name, ()):
+            dependents = self.dependents[dependency]
+            dependents.discard(name)
+            if not dependents:
+                del self.dependents[dependency]
+        self.dynamic.discard(name)
+
+        environment = self.environment
+        try:
+            source, filename = environment.loader.get_source(
+                environment, name)[:2]
+            ast = environment.parse(source, name, filename)
+        except (TemplateNotFound, TemplateSyntaxError):
+            return
+
+        dependencies = set()
+        for template_name in find_template_dependencies(ast):
+            if template_name is None:
+                self.dynamic.add(name)
+            else:
+                dependencies.add(environment.join_path(template_name, name))
+        self.dependencies[name] = dependencies
+        for dependency in dependencies:
+            self.dependents.setdefault(dependency, set()).add(name)
+
+    def closure(self, name):
+        """Return the set of templates the template `name` depends on
+        directly or indirectly, including the template itself.  Templates
+        that are not part of the graph yet are scanned.
+        """
+        rv = set()
+        pending = [name]
+        while pending:
+            template_name = pending.pop()
+            if template_name in rv:
+                continue
+            rv.add(template_name)
+            if template_name not in self.dependencies:
+                self.update(template_name)
+            pending.extend(self.dependencies.get(template_name, ()))
+        return rv
+
+    def affected(self, name):
+        """Return the set of templates whose output depends on the template
+        `name`, including the template itself.
+        """
+        rv = set()
+        pending = [name] + list(self.dynamic)
+        while pending:
+            template_name = pending.pop()
+            if template_name in rv:
+                continue
+            rv.add(template_name)
+            pending.extend(self.dependents.get(template_name, ()))
+        return rv
+
+    def invalidate(self, name):
+        """Update the graph after the template `name` changed and remove the
+        affected templates from the template cache of the environment and
+        their fragments from the fragment cache, if there is one.  Returns
+        the set of affected templates.
+        """
+        self.update(name)
+        affected = self.affected(name)
+        environment = self.environment
+        if environment.cache is not None:
+            loader = weakref.ref(environment.loader)
+            for template_name in affected:
+                try:
+                    del environment.cache[loader, template_name]
+                except KeyError:
+                    pass
+        fragment_cache = getattr(environment, 'fragment_cache', None)
+        if fragment_cache is not None:
+            fragment_cache.delete_templates(affected)
+        return affected
+
+
+def _split_path(node):
+    """Splits a chain of attribute and item lookups into the node the chain
+    starts with, the path as tuple and the list of item keys that are not
+    constant.  Their place in the path is taken by ``'*'``.
+    """
+    path = []
+    dynamic = []
+    while isinstance(node, (nodes.Getattr, nodes.Getitem)):
+        if isinstance(node, nodes.Getattr):
+            path.append(node.attr)
+        elif isinstance(node.arg, nodes.Const) and \
+             not isinstance(node.arg.value, (tuple, list)):
+            path.append(node.arg.value)
+        else:
+            path.append('*')
+            dynamic.append(node.arg)
+        node = node.node
+    path.reverse()
+    return node, tuple(path), dynamic
+
+
+class DataRequirementsVisitor(NodeVisitor):
+    """Collects the attribute and item paths read from the context.  Local
+    names are mapped to the path they alias in `aliases` or to `None` if
+    they are not an alias of a context variable.  Templates rendered with
+    an isolated context, like the snippets of render tags, can't read the
+    context, their free names are no requirements if `isolated` is set.
+    """
+
+    def __init__(self, environment, name=None, follow_includes=True):
+        self.environment = environment
+        self.name = name
+        self.follow_includes = follow_includes
+        self.requirements = {}
+        self.aliases = {}
+        self.isolated = False
+        self.loading = set()
+
+    def require(self, name, path):
+        alias = self.aliases.get(name, missing)
+        if alias is None or (alias is missing and self.isolated):
+            return
+        if alias is not missing:
+            name, path = alias[0], alias[1] + path
+        self.requirements.setdefault(name, set()).add(path)
+
+    def resolve(self, node):
+        """Return the ``(name, path)`` tuple of the context variable a path
+        expression points to, `None` if the node is not such an expression.
+        """
+        node, path, dynamic = _split_path(node)
+        if dynamic or not isinstance(node, nodes.Name) or node.ctx != 'load':
+            return None
+        alias = self.aliases.get(node.name, missing)
+        if alias is None or (alias is missing and self.isolated):
+            return None
+        if alias is missing:
+            return node.name, path
+        return alias[0], alias[1] + path
+
+    def bind(self, target, node=None):
+        """Bind the names of an assignment target.  If `node` is a path
+        expression and the target a single name, the name becomes an alias.
+        Returns the old bindings for :meth:`unbind`.
+        """
+        alias = None
+        if node is not None and isinstance(target, nodes.Name):
+            alias = self.resolve(node)
+        if alias is None and node is not None:
+            self.visit(node)
+        if isinstance(target, string_types):
+            names = [target]
+        else:
+            names = [x.name for x in target.find_all(nodes.Name)]
+            if isinstance(target, nodes.Name):
+                names.append(target.name)
+        old = {}
+        for name in names:
+            old[name] = self.aliases.get(name, missing)
+            self.aliases[name] = alias
+        return old
+
+    def unbind(self, old):
+        for name, alias in iteritems(old):
+            if alias is missing:
+                self.aliases.pop(name, None)
+            else:
+                self.aliases[name] = alias
+
+    def visit_Name(self, node):
+        if node.ctx == 'load':
+            self.require(node.name, ())
+
+    def visit_Getattr(self, node):
+        node, path, dynamic = _split_path(node)
+        for arg in dynamic:
+            self.visit(arg)
+        if isinstance(node, nodes.Name) and node.ctx == 'load':
+            self.require(node.name, path)
+        else:
+            self.visit(node)
+
+    visit_Getitem = visit_Getattr
+
+    def visit_Assign(self, node):
+        self.bind(node.target, node.node)
+
+    def visit_AssignBlock(self, node):
+        for child in node.body:
+            self.visit(child)
+        self.bind(node.target)
+
+    def visit_For(self, node):
+        alias = None
+        if isinstance(node.target, nodes.Name):
+            alias = self.resolve(node.iter)
+        if alias is None:
+            self.visit(node.iter)
+        old = self.bind(node.target)
+        if alias is not None:
+            self.aliases[node.target.name] = (alias[0], alias[1] + ('*',))
+        old.update(self.bind('forloop'))
+        if node.test is not None:
+            self.visit(node.test)
+        for child in node.body:
+            self.visit(child)
+        self.unbind(old)
+        for child in node.else_:
+            self.visit(child)
+
+    def visit_Macro(self, node):
+        for child in node.defaults:
+            self.visit(child)
+        old = {}
+        for target in node.args + ['caller', 'varargs', 'kwargs']:
+            old.update(self.bind(target))
+        for child in node.body:
+            self.visit(child)
+        self.unbind(old)
+        if isinstance(node, nodes.Macro):
+            self.bind(node.name)
+        else:
+            self.visit(node.call)
+
+    visit_CallBlock = visit_Macro
+
+    def visit_Import(self, node):
+        self.visit(node.template)
+        self.bind(node.target)
+
+    def visit_FromImport(self, node):
+        self.visit(node.template)
+        for name in node.names:
+            if isinstance(name, tuple):
+                name = name[1]
+            self.bind(name)
+
+    def visit_Extends(self, node):
+        self.visit(node.template)
+        self.follow(node, None, self.aliases)
+
+    def visit_Include(self, node, fmt=SNIPPET_TEMPLATE_FORMAT):
+        self.visit(node.template)
+        if node.with_context:
+            self.follow(node, fmt, self.aliases)
+        else:
+            self.follow(node, fmt, {}, isolated=True)
+
+    def visit_Section(self, node):
+        self.visit_Include(node, SECTION_TEMPLATE_FORMAT)
+
+    def visit_Render(self, node):
+        self.visit(node.template)
+        aliases = {}
+        for argument in node.arguments:
+            alias = self.resolve(argument.value)
+            if alias is None:
+                self.visit(argument.value)
+            aliases[argument.key] = alias
+        self.follow(node, SNIPPET_TEMPLATE_FORMAT, aliases, isolated=True)
+
+    def follow(self, node, fmt, aliases, isolated=False):
+        """Visit the templates loaded by an include-like node with the
+        given local names.  If a template is not known at compile time or
+        cannot be loaded, the aliases it gets are required as a whole.
+        `isolated` templates don't see the context of the current one.
+        """
+        complete = self.follow_includes and \
+            self.environment.loader is not None
+        for template_name in _iter_template_names(node):
+            if not complete or template_name is None:
+                complete = False
+                break
+            if fmt is not None:
+                template_name = fmt.format(template_name)
+            template_name = self.environment.join_path(template_name,
+                                                       self.name)
+            if template_name in self.loading:
+                continue
+            try:
+                source, filename = self.environment.loader.get_source(
+                    self.environment, template_name)[:2]
+                ast = self.environment.parse(source, template_name, filename)
+            except (TemplateNotFound, TemplateSyntaxError):
+                complete = False
+                continue
+            old = self.name, self.aliases, self.isolated
+            self.name, self.aliases = template_name, dict(aliases)
+            self.isolated = self.isolated or isolated
+            self.loading.add(template_name)
+            try:
+                self.visit(ast)
+            finally:
+                self.loading.discard(template_name)
+                self.name, self.aliases, self.isolated = old
+        if not complete:
+            for alias in itervalues(aliases):
+                if alias is not None:
+                    self.requirements.setdefault(alias[0], set()).add(alias[1])
+
+
+def find_data_requirements(ast, name=None, follow_includes=True):
+    """Returns a dict that maps the variables the template looks up from the
+    context to the set of attribute and item paths it reads from them.  A
+    path is a tuple of attribute names and item keys, ``'*'`` stands for
+    every item of a loop or an item with a key only known at runtime.  The
+    empty path means that the variable itself is used.
+
+    Variables assigned from paths and loop targets are aliases of the path
+    they come from.  The templates loaded by constant includes, sections,
+    render tags and extends are analyzed as well unless `follow_includes`
+    is `False`.  `name` is the name of the template, it's needed to look up
+    included templates by relative names.
+
+    >>> from jinja2 import Environment, meta
+    >>> env = Environment()
+    >>> ast = env.parse('{% for v in product.variants %}{{ v.price }}'
+    ...                 '{% endfor %}{{ product.images[0].src }}')
+    >>> sorted(meta.find_data_requirements(ast)['product'])
+    [('images', 0, 'src'), ('variants', '*', 'price')]
+
+    .. versionadded:: 2.9
+    """
+    visitor = DataRequirementsVisitor(ast.environment, name, follow_includes)
+    if name is not None:
+        visitor.loading.add(name)
+    visitor.visit(ast)
+    return visitor.requirements
@@ -17,7 +17,7 @@ import operator
 
 from collections import deque
 from jinja2.utils import Markup
-from jinja2._compat import izip, with_metaclass, text_type
+from jinja2._compat import izip, with_metaclass, text_type, iteritems
 
 
 #: the types we support for context functions
@@ -59,16 +59,21 @@ class Impossible(Exception):
 class NodeType(type):
     """A metaclass for nodes that handles the field and attribute
     inheritance.  fields and attributes from the parent class are
-    automatically forwarded to the child."""
+    automatically forwarded to the child.  The slots of a node class are
+    the fields and attributes it adds, so nodes have no instance dict."""
 
     def __new__(cls, name, bases, d):
+        inherited = set()
         for attr in 'fields', 'attributes':
             storage = []
             storage.extend(getattr(bases[0], attr, ()))
+            inherited.update(storage)
             storage.extend(d.get(attr, ()))
             assert len(bases) == 1, 'multiple inheritance not allowed'
             assert len(storage) == len(set(storage)), 'layout conflict'
             d[attr] = tuple(storage)
+        d.setdefault('__slots__', tuple(
+            x for x in d['fields'] + d['attributes'] if x not in inherited))
         d.setdefault('abstract', False)
         return type.__new__(cls, name, bases, d)
 
@@ -225,6 +230,19 @@ class Node(with_metaclass(NodeType, object)):
             todo.extend(node.iter_child_nodes())
         return self
 
+    def __getstate__(self):
+        rv = {}
+        for name in self.fields + self.attributes:
+            try:
+                rv[name] = getattr(self, name)
+            except AttributeError:
+                pass
+        return rv
+
+    def __setstate__(self, state):
+        for name, value in iteritems(state):
+            setattr(self, name, value)
+
     def __eq__(self, other):
         return type(self) is type(other) and \
                tuple(self.iter_fields()) == tuple(other.iter_fields())
@@ -323,6 +341,13 @@ class Section(Stmt):
     fields = ('template', 'with_context', 'ignore_missing')
 
 
+class Render(Stmt):
+    """A node that represents the render tag.  `arguments` is a list of
+    :class:`Keyword` nodes with the variables passed to the template.
+    """
+    fields = ('template', 'arguments')
+
+
 class Import(Stmt):
     """A node that represents the import tag."""
     fields = ('template', 'target', 'with_context')
@@ -16,7 +16,8 @@ from jinja2._compat import imap
 
 _statement_keywords = frozenset(['for', 'if', 'unless', 'block', 'extends',
                                  'print', 'macro', 'include', 'section',
-                                 'from', 'import', 'set', 'assign', 'capture'])
+                                 'render', 'from', 'import', 'set', 'assign',
+                                 'capture'])
 _compare_operators = frozenset(['eq', 'ne', 'lt', 'lteq', 'gt', 'gteq'])
 
 
@@ -277,6 +278,18 @@ class Parser(object):
     def parse_section(self):
         return self.parse_include(node_cls=nodes.Section)
 
+    def parse_render(self):
+        node = nodes.Render(lineno=next(self.stream).lineno)
+        node.template = self.parse_expression()
+        node.arguments = []
+        while self.stream.skip_if('comma'):
+            token = self.stream.expect('name')
+            self.stream.expect('colon')
+            value = self.parse_expression(with_filter=False)
+            node.arguments.append(nodes.Keyword(token.value, value,
+                                                lineno=token.lineno))
+        return node
+
     def parse_import(self):
         node = nodes.Import(lineno=next(self.stream).lineno)
         node.template = self.parse_expression()
@@ -10,14 +10,17 @@
 """
 import sys
 
+from collections import deque
 from itertools import chain
+from threading import local
 from jinja2.nodes import EvalContext, _context_function_types
 from jinja2.utils import Markup, soft_unicode, escape, missing, concat, \
      internalcode, object_type_repr, is_falsy, is_truthy
 from jinja2.exceptions import UndefinedError, TemplateRuntimeError, \
      TemplateNotFound
 from jinja2._compat import imap, text_type, iteritems, \
-     implements_iterator, implements_to_string, string_types, PY2
+     implements_iterator, implements_to_string, string_types, \
+     integer_types, PY2
 
 
 # these variables are exported to the template runtime
@@ -25,7 +28,8 @@ __all__ = ['LoopContext', 'TemplateReference', 'Macro', 'Markup',
            'TemplateRuntimeError', 'missing', 'concat', 'escape',
            'markup_join', 'unicode_join', 'to_string', 'identity',
            'TemplateNotFound', 'make_logging_undefined', 'is_falsy',
-           'is_truthy']
+           'is_truthy', 'BlockReference', 'make_render_key',
+           'submit_section', 'resolve_events']
 
 #: the name of the function that is used to convert something into
 #: a string.  We can just use the text type here.
@@ -36,6 +40,9 @@ identity = lambda x: x
 
 _last_iteration = object()
 
+# the argument types for which the output of a render tag is memoized
+_immutable_types = string_types + integer_types + (float, type(None))
+
 
 def markup_join(seq):
     """Concatenation that escapes if necessary and converts to unicode."""
@@ -53,6 +60,140 @@ def unicode_join(seq):
     return concat(imap(text_type, seq))
 
 
+def _make_value_key(value):
+    """Return the key of an argument value or `None` if the value could
+    change between two renders.  The key contains the types of the values
+    because equal values of different types, like ``Markup('<b>')`` and
+    ``'<b>'`` or ``1`` and ``True``, render differently.
+    """
+    if isinstance(value, tuple):
+        items = []
+        for item in value:
+            item = _make_value_key(item)
+            if item is None:
+                return None
+            items.append(item)
+        return tuple, tuple(items)
+    if isinstance(value, _immutable_types):
+        return type(value), value
+    return None
+
+
+def make_render_key(template, arguments):
+    """Return the key under which the output of a render tag is memoized or
+    `None` if one of the arguments is an object that could change between
+    two renders.
+    """
+    key = []
+    for name, value in iteritems(arguments):
+        value = _make_value_key(value)
+        if value is None:
+            return None
+        key.append((name, value))
+    key.sort()
+    return template, tuple(key)
+
+
+class DeferredOutput(object):
+    """The output of a section that is rendered by the section executor of
+    the environment.  Events of this type are replaced with the rendered
+    string by :func:`resolve_events`.
+    """
+    __slots__ = ('future',)
+
+    def __init__(self, future):
+        self.future = future
+
+
+# per thread state of the section executor: `in_section` is set in the
+# worker threads while a section renders, `pending` holds the futures of
+# the sections submitted by the render that is running in the thread and
+# may still run.
+_section_state = local()
+
+
+def _render_section(template, context):
+    _section_state.in_section = True
+    try:
+        return concat(template.root_render_func(context))
+    finally:
+        _section_state.in_section = False
+
+
+def submit_section(environment, template, context):
+    """Render a section or isolated snippet on the section executor of the
+    environment and return a :class:`DeferredOutput` for it.  Sections
+    reached while rendering a section are rendered in place so that the
+    workers never wait for each other.  If more than `section_concurrency`
+    sections submitted by the current render are still running, the oldest
+    one is waited for first.
+    """
+    executor = environment.section_executor
+    if executor is None or getattr(_section_state, 'in_section', False):
+        return concat(template.root_render_func(context))
+    pending = getattr(_section_state, 'pending', None)
+    if pending is None:
+        pending = _section_state.pending = deque()
+    while pending and pending[0].done():
+        pending.popleft()
+    limit = environment.section_concurrency
+    while limit is not None and len(pending) >= limit:
+        # waits without raising, errors are raised in document order
+        # when the output is resolved.
+        pending.popleft().exception()
+    future = executor.submit(_render_section, template, context)
+    pending.append(future)
+    return DeferredOutput(future)
+
+
+def _track_sections(events, pending):
+    """Iterate over the events of a render function with `pending` as the
+    futures of the sections the render submits.
+    """
+    events = iter(events)
+    while 1:
+        outer = getattr(_section_state, 'pending', None)
+        _section_state.pending = pending
+        try:
+            event = next(events)
+        except StopIteration:
+            return
+        finally:
+            _section_state.pending = outer
+        yield event
+
+
+def resolve_events(events, new_render=False):
+    """Iterate over the events of a render function and put the output of
+    deferred sections in place.  The render function keeps running while
+    sections are rendered, events after a section that is not finished yet
+    are held back.  If a section failed its exception is raised when the
+    section is reached.
+
+    If `new_render` is true the events are the output of a render of its
+    own, the sections it submits are limited by `section_concurrency`
+    independently of other renders that run in the same thread.
+    """
+    if new_render:
+        events = _track_sections(events, deque())
+    held = deque()
+    for event in events:
+        if not held and event.__class__ is not DeferredOutput:
+            yield event
+            continue
+        held.append(event)
+        while held and (held[0].__class__ is not DeferredOutput or
+                        held[0].future.done()):
+            event = held.popleft()
+            if event.__class__ is DeferredOutput:
+                event = event.future.result()
+            yield event
+    for event in held:
+        if event.__class__ is DeferredOutput:
+            event = event.future.result()
+        yield event
+
+
 def new_context(environment, template_name, blocks, vars=None,
                 shared=None, globals=None, locals=None):
     """Internal helper to for context creation."""
@@ -275,7 +416,10 @@ class BlockReference(object):
 
     @internalcode
     def __call__(self):
-        rv = concat(self._stack[self._depth](self._context))
+        events = self._stack[self._depth](self._context)
+        if self._context.environment.section_executor is not None:
+            events = resolve_events(events)
+        rv = concat(events)
         if self._context.eval_ctx.autoescape:
             rv = Markup(rv)
         return rv
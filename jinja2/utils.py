@@ -8,10 +8,13 @@
     :copyright: (c) 2010 by the Jinja Team.
     :license: BSD, see LICENSE for more details.
 """
+import os
 import re
 import errno
 from collections import deque
-from threading import Lock
+from hashlib import sha1
+from itertools import count
+from threading import Event, Lock
 from jinja2._compat import text_type, string_types, implements_iterator, \
      url_quote
 
@@ -37,6 +40,13 @@ internal_code = set()
 
 concat = u''.join
 
+# async generators (and with them async rendering) need python 3.6
+try:
+    exec('async def _():\n async for _ in ():\n  yield _')
+    have_async_gen = True
+except SyntaxError:
+    have_async_gen = False
+
 
 def contextfunction(f):
     """This decorator can be used to mark a function or method context callable.
@@ -170,6 +180,28 @@ def open_if_exists(filename, mode='rb'):
             raise
 
 
+def fork_pool(processes, initializer=None, initargs=()):
+    """Return a :class:`multiprocessing.Pool` with `processes` workers that
+    are forked from the current process, so that they share everything that
+    was loaded before.  The `initargs` are inherited by the workers instead
+    of being pickled.  Returns `None` on platforms without ``fork``.
+    """
+    if not hasattr(os, 'fork'):
+        return None
+    import multiprocessing
+    get_context = getattr(multiprocessing, 'get_context', None)
+    if get_context is not None:
+        return get_context('fork').Pool(processes, initializer, initargs)
+    return multiprocessing.Pool(processes, initializer, initargs)
+
+
+def template_checksum(source):
+    """Returns a checksum for the source of a template."""
+    if isinstance(source, text_type):
+        source = source.encode('utf-8')
+    return sha1(source).hexdigest()
+
+
 def object_type_repr(obj):
     """Returns the name of the object's type.  For some recognized
     singletons the name of the object is returned instead. (For
@@ -495,10 +527,351 @@ class LRUCache(object):
     __copy__ = copy
 
 
-# register the LRU cache as mutable mapping if possible
+# the fields of the links in the doubly linked lists of the
+# `ConcurrentLRUCache` segments.
+_PREV, _NEXT, _KEY, _VALUE, _STAMP = range(5)
+
+
+class _CacheSegment(object):
+    """One segment of a :class:`ConcurrentLRUCache`.  It holds a dict that
+    maps keys to links of a circular doubly linked list.  The link right
+    after the root is the least recently used one, the link right before
+    the root is the most recently used one.  All modifications of the list
+    must happen with the lock held.
+    """
+
+    def __init__(self):
+        self.mapping = {}
+        self.root = root = []
+        root[:] = [root, root, None, None, -1]
+        self.lock = Lock()
+
+    def _unlink(self, link):
+        prev, next = link[_PREV], link[_NEXT]
+        prev[_NEXT] = next
+        next[_PREV] = prev
+
+    def _append(self, link):
+        root = self.root
+        last = root[_PREV]
+        last[_NEXT] = root[_PREV] = link
+        link[_PREV] = last
+        link[_NEXT] = root
+
+    def promote(self, link):
+        """Move an existing link to the most recently used position."""
+        self._unlink(link)
+        self._append(link)
+
+    def set(self, key, value, stamp):
+        """Insert or update an item.  Return `True` if the item is new."""
+        link = self.mapping.get(key)
+        if link is not None:
+            link[_VALUE] = value
+            link[_STAMP] = stamp
+            self.promote(link)
+            return False
+        link = [None, None, key, value, stamp]
+        self._append(link)
+        self.mapping[key] = link
+        return True
+
+    def evict(self):
+        """Remove the least recently used item.  Return `False` if the
+        segment is empty.
+        """
+        oldest = self.root[_NEXT]
+        if oldest is self.root:
+            return False
+        self._unlink(oldest)
+        del self.mapping[oldest[_KEY]]
+        return True
+
+    def remove(self, key):
+        """Remove an item.  Raise a `KeyError` if it does not exist."""
+        link = self.mapping.pop(key)
+        self._unlink(link)
+
+    def clear(self):
+        self.mapping.clear()
+        root = self.root
+        root[_PREV] = root[_NEXT] = root
+
+    def links(self):
+        """Return a list of all links, oldest first."""
+        result = []
+        root = self.root
+        link = root[_NEXT]
+        while link is not root:
+            result.append(link)
+            link = link[_NEXT]
+        return result
+
+
+class ConcurrentLRUCache(object):
+    """A thread safe LRU cache with constant time lookups, insertions and
+    promotions.  This is the cache used for templates by the environment.
+
+    The cache is split into `segments` that each hold their own lock and
+    their own recently-used list.  A key always lives in the same segment,
+    so writes to different segments don't block each other.  Reads never
+    wait for a lock: if the segment is busy the item is returned without
+    being moved to the front.  The segments share the capacity, a write to
+    a full cache evicts the oldest of the least recently used items of the
+    segments.  As a result the eviction order is a close approximation of
+    a strict LRU order, which is good enough for caching templates.
+
+    If `segments` is not given, small caches use a single segment (which
+    makes them behave like a strict LRU cache) and larger caches use up to
+    sixteen.
+
+    .. versionadded:: 2.9
+    """
+
+    def __init__(self, capacity, segments=None):
+        if segments is None:
+            segments = min(16, capacity // 100)
+        segments = max(1, min(segments, capacity))
+        self.capacity = capacity
+        self._segments = tuple(_CacheSegment() for idx in range(segments))
+        self._clock = count()
+        self._size = 0
+        self._size_lock = Lock()
+
+    def _segment(self, key):
+        segments = self._segments
+        if len(segments) == 1:
+            return segments[0]
+        return segments[hash(key) % len(segments)]
+
+    def __getstate__(self):
+        return {
+            'capacity':     self.capacity,
+            'segments':     len(self._segments),
+            'items':        list(reversed(self.items()))
+        }
+
+    def __setstate__(self, d):
+        self.__init__(d['capacity'], d['segments'])
+        for key, value in d['items']:
+            self[key] = value
+
+    def __getnewargs__(self):
+        return (self.capacity,)
+
+    def copy(self):
+        """Return a shallow copy of the instance."""
+        rv = self.__class__(self.capacity, len(self._segments))
+        for key, value in reversed(self.items()):
+            rv[key] = value
+        return rv
+
+    def get(self, key, default=None):
+        """Return an item from the cache dict or `default`"""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        """Set `default` if the key is not in the cache otherwise
+        leave unchanged. Return the value of this key.
+        """
+        segment = self._segment(key)
+        with segment.lock:
+            link = segment.mapping.get(key)
+            if link is not None:
+                return link[_VALUE]
+            segment.set(key, default, next(self._clock))
+        self._added()
+        return default
+
+    def _added(self):
+        """Account for a new item and evict one item if the cache is over
+        capacity.  Every new item over capacity evicts exactly one item, so
+        concurrent writes never evict too many.
+        """
+        with self._size_lock:
+            self._size += 1
+            if self._size <= self.capacity:
+                return
+        while True:
+            victim = None
+            for segment in self._segments:
+                link = segment.root[_NEXT]
+                if link is not segment.root and \
+                   (victim is None or link[_STAMP] < stamp):
+                    victim = segment
+                    stamp = link[_STAMP]
+            if victim is None:
+                return
+            with victim.lock:
+                if not victim.evict():
+                    continue
+            with self._size_lock:
+                self._size -= 1
+            return
+
+    def clear(self):
+        """Clear the cache."""
+        for segment in self._segments:
+            with segment.lock:
+                with self._size_lock:
+                    self._size -= len(segment.mapping)
+                segment.clear()
+
+    def __contains__(self, key):
+        """Check if a key exists in this cache."""
+        return key in self._segment(key).mapping
+
+    def __len__(self):
+        """Return the current size of the cache."""
+        return sum(len(x.mapping) for x in self._segments)
+
+    def __repr__(self):
+        return '<%s %r>' % (
+            self.__class__.__name__,
+            dict(self.items())
+        )
+
+    def __getitem__(self, key):
+        """Get an item from the cache.  Moves the item up so that it has the
+        highest priority then, unless the segment is locked by another
+        thread at that moment.
+
+        Raise a `KeyError` if it does not exist.
+        """
+        segment = self._segment(key)
+        link = segment.mapping[key]
+        link[_STAMP] = next(self._clock)
+        if link[_NEXT] is not segment.root and segment.lock.acquire(False):
+            try:
+                # the link might have been evicted since we looked it up
+                if segment.mapping.get(key) is link:
+                    segment.promote(link)
+            finally:
+                segment.lock.release()
+        return link[_VALUE]
+
+    def __setitem__(self, key, value):
+        """Sets the value for an item. Moves the item up so that it
+        has the highest priority then.
+        """
+        segment = self._segment(key)
+        with segment.lock:
+            added = segment.set(key, value, next(self._clock))
+        if added:
+            self._added()
+
+    def __delitem__(self, key):
+        """Remove an item from the cache dict.
+        Raise a `KeyError` if it does not exist.
+        """
+        segment = self._segment(key)
+        with segment.lock:
+            segment.remove(key)
+        with self._size_lock:
+            self._size -= 1
+
+    def _links(self):
+        links = []
+        for segment in self._segments:
+            with segment.lock:
+                links.extend(segment.links())
+        links.sort(key=lambda x: x[_STAMP], reverse=True)
+        return links
+
+    def items(self):
+        """Return a list of items, most recently used first."""
+        return [(link[_KEY], link[_VALUE]) for link in self._links()]
+
+    def iteritems(self):
+        """Iterate over all items."""
+        return iter(self.items())
+
+    def values(self):
+        """Return a list of all values."""
+        return [x[1] for x in self.items()]
+
+    def itervalue(self):
+        """Iterate over all values."""
+        return iter(self.values())
+
+    def keys(self):
+        """Return a list of all keys ordered by most recent usage."""
+        return list(self)
+
+    def iterkeys(self):
+        """Iterate over all keys in the cache dict, ordered by
+        the most recent usage.
+        """
+        return iter([link[_KEY] for link in self._links()])
+
+    __iter__ = iterkeys
+
+    def __reversed__(self):
+        """Iterate over the keys in the cache dict, oldest items
+        coming first.
+        """
+        return reversed([link[_KEY] for link in self._links()])
+
+    __copy__ = copy
+
+
+class _Flight(object):
+    __slots__ = ('done', 'value', 'failed')
+
+    def __init__(self):
+        self.done = Event()
+        self.value = None
+        self.failed = True
+
+
+class SingleFlight(object):
+    """Calls a function only once at a time per key.  Threads calling
+    :meth:`do` with a key that is already in flight wait for the first call
+    and get its result.  If the first call raises an exception the waiting
+    threads call the function on their own.
+
+    .. versionadded:: 2.9
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = Lock()
+
+    def do(self, key, func):
+        """Return the result of `func` or of the call in flight for `key`."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.failed:
+                return func()
+            return flight.value
+
+        try:
+            flight.value = func()
+            flight.failed = False
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.value
+
+    def __len__(self):
+        return len(self._flights)
+
+
+# register the LRU caches as mutable mapping if possible
 try:
     from collections import MutableMapping
     MutableMapping.register(LRUCache)
+    MutableMapping.register(ConcurrentLRUCache)
 except ImportError:
     pass
 
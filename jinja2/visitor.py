@@ -8,9 +8,55 @@
     :copyright: (c) 2010 by the Jinja Team.
     :license: BSD.
 """
+from types import FunctionType
+
 from jinja2.nodes import Node
 
 
+def _find_function(cls, name):
+    """Return the function `name` of the class or `None`.  Attributes
+    that are not plain functions, like static methods, are looked up on the
+    visitor on every call.
+    """
+    for base in cls.__mro__:
+        if name in base.__dict__:
+            rv = base.__dict__[name]
+            if isinstance(rv, FunctionType):
+                return rv
+            return lambda self, *args, **kwargs: \
+                getattr(self, name)(*args, **kwargs)
+
+
+def _visit_with_get_visitor(self, node, *args, **kwargs):
+    f = self.get_visitor(node)
+    if f is not None:
+        return f(node, *args, **kwargs)
+    return self.generic_visit(node, *args, **kwargs)
+
+
+class _DispatchTable(dict):
+    """Maps node classes to the functions a visitor class calls for them,
+    the visitor function of the node or the generic visit function.
+    """
+
+    def __init__(self, visitor_class):
+        dict.__init__(self)
+        self.visitor_class = visitor_class
+        self.custom_get_visitor = \
+            _find_function(visitor_class, 'get_visitor') is not \
+            NodeVisitor.__dict__['get_visitor']
+
+    def __missing__(self, node_class):
+        if self.custom_get_visitor:
+            rv = _visit_with_get_visitor
+        else:
+            rv = _find_function(self.visitor_class,
+                                'visit_' + node_class.__name__) or \
+                _find_function(self.visitor_class, 'generic_visit')
+        self[node_class] = rv
+        return rv
+
+
 class NodeVisitor(object):
     """Walks the abstract syntax tree and call visitor functions for every
     node found.  The visitor functions may return values which will be
@@ -21,8 +67,14 @@ class NodeVisitor(object):
     be `visit_TryFinally`.  This behavior can be changed by overriding
     the `get_visitor` function.  If no visitor function exists for a node
     (return value `None`) the `generic_visit` visitor is used instead.
+
+    The visitor functions are looked up once per visitor and node class
+    and remembered, so methods added to a visitor class after it visited
+    nodes are not used.
     """
 
+    _dispatch_table = None
+
     def get_visitor(self, node):
         """Return the visitor function for this node or `None` if no visitor
         exists for this node.  In that case the generic visit function is
@@ -33,10 +85,11 @@ class NodeVisitor(object):
 
     def visit(self, node, *args, **kwargs):
         """Visit a node."""
-        f = self.get_visitor(node)
-        if f is not None:
-            return f(node, *args, **kwargs)
-        return self.generic_visit(node, *args, **kwargs)
+        table = self._dispatch_table
+        if table is None or table.visitor_class is not self.__class__:
+            table = self.__class__._dispatch_table = \
+                _DispatchTable(self.__class__)
+        return table[node.__class__](self, node, *args, **kwargs)
 
     def generic_visit(self, node, *args, **kwargs):
         """Called if no explicit visitor function exists for a node."""
@@ -17,6 +17,13 @@ from traceback import format_exception
 from jinja2 import loaders
 from jinja2._compat import PY2
 from jinja2 import Environment
+from jinja2.utils import have_async_gen
+
+
+def pytest_ignore_collect(path):
+    if 'async' in path.basename and not have_async_gen:
+        return True
+    return False
 
 
 @pytest.fixture
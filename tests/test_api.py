@@ -9,16 +9,20 @@
     :license: BSD, see LICENSE for more details.
 """
 import os
+import copy
+import pickle
 import tempfile
 import shutil
 
 import pytest
 from jinja2 import Environment, Undefined, DebugUndefined, \
      StrictUndefined, UndefinedError, meta, \
-     is_undefined, Template, DictLoader, make_logging_undefined
+     is_undefined, Template, DictLoader, make_logging_undefined, \
+     TemplateNotFound, TemplateSyntaxError, nodes
 from jinja2.compiler import CodeGenerator
 from jinja2.runtime import Context
 from jinja2.utils import Cycler
+from jinja2.visitor import NodeVisitor, NodeTransformer
 
 
 @pytest.mark.api
@@ -141,6 +145,105 @@ class TestMeta():
         i = meta.find_referenced_templates(ast)
         assert list(i) == ['foo.html', 'bar.html', None]
 
+    def test_find_template_dependencies(self, env):
+        ast = env.parse('{% extends "layout.html" %}'
+                        '{% include "price" %}{% section "header" %}'
+                        '{% render "card", product: product %}'
+                        '{% include helper %}')
+        i = meta.find_template_dependencies(ast)
+        assert list(i) == ['layout.html', 'snippets/price.liquid',
+                           'sections/header.liquid', 'snippets/card.liquid',
+                           None]
+
+    def test_dependency_graph(self):
+        loader = DictLoader({
+            'layout.html': '{% section "header" %}{% block body %}'
+                           '{% endblock %}',
+            'product.html': '{% extends "layout.html" %}{% block body %}'
+                            '{% render "price" %}{% endblock %}',
+            'page.html': '{% extends "layout.html" %}',
+            'sections/header.liquid': '{% include "logo" %}',
+            'snippets/logo.liquid': 'logo',
+            'snippets/price.liquid': 'price',
+        })
+        env = Environment(loader=loader)
+        graph = env.build_dependency_graph()
+        assert graph.dependencies['product.html'] == \
+            set(['layout.html', 'snippets/price.liquid'])
+        assert graph.affected('snippets/price.liquid') == \
+            set(['snippets/price.liquid', 'product.html'])
+        assert graph.affected('snippets/logo.liquid') == \
+            set(['snippets/logo.liquid', 'sections/header.liquid',
+                 'layout.html', 'product.html', 'page.html'])
+
+        for name in loader.list_templates():
+            env.get_template(name)
+        assert graph.invalidate('snippets/price.liquid') == \
+            set(['snippets/price.liquid', 'product.html'])
+        cached = set(key[1] for key in env.cache.keys())
+        assert cached == set(['layout.html', 'page.html',
+                              'sections/header.liquid',
+                              'snippets/logo.liquid'])
+
+        loader.mapping['page.html'] = '{% include name %}'
+        graph.update('page.html')
+        assert graph.dynamic == set(['page.html'])
+        assert 'page.html' in graph.affected('snippets/price.liquid')
+        del loader.mapping['page.html']
+        graph.update('page.html')
+        assert 'page.html' not in graph.dependencies
+        assert not graph.dynamic
+
+    def test_find_data_requirements(self, env):
+        ast = env.parse('{% assign v = product.variants.first %}'
+                        '{{ v.price }}{{ product.images[0].src }}'
+                        '{% for tag in product.tags %}{{ tag.title }}'
+                        '{{ forloop.index }}{% endfor %}'
+                        '{{ product.options[name] }}'
+                        '{% capture c %}{{ shop.name }}{% endcapture %}{{ c }}'
+                        '{% macro m(a) %}{{ a.b }}{% endmacro %}{{ m(x) }}')
+        x = meta.find_data_requirements(ast)
+        assert x == {
+            'product': set([('variants', 'first', 'price'),
+                            ('images', 0, 'src'), ('tags', '*', 'title'),
+                            ('options', '*')]),
+            'name': set([()]),
+            'shop': set([('name',)]),
+            'x': set([()])
+        }
+
+    def test_find_data_requirements_includes(self):
+        env = Environment(loader=DictLoader({
+            'snippets/card.liquid': '{{ item.title }}{{ shop.name }}',
+            'sections/footer.liquid': '{{ p.url }}{% include "card" %}',
+        }))
+        ast = env.parse('{% assign p = product %}{% section "footer" %}'
+                        '{% render "card", item: collection.products[0] %}'
+                        '{% include name %}')
+        x = meta.find_data_requirements(ast)
+        assert x == {
+            'product': set([('url',), ()]),
+            'collection': set([('products', 0, 'title')]),
+            'item': set([('title',)]),
+            'shop': set([('name',)]),
+            'name': set([()])
+        }
+        x = meta.find_data_requirements(ast, follow_includes=False)
+        assert x == {'product': set([()]), 'collection': set([('products', 0)]),
+                     'name': set([()])}
+
+    def test_find_data_requirements_isolated(self):
+        env = Environment(loader=DictLoader({
+            'snippets/r.liquid': '{{ item.title }}{{ products }}'
+                                 '{% include "inner" %}',
+            'snippets/inner.liquid': '{{ item.url }}{{ shop.name }}',
+            'snippets/plain.liquid': '{{ cart.count }}',
+        }))
+        ast = env.parse("{% render 'r', item: x %}"
+                        "{% include 'plain' without context %}")
+        x = meta.find_data_requirements(ast)
+        assert x == {'x': set([('title',), ('url',)])}
+
 
 @pytest.mark.api
 @pytest.mark.streaming
@@ -186,6 +289,221 @@ class TestStreaming():
             shutil.rmtree(tmp)
 
 
+@pytest.mark.api
+@pytest.mark.rendermany
+class TestRenderMany():
+    templates = {
+        'page': '{% include "header" %}{{ name }}',
+        'snippets/header.liquid': '[{{ title }}]',
+    }
+
+    def make_env(self):
+        return Environment(loader=DictLoader(self.templates), cache_size=-1)
+
+    def make_contexts(self, count):
+        return ({'title': 'T', 'name': str(i)} for i in range(count))
+
+    def test_inline(self):
+        env = self.make_env()
+        rv = list(env.render_many('page', self.make_contexts(3), workers=1))
+        assert rv == ['[T]0', '[T]1', '[T]2']
+        assert set(env.cache) and len(env.cache) == 2
+
+    def test_unordered_inline(self):
+        env = self.make_env()
+        rv = env.render_many('page', self.make_contexts(2), workers=1,
+                             ordered=False)
+        assert list(rv) == [(0, '[T]0'), (1, '[T]1')]
+
+    @pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+    def test_forked(self):
+        env = self.make_env()
+        rv = env.render_many('page', self.make_contexts(50), workers=2,
+                             chunksize=4)
+        assert list(rv) == ['[T]%d' % i for i in range(50)]
+
+    @pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+    def test_forked_unordered(self):
+        env = self.make_env()
+        rv = env.render_many('page', self.make_contexts(20), workers=2,
+                             chunksize=3, ordered=False)
+        assert sorted(rv) == [(i, '[T]%d' % i) for i in range(20)]
+
+    @pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+    def test_sink(self):
+        env = self.make_env()
+        tmp = tempfile.mkdtemp()
+        try:
+            def sink(index, context):
+                return os.path.join(tmp, '%d.txt' % index)
+            rv = list(env.render_many('page', self.make_contexts(5),
+                                      workers=2, sink=sink))
+            assert rv == [os.path.join(tmp, '%d.txt' % i) for i in range(5)]
+            with open(rv[3], 'rb') as f:
+                assert f.read() == b'[T]3'
+        finally:
+            shutil.rmtree(tmp)
+
+    @pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+    def test_worker_error(self):
+        env = Environment(loader=DictLoader({
+            'page': '{% include "missing" %}'
+        }))
+        rv = env.render_many('page', [{}] * 4, workers=2)
+        pytest.raises(TemplateNotFound, list, rv)
+
+    @pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+    def test_no_workers_before_iteration(self):
+        import multiprocessing
+        env = self.make_env()
+        children = len(multiprocessing.active_children())
+        rv = env.render_many('page', self.make_contexts(4), workers=2)
+        assert len(multiprocessing.active_children()) == children
+        del rv
+        assert len(multiprocessing.active_children()) == children
+
+    def test_missing_template(self):
+        env = self.make_env()
+        pytest.raises(TemplateNotFound, env.render_many, 'missing', [{}])
+
+
+@pytest.mark.api
+@pytest.mark.preload
+class TestPreload():
+    templates = {
+        'a.liquid': '{{ foo }}',
+        'b.liquid': '{% include "c" %}',
+        'snippets/c.liquid': 'c',
+        'broken.liquid': '{% if %}',
+        'notes.txt': 'not a template',
+    }
+
+    def test_preload(self):
+        env = Environment(loader=DictLoader(self.templates), cache_size=2)
+        report = env.preload(extensions=['liquid'], freeze=False)
+        assert sorted(report.templates) == ['a.liquid', 'b.liquid',
+                                            'snippets/c.liquid']
+        assert list(report.errors) == ['broken.liquid']
+        assert report.seconds >= 0
+        assert not report.frozen
+        assert env.cache.capacity >= 4
+        assert len(env.cache) == 3
+        assert 'templates' in repr(report)
+
+    def test_trace_memory(self):
+        env = Environment(loader=DictLoader(self.templates))
+        report = env.preload(['a.liquid'], freeze=False)
+        assert report.memory is None
+        try:
+            import tracemalloc
+        except ImportError:
+            return
+        report = env.preload(['b.liquid'], freeze=False, trace_memory=True)
+        assert report.memory > 0
+        assert not tracemalloc.is_tracing()
+
+    def test_nothing_evicted(self):
+        templates = dict(('t%d.liquid' % x, '{{ %d }}' % x)
+                         for x in range(1500))
+        env = Environment(loader=DictLoader(templates))
+        report = env.preload(freeze=False)
+        assert len(report.templates) == 1500
+        assert report.evicted == []
+        assert len(env.cache) == 1500
+
+    def test_evicted(self):
+        class ForgetfulCache(dict):
+            capacity = 100
+
+            def __setitem__(self, key, value):
+                self.clear()
+                dict.__setitem__(self, key, value)
+
+        env = Environment(loader=DictLoader(self.templates))
+        env.cache = ForgetfulCache()
+        messages = []
+        report = env.preload(['a.liquid', 'b.liquid'], freeze=False,
+                             log_function=messages.append)
+        assert report.evicted == ['a.liquid']
+        assert '1 preloaded templates were evicted from the template ' \
+            'cache' in messages
+
+    def test_names(self):
+        env = Environment(loader=DictLoader(self.templates))
+        report = env.preload(['a.liquid', 'missing'], freeze=False)
+        assert report.templates == ['a.liquid']
+        assert list(report.errors) == ['missing']
+        assert len(env.cache) == 1
+
+    def test_errors(self):
+        env = Environment(loader=DictLoader(self.templates))
+        pytest.raises(TemplateSyntaxError, env.preload, ['broken.liquid'],
+                      freeze=False, ignore_errors=False)
+
+    def test_freeze(self):
+        import gc
+        env = Environment(loader=DictLoader(self.templates))
+        report = env.preload(['a.liquid'])
+        try:
+            assert report.frozen == hasattr(gc, 'freeze')
+        finally:
+            if report.frozen:
+                gc.unfreeze()
+
+
+@pytest.mark.api
+@pytest.mark.rendermode
+class TestBufferRenderMode():
+    templates = {
+        'layout': '<{% block title %}Layout{% endblock %}>'
+                  '{% block body %}{% endblock %}'
+                  '[{{ self.title() }}]',
+        'child': '{% extends "layout" %}'
+                 '{% block title %}Child {{ super() }}{% endblock %}'
+                 '{% block body %}{% for item in seq %}'
+                 '{% include "item" %}{% section "footer" %}'
+                 '{% endfor %}{% endblock %}',
+        'snippets/item.liquid': '({{ item }})',
+        'sections/footer.liquid': '{% capture x %}-{{ item }}-'
+                                  '{% endcapture %}{{ x }}',
+        'macros': '{% macro m(x) %}{% block inner %}<{{ x }}>'
+                  '{% endblock %}{% endmacro %}{{ m(1) }}{{ m(2) }}',
+    }
+
+    def make_env(self, render_mode):
+        return Environment(loader=DictLoader(self.templates),
+                           render_mode=render_mode)
+
+    def test_same_output(self):
+        generator_env = self.make_env('generator')
+        buffer_env = self.make_env('buffer')
+        for name in 'layout', 'child', 'macros':
+            expected = generator_env.get_template(name).render(seq=[1, 2])
+            tmpl = buffer_env.get_template(name)
+            assert tmpl.render(seq=[1, 2]) == expected
+            assert ''.join(tmpl.generate(seq=[1, 2])) == expected
+            assert tmpl.module.__html__() == \
+                generator_env.get_template(name).module.__html__()
+
+    def test_no_generators(self):
+        env = self.make_env('buffer')
+        source = env.compile(self.templates['child'], raw=True)
+        assert 'yield' not in source
+        assert 'for event in' not in source
+
+    def test_stream(self):
+        tmpl = self.make_env('buffer').get_template('child')
+        assert ''.join(tmpl.stream(seq=[1])) == tmpl.render(seq=[1])
+
+    def test_overlay_and_template(self):
+        env = Environment().overlay(render_mode='buffer')
+        assert env.render_mode == 'buffer'
+        assert env.from_string('{{ 1 }}{% if x %}x{% endif %}') \
+            .render(x=True) == '1x'
+        assert Template('{{ 1 }}', render_mode='buffer').render() == '1'
+        pytest.raises(AssertionError, Environment, render_mode='list')
+
+
 @pytest.mark.api
 @pytest.mark.undefined
 class TestUndefined():
@@ -325,3 +643,87 @@ class TestLowLevel():
         env = CustomEnvironment()
         tmpl = env.from_string('{{ foo }}')
         assert tmpl.render() == 'resolve-foo'
+
+
+@pytest.mark.api
+@pytest.mark.nodes
+class TestNodes():
+
+    def test_slots(self, env):
+        ast = env.parse('{% for x in seq %}{{ x.y|upper }}{% endfor %}')
+        for node in ast.find_all(nodes.Node):
+            assert not hasattr(node, '__dict__')
+        assert nodes.For.__slots__ == nodes.For.fields
+        assert nodes.Node.__slots__ == ('lineno', 'environment')
+        with pytest.raises(AttributeError):
+            ast.body[0].foo = 42
+
+    def test_set_ctx_and_lineno(self):
+        node = nodes.Tuple([nodes.Name('a', 'load'), nodes.Name('b', 'load')],
+                           'load')
+        node.set_ctx('store').set_lineno(3)
+        assert [x.ctx for x in node.items] == ['store', 'store']
+        assert [x.lineno for x in node.items] == [3, 3]
+        assert dict(nodes.Name('a', 'load').iter_fields()) == \
+            {'name': 'a', 'ctx': 'load'}
+        assert list(nodes.Name().iter_fields()) == []
+
+    def test_pickle(self, env):
+        ast = env.parse('{% if a %}{{ b + 1 }}{% else %}c{% endif %}')
+        ast.set_environment(None)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            rv = pickle.loads(pickle.dumps(ast, protocol))
+            assert rv == ast
+            assert rv.body[0].lineno == 1
+            assert rv.environment is None
+        rv = copy.deepcopy(nodes.Name('a', 'load', lineno=2))
+        assert (rv.name, rv.ctx, rv.lineno) == ('a', 'load', 2)
+
+
+@pytest.mark.api
+@pytest.mark.visitor
+class TestNodeVisitor():
+
+    def test_dispatch_per_class(self):
+        class NameVisitor(NodeVisitor):
+            def __init__(self):
+                self.visited = []
+
+            def visit_Name(self, node):
+                self.visited.append(node.name)
+
+        class ConstVisitor(NameVisitor):
+            def visit_Const(self, node):
+                self.visited.append(node.value)
+
+        node = nodes.Add(nodes.Name('a', 'load'), nodes.Const(1))
+        for cls, expected in (NameVisitor, ['a']), (ConstVisitor, ['a', 1]):
+            for x in range(2):
+                visitor = cls()
+                visitor.visit(node)
+                assert visitor.visited == expected
+
+    def test_custom_get_visitor(self):
+        class UpperVisitor(NodeVisitor):
+            def get_visitor(self, node):
+                return getattr(self, 'VISIT_' + node.__class__.__name__,
+                               None)
+
+            def VISIT_Const(self, node):
+                return node.value
+
+            @staticmethod
+            def visit_Const(node):
+                return 'lower'
+
+        assert UpperVisitor().visit(nodes.Const(42)) == 42
+
+    def test_transformer(self):
+        class ConstTransformer(NodeTransformer):
+            @staticmethod
+            def visit_Const(node):
+                return nodes.Const(node.value * 2)
+
+        node = ConstTransformer().visit(nodes.Add(nodes.Const(1),
+                                                  nodes.Const(2)))
+        assert node == nodes.Add(nodes.Const(2), nodes.Const(4))
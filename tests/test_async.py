@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+    jinja2.testsuite.async
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests the async rendering support.  Only collected on Python 3.6+.
+
+    :copyright: (c) 2010 by the Jinja Team.
+    :license: BSD, see LICENSE for more details.
+"""
+import asyncio
+
+import pytest
+from jinja2 import Environment, DictLoader, Template
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+class Product(object):
+
+    def __init__(self, title, price):
+        self.title = title
+        self._price = price
+
+    @property
+    async def price(self):
+        await asyncio.sleep(0)
+        return self._price
+
+    async def variants(self):
+        for size in 'SM':
+            await asyncio.sleep(0)
+            yield size
+
+
+@pytest.fixture
+def async_env():
+    return Environment(enable_async=True, loader=DictLoader({
+        'layout.html': '[{% block body %}{% endblock %}]',
+        'snippets/price.liquid': '{{ product.price }}',
+        'sections/header.liquid': '<{{ shop() }}>',
+        'macros.html': '{% macro label(p) %}{{ p.title }}: '
+                       '{{ p.price }}{% endmacro %}'
+    }))
+
+
+@pytest.mark.async_render
+class TestAsyncRendering():
+
+    def test_render_async(self, async_env):
+        tmpl = async_env.from_string('{{ product.title }} {{ product.price }}')
+        rv = run(tmpl.render_async(product=Product('Shirt', 42)))
+        assert rv == 'Shirt 42'
+
+    def test_sync_render(self, async_env):
+        tmpl = async_env.from_string('{{ product.price }}')
+        assert tmpl.render(product=Product('Shirt', 42)) == '42'
+        assert list(tmpl.generate(product=Product('Shirt', 42))) == ['42']
+
+    def test_async_calls_and_filters(self, async_env):
+        async def shop():
+            return 'shop'
+        async_env.filters['twice'] = lambda x: x * 2
+        tmpl = async_env.from_string('{{ shop() | upper | twice }}')
+        assert run(tmpl.render_async(shop=shop)) == 'SHOPSHOP'
+
+    def test_async_loop(self, async_env):
+        tmpl = async_env.from_string('{% for v in product.variants() %}'
+                                     '{{ forloop.index }}{{ v }}{% endfor %}'
+                                     '{% for v in product.variants() '
+                                     'if v != "S" %}{{ v }}{% endfor %}')
+        assert run(tmpl.render_async(product=Product('Shirt', 1))) == '1S2MM'
+
+    def test_recursive_loop(self, async_env):
+        tmpl = async_env.from_string('{% for item in seq recursive %}'
+                                     '[{{ item.a }}{% if item.b %}'
+                                     '<{{ forloop(item.b) }}>{% endif %}]'
+                                     '{% endfor %}')
+        seq = [dict(a=1, b=[dict(a=2)]), dict(a=3)]
+        assert run(tmpl.render_async(seq=seq)) == '[1<[2]>][3]'
+
+    def test_includes_and_inheritance(self, async_env):
+        async def shop():
+            return 'shop'
+        tmpl = async_env.from_string(
+            '{% extends "layout.html" %}{% block body %}'
+            '{% include "price" %}{% section "header" %}'
+            '{% render "price", product: product %}'
+            '{% import "macros.html" as macros %}'
+            '{{ macros.label(product) }}{% endblock %}')
+        rv = run(tmpl.render_async(product=Product('Shirt', 42), shop=shop))
+        assert rv == '[42<shop>42Shirt: 42]'
+
+    def test_super(self):
+        env = Environment(enable_async=True, loader=DictLoader({
+            'a': '{% block x %}A{% endblock %}',
+            'b': '{% extends "a" %}{% block x %}B{{ super() }}{% endblock %}'
+        }))
+        assert run(env.get_template('b').render_async()) == 'BA'
+
+    def test_buffer_render_mode(self):
+        env = Environment(enable_async=True, render_mode='buffer',
+                          loader=DictLoader({
+                              'a': '{% block x %}{{ x.price }}{% endblock %}',
+                              'b': '{% extends "a" %}{% block x %}'
+                                   '<{{ super() }}>{% endblock %}'
+                          }))
+        rv = run(env.get_template('b').render_async(x=Product('Shirt', 1)))
+        assert rv == '<1>'
+
+    def test_stream_async(self, async_env):
+        tmpl = async_env.from_string('{% for i in seq %}{{ i }}{% endfor %}')
+
+        async def collect(stream):
+            return [x async for x in stream]
+        assert run(collect(tmpl.stream_async(seq=range(4)))) == \
+            ['0', '1', '2', '3']
+        stream = tmpl.stream_async(seq=range(4))
+        stream.enable_buffering(3)
+        assert run(collect(stream)) == ['012', '3']
+
+    def test_module(self, async_env):
+        tmpl = async_env.get_template('macros.html')
+        pytest.raises(RuntimeError, getattr, tmpl, 'module')
+        module = run(tmpl.make_module_async())
+        assert run(module.label(Product('Shirt', 3))) == 'Shirt: 3'
+
+    def test_interleaving(self, async_env):
+        order = []
+
+        async def step(name):
+            order.append(name)
+            await asyncio.sleep(0)
+            order.append(name)
+            return name
+        tmpl = async_env.from_string('{{ step(name) }}')
+
+        async def main():
+            return await asyncio.gather(tmpl.render_async(step=step, name='a'),
+                                        tmpl.render_async(step=step, name='b'))
+        assert run(main()) == ['a', 'b']
+        assert sorted(order[:2]) == ['a', 'b']
+
+    def test_fragment_cache(self):
+        env = Environment(enable_async=True, extensions=['jinja2.ext.cache'])
+        tmpl = env.from_string('{% cache "k" %}{{ product.price }}'
+                               '{% endcache %}')
+        assert run(tmpl.render_async(product=Product('Shirt', 1))) == '1'
+        assert run(tmpl.render_async(product=Product('Shirt', 2))) == '1'
+        assert env.fragment_cache.hits == 1
+
+    def test_no_async_mode(self):
+        tmpl = Template('foo')
+        pytest.raises(RuntimeError, tmpl.render_async)
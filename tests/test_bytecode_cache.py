@@ -8,9 +8,19 @@
     :copyright: (c) 2010 by the Jinja Team.
     :license: BSD, see LICENSE for more details.
 """
+import os
+import time
+import shutil
+import marshal
+import tempfile
+import threading
+
 import pytest
-from jinja2 import Environment
-from jinja2.bccache import FileSystemBytecodeCache
+from jinja2 import Environment, FunctionLoader, DictLoader, \
+     FileSystemLoader, BaseLoader
+from jinja2.bccache import BytecodeCache, FileSystemBytecodeCache, \
+     ContentAddressedBytecodeCache, PackFileBytecodeCache, \
+     MemoryBytecodeCache, TieredBytecodeCache, MemcachedBytecodeCache
 from jinja2.exceptions import TemplateNotFound
 
 
@@ -30,3 +40,556 @@ class TestByteCodeCache():
         tmpl = env.get_template('test.html')
         assert tmpl.render().strip() == 'BAR'
         pytest.raises(TemplateNotFound, env.get_template, 'missing.html')
+
+    def test_render_modes(self):
+        bcc = MockMemoryBytecodeCache()
+        loader = DictLoader({'snippets/x.liquid': 'X{{ 1 }}',
+                             'main': "a{% include 'x' %}b"})
+        generator_env = Environment(loader=loader, bytecode_cache=bcc)
+        buffer_env = Environment(loader=loader, bytecode_cache=bcc,
+                                 render_mode='buffer')
+        assert generator_env.get_template('snippets/x.liquid').render() == \
+            'X1'
+        assert buffer_env.get_template('main').render() == 'aX1b'
+        assert generator_env.get_template('main').render() == 'aX1b'
+        assert len(bcc.storage) == 4
+
+
+class MockMemoryBytecodeCache(BytecodeCache):
+
+    def __init__(self):
+        self.storage = {}
+        self.dumps = 0
+
+    def load_bytecode(self, bucket):
+        data = self.storage.get(bucket.key)
+        if data is not None:
+            bucket.bytecode_from_string(data)
+
+    def dump_bytecode(self, bucket):
+        self.dumps += 1
+        self.storage[bucket.key] = bucket.bytecode_to_string()
+
+
+@pytest.mark.byte_code_cache
+class TestContentAddressedBytecodeCache():
+
+    def make_env(self, bcc, source, filename=None, **options):
+        def load(name):
+            return source, filename, lambda: True
+        return Environment(loader=FunctionLoader(load), bytecode_cache=bcc,
+                           **options)
+
+    def test_shared_code(self):
+        backend = MockMemoryBytecodeCache()
+        bcc = ContentAddressedBytecodeCache(backend)
+        tmpl1 = self.make_env(bcc, '{{ foo }}', '/a/x.html') \
+            .get_template('x.html')
+        tmpl2 = self.make_env(bcc, '{{ foo }}', '/b/x.html') \
+            .get_template('x.html')
+        assert backend.dumps == 1
+        assert len(backend.storage) == 1
+        assert tmpl1.root_render_func.__code__ is \
+            tmpl2.root_render_func.__code__
+        assert tmpl1.filename.endswith('/a/x.html')
+        assert tmpl2.filename.endswith('/b/x.html')
+        assert tmpl2.render(foo=42) == '42'
+
+    def test_different_sources(self):
+        backend = MockMemoryBytecodeCache()
+        bcc = ContentAddressedBytecodeCache(backend)
+        self.make_env(bcc, 'a').get_template('x.html')
+        self.make_env(bcc, 'b').get_template('x.html')
+        self.make_env(bcc, 'a').get_template('y.html')
+        assert backend.dumps == 3
+
+    def test_different_settings(self):
+        backend = MockMemoryBytecodeCache()
+        bcc = ContentAddressedBytecodeCache(backend)
+        self.make_env(bcc, '{% if x %}\nx{% endif %}').get_template('x.html')
+        tmpl = self.make_env(bcc, '{% if x %}\nx{% endif %}',
+                             trim_blocks=True).get_template('x.html')
+        assert backend.dumps == 2
+        assert tmpl.render(x=True) == 'x'
+
+    def test_backend(self):
+        backend = MockMemoryBytecodeCache()
+        self.make_env(ContentAddressedBytecodeCache(backend), 'foo') \
+            .get_template('x.html')
+        bcc = ContentAddressedBytecodeCache(backend)
+        tmpl = self.make_env(bcc, 'foo').get_template('x.html')
+        assert backend.dumps == 1
+        assert tmpl.render() == 'foo'
+        bcc.clear()
+        assert len(bcc._code) == 0
+
+    def test_memory_only(self):
+        bcc = ContentAddressedBytecodeCache(capacity=1)
+        self.make_env(bcc, 'a').get_template('x.html')
+        self.make_env(bcc, 'b').get_template('x.html')
+        assert len(bcc._code) == 1
+
+
+@pytest.mark.byte_code_cache
+class TestPackFileBytecodeCache():
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def make_env(self, bcc, templates):
+        return Environment(loader=DictLoader(templates), bytecode_cache=bcc)
+
+    def get_code(self, bcc, name, source):
+        bucket = bcc.get_bucket(Environment(), name, None, source)
+        return bucket.code
+
+    def test_roundtrip(self):
+        templates = dict(('t%d' % x, 'x{{ %d }}' % x) for x in range(50))
+        env = self.make_env(PackFileBytecodeCache(self.directory,
+                                                  capacity=4), templates)
+        for name in templates:
+            env.get_template(name)
+        bcc = PackFileBytecodeCache(self.directory)
+        for name, source in templates.items():
+            assert self.get_code(bcc, name, source) is not None
+        env = self.make_env(bcc, templates)
+        assert env.get_template('t42').render() == 'x42'
+        assert self.get_code(bcc, 'missing', 'x') is None
+
+    def test_changed_source(self):
+        bcc = PackFileBytecodeCache(self.directory)
+        self.make_env(bcc, {'a': 'one'}).get_template('a')
+        assert self.get_code(bcc, 'a', 'two') is None
+        assert self.make_env(bcc, {'a': 'two'}).get_template('a') \
+            .render() == 'two'
+        assert self.get_code(bcc, 'a', 'two') is not None
+
+    def test_compaction(self):
+        bcc = PackFileBytecodeCache(self.directory, compact_size=0)
+        other = PackFileBytecodeCache(self.directory)
+        self.make_env(other, {'a': 'a', 'b': 'b'}).get_template('a')
+        for x in range(10):
+            self.make_env(bcc, {'b': 'b%d' % x}).get_template('b')
+        packs = [x for x in os.listdir(self.directory)
+                 if x.endswith('.pack')]
+        assert len(packs) == 1
+        assert self.get_code(other, 'a', 'a') is not None
+        assert self.get_code(other, 'b', 'b9') is not None
+        assert self.get_code(other, 'b', 'b') is None
+
+    def test_clear(self):
+        bcc = PackFileBytecodeCache(self.directory)
+        other = PackFileBytecodeCache(self.directory)
+        self.make_env(bcc, {'a': 'a'}).get_template('a')
+        assert self.get_code(other, 'a', 'a') is not None
+        bcc.clear()
+        assert self.get_code(other, 'a', 'a') is None
+        assert self.get_code(bcc, 'a', 'a') is None
+
+
+@pytest.mark.byte_code_cache
+class TestTieredBytecodeCache():
+
+    def test_read_through(self):
+        back = MockMemoryBytecodeCache()
+        Environment(loader=DictLoader({'a': 'a'}),
+                    bytecode_cache=back).get_template('a')
+        bcc = TieredBytecodeCache(MemoryBytecodeCache(), back)
+        for x in range(3):
+            env = Environment(loader=DictLoader({'a': 'a'}),
+                              bytecode_cache=bcc, cache_size=0)
+            assert env.get_template('a').render() == 'a'
+        assert bcc.back_hits == 1
+        assert bcc.hits == 2
+        assert bcc.misses == 0
+        assert back.dumps == 1
+
+    def test_write_through(self):
+        front = MemoryBytecodeCache()
+        back = MockMemoryBytecodeCache()
+        bcc = TieredBytecodeCache(front, back)
+        env = Environment(loader=DictLoader({'a': 'a'}), bytecode_cache=bcc)
+        env.get_template('a')
+        assert bcc.misses == 1
+        assert len(front) == 1
+        assert back.dumps == 1
+
+    def test_negative_caching(self):
+        back = MockMemoryBytecodeCache()
+        bcc = TieredBytecodeCache(MemoryBytecodeCache(), back)
+        env = Environment()
+        bucket = bcc.get_bucket(env, 'a', None, 'a')
+        assert bucket.code is None
+        bucket = bcc.get_bucket(env, 'a', None, 'a')
+        assert bucket.code is None
+        assert bcc.misses == 1
+        assert bcc.negative_hits == 1
+
+        # storing the code forgets the miss
+        bucket.code = env.compile('a', 'a')
+        bcc.set_bucket(bucket)
+        bcc.front.clear()
+        assert bcc.get_bucket(env, 'a', None, 'a').code is not None
+        assert bcc.back_hits == 1
+
+        # a checksum mismatch in the back cache is remembered
+        bcc.get_bucket(env, 'a', None, 'b')
+        bcc.get_bucket(env, 'a', None, 'b')
+        assert bcc.misses == 2
+        assert bcc.negative_hits == 2
+
+    def test_negative_timeout(self):
+        bcc = TieredBytecodeCache(MemoryBytecodeCache(),
+                                  MockMemoryBytecodeCache(),
+                                  negative_timeout=-1)
+        bcc.get_bucket(Environment(), 'a', None, 'a')
+        bcc.get_bucket(Environment(), 'a', None, 'a')
+        assert bcc.misses == 2
+        assert bcc.negative_hits == 0
+
+    def test_memory_limit(self):
+        env = Environment()
+        code = env.compile('{{ foo }}', 'a')
+        size = len(marshal.dumps(code))
+        bcc = MemoryBytecodeCache(max_bytes=size * 2)
+        for name in 'abc':
+            bucket = bcc.get_bucket(env, name, None, 'x')
+            bucket.code = code
+            bcc.set_bucket(bucket)
+        assert len(bcc) == 2
+        assert bcc.size == size * 2
+        assert bcc.evictions == 1
+        assert bcc.get_bucket(env, 'a', None, 'x').code is None
+        assert bcc.get_bucket(env, 'c', None, 'x').code is code
+        bcc.clear()
+        assert len(bcc) == 0 and bcc.size == 0
+
+
+class CountingFileSystemLoader(FileSystemLoader):
+
+    def __init__(self, *args, **kwargs):
+        FileSystemLoader.__init__(self, *args, **kwargs)
+        self.sources = 0
+
+    def get_source(self, environment, template):
+        self.sources += 1
+        return FileSystemLoader.get_source(self, environment, template)
+
+
+@pytest.mark.byte_code_cache
+class TestSourceVersions():
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.write('index.html', 'one')
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, source, mtime=1000000000):
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'w') as f:
+            f.write(source)
+        os.utime(filename, (mtime, mtime))
+
+    def load(self, bcc, name='index.html'):
+        loader = CountingFileSystemLoader(self.directory)
+        env = Environment(loader=loader, bytecode_cache=bcc)
+        return env.get_template(name).render(), loader.sources
+
+    def test_version(self):
+        loader = FileSystemLoader(self.directory)
+        version, filename, uptodate = loader.get_source_version(
+            Environment(), 'index.html')
+        assert filename == os.path.join(self.directory, 'index.html')
+        assert uptodate()
+        self.write('index.html', 'two', 2000000000)
+        assert loader.get_source_version(Environment(),
+                                         'index.html')[0] != version
+        assert not uptodate()
+        pytest.raises(TemplateNotFound, loader.get_source_version,
+                      Environment(), 'missing.html')
+        assert DictLoader({}).get_source_version(Environment(), 'x') is None
+
+    def test_source_not_loaded(self):
+        bcc = MockMemoryBytecodeCache()
+        assert self.load(bcc) == ('one', 1)
+        assert self.load(bcc) == ('one', 0)
+        assert bcc.dumps == 1
+
+    def test_changed(self):
+        bcc = MockMemoryBytecodeCache()
+        self.load(bcc)
+        self.write('index.html', 'three', 2000000000)
+        assert self.load(bcc) == ('three', 1)
+        assert self.load(bcc) == ('three', 0)
+        assert bcc.dumps == 2
+
+    def test_content_addressed(self):
+        bcc = ContentAddressedBytecodeCache()
+        assert self.load(bcc) == ('one', 1)
+        assert self.load(bcc) == ('one', 1)
+
+    def test_integer_version(self):
+        class RowLoader(BaseLoader):
+            # templates stored in database rows with a row version
+            def __init__(self, rows):
+                self.rows = rows
+                self.sources = 0
+
+            def get_source(self, environment, template):
+                self.sources += 1
+                return self.rows[template][0], None, lambda: True
+
+            def get_source_version(self, environment, template):
+                return self.rows[template][1], None, lambda: True
+
+        bcc = MockMemoryBytecodeCache()
+
+        def load(source, version):
+            loader = RowLoader({'index.html': (source, version)})
+            env = Environment(loader=loader, bytecode_cache=bcc)
+            return env.get_template('index.html').render(), loader.sources
+
+        assert load(u'one', 1) == ('one', 1)
+        assert load(u'one', 1) == ('one', 0)
+        assert load(u'two', 2) == ('two', 1)
+        assert bcc.dumps == 2
+
+class MockMemcacheClient(object):
+
+    def __init__(self):
+        self.values = {}
+        self.gets = 0
+        self.multi_gets = []
+
+    def get(self, key):
+        self.gets += 1
+        return self.values.get(key)
+
+    def get_multi(self, keys):
+        self.multi_gets.append(len(keys))
+        return dict((key, self.values[key]) for key in keys
+                    if key in self.values)
+
+    def set(self, key, value, timeout=None):
+        self.values[key] = value
+
+
+@pytest.mark.byte_code_cache
+class TestPrefetch():
+    templates = {
+        'page.html': '{% extends "layout.html" %}{% block body %}'
+                     '{% include "header" %}{% section "product" %}'
+                     '{% endblock %}',
+        'layout.html': '<{% block body %}{% endblock %}>',
+        'snippets/header.liquid': 'header {% include "logo" %}',
+        'snippets/logo.liquid': 'logo',
+        'sections/product.liquid': ' product',
+    }
+    expected = '<header logo product>'
+
+    def make_env(self, client, prefetch=True, bcc=None):
+        if bcc is None:
+            bcc = MemcachedBytecodeCache(client, prefetch=prefetch)
+        return Environment(loader=DictLoader(self.templates),
+                           bytecode_cache=bcc)
+
+    def test_dependencies(self):
+        env = Environment(loader=DictLoader(self.templates))
+        assert env.get_template('page.html').dependencies == (
+            'layout.html', 'snippets/header.liquid',
+            'sections/product.liquid')
+        assert env.get_template('snippets/logo.liquid').dependencies == ()
+        assert env.from_string('{% include name %}').dependencies == ()
+
+    def test_one_round_trip_per_level(self):
+        client = MockMemcacheClient()
+        assert self.make_env(client).get_template('page.html').render() \
+            == self.expected
+        assert len(client.values) == 5
+
+        client.gets = 0
+        client.multi_gets = []
+        env = self.make_env(client)
+        assert env.get_template('page.html').render() == self.expected
+        # one round trip for the page and one for each level of its
+        # dependencies, single keys are fetched with get
+        assert client.gets == 2
+        assert client.multi_gets == [3]
+
+    def test_disabled(self):
+        client = MockMemcacheClient()
+        self.make_env(client).get_template('page.html').render()
+        client.gets = 0
+        client.multi_gets = []
+        env = self.make_env(client, prefetch=False)
+        assert env.get_template('page.html').render() == self.expected
+        assert client.gets == 5
+        assert client.multi_gets == []
+
+    def test_cold_cache(self):
+        client = MockMemcacheClient()
+        env = self.make_env(client)
+        assert env.get_template('page.html').render() == self.expected
+        assert env.get_template('page.html').render() == self.expected
+        assert (client.gets, client.multi_gets) == (5, [])
+        assert len(client.values) == 5
+
+    def test_tiered(self):
+        client = MockMemcacheClient()
+        self.make_env(client).get_template('page.html').render()
+        client.gets = 0
+        client.multi_gets = []
+        bcc = TieredBytecodeCache(MemoryBytecodeCache(),
+                                  MemcachedBytecodeCache(client,
+                                                         prefetch=True))
+        env = self.make_env(client, bcc=bcc)
+        assert env.get_template('page.html').render() == self.expected
+        assert (client.gets, client.multi_gets) == (2, [3])
+        assert bcc.back_hits == 5
+
+        env = self.make_env(client, bcc=bcc)
+        assert env.get_template('page.html').render() == self.expected
+        assert (client.gets, client.multi_gets) == (2, [3])
+        assert bcc.hits == 5
+
+
+class CountingEnvironment(Environment):
+
+    def __init__(self, *args, **kwargs):
+        Environment.__init__(self, *args, **kwargs)
+        self.compiles = 0
+
+    def compile(self, *args, **kwargs):
+        self.compiles += 1
+        return Environment.compile(self, *args, **kwargs)
+
+
+class SlowDictLoader(DictLoader):
+
+    def get_source(self, environment, template):
+        time.sleep(0.1)
+        return DictLoader.get_source(self, environment, template)
+
+
+@pytest.mark.byte_code_cache
+class TestSingleFlightCompile():
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def run(self, func, count=8):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(func()))
+                   for x in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_threads(self):
+        env = CountingEnvironment(loader=SlowDictLoader({'a': 'A'}))
+        templates = self.run(lambda: env.get_template('a'))
+        assert env.compiles == 1
+        assert len(set(map(id, templates))) == 1
+
+    def test_lock_files(self):
+        bcc = FileSystemBytecodeCache(self.directory, lock_compiles=True)
+        loader = DictLoader({'a': '{{ 42 }}'})
+        envs = [CountingEnvironment(loader=loader, bytecode_cache=bcc)
+                for x in range(4)]
+
+        # another process is compiling the template
+        compiler = Environment(loader=loader)
+        bucket = bcc.get_bucket(compiler, 'a', None, '{{ 42 }}')
+        with bcc.get_compile_lock(bucket):
+            threads = [threading.Thread(target=env.get_template, args=('a',))
+                       for env in envs]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.1)
+            bucket.code = compiler.compile('{{ 42 }}', 'a')
+            bcc.set_bucket(bucket)
+        for thread in threads:
+            thread.join()
+        assert [env.compiles for env in envs] == [0, 0, 0, 0]
+        assert envs[0].get_template('a').render() == '42'
+        assert any(x.endswith('.lock') for x in os.listdir(self.directory))
+        bcc.clear()
+        assert os.listdir(self.directory) == []
+
+    @pytest.mark.parametrize('wrap', [
+        lambda back: TieredBytecodeCache(MemoryBytecodeCache(), back),
+        lambda back: ContentAddressedBytecodeCache(back),
+    ])
+    def test_wrapped_lock_files(self, wrap):
+        back = FileSystemBytecodeCache(self.directory, lock_compiles=True)
+        bcc = wrap(back)
+        loader = DictLoader({'a': '{{ 42 }}'})
+        envs = [CountingEnvironment(loader=loader, bytecode_cache=bcc)
+                for x in range(4)]
+
+        # another process is compiling the template and stores it in the
+        # shared cache only.
+        compiler = CountingEnvironment(loader=loader)
+        bucket = bcc.make_bucket(compiler, 'a', None, '{{ 42 }}')
+        lock = bcc.get_compile_lock(bucket)
+        assert lock is not None
+        with lock:
+            threads = [threading.Thread(target=env.get_template, args=('a',))
+                       for env in envs]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.1)
+            bucket.code = compiler.compile('{{ 42 }}', 'a')
+            back.set_bucket(bucket)
+        for thread in threads:
+            thread.join()
+        assert [env.compiles for env in envs] == [0, 0, 0, 0]
+        assert envs[0].get_template('a').render() == '42'
+
+    def test_recheck_cache_in_flight(self):
+        env = CountingEnvironment(loader=DictLoader({'a': 'A'}))
+        env.get_template('a')
+        cache = env.cache
+
+        class LateCache(object):
+            # misses once, as if another flight stored the template right
+            # after this thread looked it up.
+            missed = False
+
+            def get(self, key):
+                if not self.missed:
+                    self.missed = True
+                    return None
+                return cache.get(key)
+
+            def __setitem__(self, key, value):
+                cache[key] = value
+
+        env.cache = LateCache()
+        assert env.get_template('a').render() == 'A'
+        assert env.compiles == 1
+
+    def test_lock_compiles_once(self):
+        bcc = FileSystemBytecodeCache(self.directory, lock_compiles=True)
+        loader = DictLoader({'a': 'A'})
+        envs = [CountingEnvironment(loader=loader, bytecode_cache=bcc)
+                for x in range(4)]
+        threads = [threading.Thread(target=env.get_template, args=('a',))
+                   for env in envs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sum(env.compiles for env in envs) == 1
+        assert FileSystemBytecodeCache(self.directory).get_compile_lock(
+            bucket=None) is None
@@ -8,12 +8,21 @@
     :copyright: (c) 2010 by the Jinja Team.
     :license: BSD, see LICENSE for more details.
 """
+import os
 import re
+import time
+import shutil
+import tempfile
+import itertools
+import threading
+from functools import partial
 import pytest
 
 from jinja2 import Environment, DictLoader, contextfunction, nodes
 from jinja2.exceptions import TemplateAssertionError
 from jinja2.ext import Extension
+from jinja2.fragmentcache import MemoryFragmentCache, FileSystemFragmentCache
+from jinja2.utils import Markup
 from jinja2.lexer import Token, count_newlines
 from jinja2._compat import BytesIO, itervalues, text_type
 
@@ -465,3 +474,146 @@ class TestAutoEscape():
                           autoescape=True)
         pysource = env.compile(tmplsource, raw=True)
         assert '&lt;testing&gt;\\n' in pysource
+
+
+@pytest.mark.ext
+class TestFragmentCache():
+
+    def make_env(self, **options):
+        env = Environment(extensions=['jinja2.ext.cache'], **options)
+        env.globals['count'] = partial(next, itertools.count())
+        return env
+
+    def test_cache_tag(self):
+        env = self.make_env()
+        tmpl = env.from_string('{% cache key %}{{ count() }}{% endcache %}')
+        assert tmpl.render(key='a') == '0'
+        assert tmpl.render(key='a') == '0'
+        assert tmpl.render(key='b') == '1'
+        assert env.fragment_cache.hits == 1
+        assert env.fragment_cache.misses == 2
+
+    def test_timeout(self):
+        env = self.make_env()
+        tmpl = env.from_string('{% cache "a", 0 %}{{ count() }}{% endcache %}'
+                               '{% cache "b", 60 %}{{ count() }}{% endcache %}')
+        assert tmpl.render() == '01'
+        assert tmpl.render() == '21'
+
+    def test_delete_templates(self):
+        env = self.make_env(loader=DictLoader({
+            'a.html': '{% cache "a" %}{{ count() }}{% endcache %}'
+                      '{% include "b" %}',
+            'snippets/b.liquid': '{% cache "b" %}{{ count() }}{% endcache %}'
+        }))
+        tmpl = env.get_template('a.html')
+        assert tmpl.render() == '01'
+        env.fragment_cache.delete_templates(['snippets/b.liquid'])
+        assert tmpl.render() == '02'
+        env.fragment_cache.delete_templates(['a.html'])
+        assert tmpl.render() == '32'
+
+    def test_remembered_keys_bounded(self):
+        env = self.make_env(loader=DictLoader({
+            'a.html': '{% cache "p" ~ id %}{{ count() }}{% endcache %}'
+        }))
+        env.fragment_cache = cache = MemoryFragmentCache(capacity=100)
+        tmpl = env.get_template('a.html')
+        for idx in range(2000):
+            tmpl.render(id=idx)
+        assert len(cache) == 100
+        assert len(cache._key_templates) < 300
+        assert len(cache._template_keys['a.html']) < 300
+        hits = cache.hits
+        tmpl.render(id=1999)
+        assert cache.hits == hits + 1
+        cache.delete(cache._cache.keys()[0])
+        cache.delete_templates(['a.html'])
+        assert len(cache) == 0
+        assert cache._key_templates == {} and cache._template_keys == {}
+
+    def test_memory_capacity(self):
+        cache = MemoryFragmentCache(capacity=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert len(cache) == 2
+        assert cache.get('a') == 1 and cache.get('b') is None
+        cache.delete('a')
+        assert cache.get('a') is None
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_file_system_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            env = self.make_env(autoescape=True)
+            env.fragment_cache = FileSystemFragmentCache(directory,
+                                                         threshold=2)
+            tmpl = env.from_string('{% cache key %}<{{ count() }}{{ "&" }}>'
+                                   '{% endcache %}')
+            assert tmpl.render(key='a') == '<0&amp;>'
+            other = FileSystemFragmentCache(directory)
+            assert other.get('a') == Markup('<0&amp;>')
+            assert isinstance(other.get('a'), Markup)
+            for key in 'bcd':
+                tmpl.render(key=key)
+            assert len(os.listdir(directory)) == 2
+            other.clear()
+            assert os.listdir(directory) == []
+        finally:
+            shutil.rmtree(directory)
+
+    def test_file_system_prune_margin(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = FileSystemFragmentCache(directory, threshold=100)
+            listings = []
+            list_files = cache._list
+
+            def counting_list():
+                listings.append(None)
+                return list_files()
+            cache._list = counting_list
+
+            for idx in range(110):
+                cache.set('key-%d' % idx, u'fragment')
+            assert len(os.listdir(directory)) == 110
+            assert len(listings) == 11
+            for idx in range(110, 120):
+                cache.set('key-%d' % idx, u'fragment')
+            assert len(os.listdir(directory)) == 90
+            assert cache.get('key-119') == u'fragment'
+        finally:
+            shutil.rmtree(directory)
+
+    def test_single_flight(self):
+        cache = MemoryFragmentCache()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def render():
+            calls.append(None)
+            started.set()
+            release.wait()
+            return 'fragment'
+
+        def worker():
+            results.append(cache.get_or_render('key', None, render))
+
+        threads = [threading.Thread(target=worker) for x in range(5)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert len(calls) == 1
+        assert results == ['fragment'] * 5
+        assert cache.misses == 1
+        assert cache.hits == 4
@@ -8,9 +8,12 @@
     :copyright: (c) 2010 by the Jinja Team.
     :license: BSD, see LICENSE for more details.
 """
+import time
+import threading
+
 import pytest
 
-from jinja2 import Environment, DictLoader
+from jinja2 import Environment, DictLoader, Markup
 from jinja2.exceptions import TemplateNotFound, TemplatesNotFound
 
 
@@ -155,3 +158,198 @@ class TestIncludes():
             {{ outer("FOO") }}
         """)
         assert t.render().strip() == '(FOO)'
+
+    def test_constant_include_loaded_once_per_render(self):
+        loads = []
+
+        class CountingLoader(DictLoader):
+            def load(self, environment, name, globals=None):
+                loads.append(name)
+                return DictLoader.load(self, environment, name, globals)
+
+        env = Environment(loader=CountingLoader({
+            'main': "{% for item in [1, 2, 3] %}{% include 'item' %}"
+                    "{% section 'item' %}{% endfor %}",
+            'snippets/item.liquid': "{{ item }}",
+            'sections/item.liquid': "<{{ item }}>"
+        }), cache_size=0)
+        tmpl = env.get_template('main')
+        del loads[:]
+        assert tmpl.render() == '1<1>2<2>3<3>'
+        assert sorted(loads) == ['sections/item.liquid',
+                                 'snippets/item.liquid']
+
+    def test_constant_include_in_nested_functions(self, test_env):
+        t = test_env.from_string('''
+            {%- macro m(foo) %}{% include "header" %}{% endmacro -%}
+            {%- for x in [1, 2] recursive %}{% include "header" %}
+            {%- endfor %}{{ m(1) }}{{ m(2) }}''')
+        assert t.render(foo=42) == '[42|23][42|23][1|23][2|23]'
+
+    def test_constant_include_only_loaded_when_reached(self, test_env):
+        t = test_env.from_string('{% if hide %}{% include "missing" %}'
+                                 '{% endif %}{% include "header" %}')
+        assert t.render(foo=42) == '[42|23]'
+
+
+@pytest.mark.imports
+@pytest.mark.includes
+class TestRender():
+
+    def test_isolated_scope(self, test_env):
+        t = test_env.from_string('{% assign foo = 1 %}'
+                                 '{% render "header" %}'
+                                 '{% render "header", foo: 42 %}')
+        assert t.render(foo=2) == '[|23][42|23]'
+        t = test_env.from_string('{% render "o_printer", o: seq[1] %}')
+        assert t.render(seq=[1, 2]) == '(2)'
+
+    def test_no_locals_snapshot(self, test_env):
+        source = test_env.compile('{% for o in seq %}{% render "o_printer", '
+                                  'o: o %}{% endfor %}', raw=True)
+        assert 'locals()' not in source
+        assert 'new_context(context.parent' not in source
+
+    def test_memoized_output(self):
+        calls = []
+
+        def count():
+            calls.append(None)
+            return len(calls)
+        env = Environment(loader=DictLoader({
+            'snippets/counter.liquid': '{{ x }}{{ count() }}',
+        }))
+        env.globals['count'] = count
+        t = env.from_string('{% for x in seq %}{% render "counter", x: x %}'
+                            '{% endfor %}|{% render "counter", x: seq %}'
+                            '{% render "counter", x: seq %}')
+        assert t.render(seq=[1, 1, 'a', 'a', 1]) == \
+            '1111a2a211|[1, 1, \'a\', \'a\', 1]3[1, 1, \'a\', \'a\', 1]4'
+
+    def test_memoized_output_types(self):
+        env = Environment(autoescape=True, loader=DictLoader({
+            'snippets/printer.liquid': '[{{ v }}]',
+        }))
+        t = env.from_string('{% render "printer", v: a %}'
+                            '{% render "printer", v: b %}')
+        assert t.render(a=Markup('<b>'), b='<b>') == '[<b>][&lt;b&gt;]'
+        t = env.from_string('{% render "printer", v: 1 %}'
+                            '{% render "printer", v: true %}'
+                            '{% render "printer", v: 1.0 %}'
+                            '{% render "printer", v: (1, 1) %}'
+                            '{% render "printer", v: (1, true) %}')
+        assert t.render() == '[1][True][1.0][(1, 1)][(1, True)]'
+
+    def test_in_macro_and_block(self, test_env):
+        t = test_env.from_string('{% macro m(o) %}{% render "o_printer", '
+                                 'o: o %}{% endmacro %}{{ m(1) }}{{ m(1) }}'
+                                 '{% block b %}{% render "o_printer", '
+                                 'o: "b" %}{% endblock %}')
+        assert t.render() == '(1)(1)(b)'
+
+    def test_missing_template(self, test_env):
+        t = test_env.from_string('{% render "missing" %}')
+        pytest.raises(TemplateNotFound, t.render)
+
+
+@pytest.fixture
+def executor():
+    futures = pytest.importorskip('concurrent.futures')
+    executor = futures.ThreadPoolExecutor(4)
+    yield executor
+    executor.shutdown()
+
+
+class Tracker(object):
+    """Counts how many sections are rendered at the same time."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def __call__(self, name, delay=0.02):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(delay)
+        with self.lock:
+            self.running -= 1
+        return name
+
+
+@pytest.mark.imports
+@pytest.mark.includes
+class TestSectionExecutor():
+
+    def make_env(self, executor, **options):
+        env = Environment(section_executor=executor, loader=DictLoader({
+            'sections/a.liquid': '<{{ track("a", 0.05) }}>',
+            'sections/b.liquid': '<{{ track("b") }}>',
+            'sections/nested.liquid': '{% section "a" %}{% section "b" %}',
+            'sections/fail.liquid': '{{ fail(name) }}',
+            'snippets/c.liquid': '<{{ track(x) }}>',
+        }), **options)
+        env.globals['track'] = Tracker()
+        return env
+
+    def test_document_order(self, executor):
+        env = self.make_env(executor)
+        t = env.from_string('{% section "a" %}-{% section "b" %}-'
+                            '{% render "c", x: "c" %}')
+        assert t.render() == '<a>-<b>-<c>'
+        assert ''.join(t.generate()) == '<a>-<b>-<c>'
+        assert env.globals['track'].max_running > 1
+
+    def test_concurrency_limit(self, executor):
+        env = self.make_env(executor, section_concurrency=1)
+        t = env.from_string('{% for x in seq %}{% render "c", x: x %}'
+                            '{% endfor %}')
+        assert t.render(seq='abcd') == '<a><b><c><d>'
+        assert env.globals['track'].max_running == 1
+
+    def test_concurrency_limit_per_render(self, executor):
+        env = self.make_env(executor, section_concurrency=1)
+        released = threading.Event()
+
+        def wait():
+            return released.wait(2) and 'w' or 'late'
+
+        def inner():
+            # another render in the same thread while the section of the
+            # outer render is still running.
+            rv = env.from_string('{% section "b" %}{% section "b" %}').render()
+            released.set()
+            return rv
+        env.globals.update(wait=wait, inner=inner)
+        env.loader.mapping['sections/wait.liquid'] = '{{ wait() }}'
+        t = env.from_string('{% section "wait" %}{{ inner() }}')
+        assert t.render() == 'w<b><b>'
+        released.clear()
+        assert ''.join(t.generate()) == 'w<b><b>'
+
+    def test_rendered_in_place(self, executor):
+        env = self.make_env(executor)
+        t = env.from_string('{% macro m() %}{% section "b" %}{% endmacro %}'
+                            '{% capture x %}{% section "a" %}{% endcapture %}'
+                            '{{ m() }}{{ x }}{% section "nested" %}')
+        assert t.render() == '<b><a><a><b>'
+        assert env.globals['track'].max_running == 1
+
+    def test_error_in_document_order(self, executor):
+        def fail(name):
+            time.sleep(name == 'first' and 0.05 or 0)
+            raise ValueError(name)
+        env = self.make_env(executor)
+        env.globals['fail'] = fail
+        t = env.from_string('{% assign name = "first" %}{% section "fail" %}'
+                            '{% assign name = "second" %}{% section "fail" %}')
+        with pytest.raises(ValueError) as excinfo:
+            t.render()
+        assert str(excinfo.value) == 'first'
+
+    def test_buffer_render_mode(self, executor):
+        env = self.make_env(executor, render_mode='buffer')
+        t = env.from_string('{% block x %}{% section "a" %}{% endblock %}'
+                            '{% section "b" %}{{ self.x() }}')
+        assert t.render() == '<a><b><a>'
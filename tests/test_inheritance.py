@@ -11,6 +11,7 @@
 import pytest
 
 from jinja2 import Environment, DictLoader, TemplateError
+from jinja2.bccache import BytecodeCache
 
 
 LAYOUTTEMPLATE = '''\
@@ -246,3 +247,104 @@ class TestBugFix():
             tmpl = env.get_template('doublee')
         except Exception as e:
             assert isinstance(e, TemplateError)
+
+
+@pytest.mark.inheritance
+class TestFlattenExtends():
+
+    def make_env(self, mapping, **options):
+        return Environment(loader=DictLoader(mapping), flatten_extends=True,
+                           **options)
+
+    def test_levels(self, env):
+        flat_env = env.overlay(flatten_extends=True)
+        for name in 'layout', 'level1', 'level2', 'level3', 'level4':
+            assert flat_env.get_template(name).render() == \
+                env.get_template(name).render()
+        tmpl = flat_env.get_template('level4')
+        assert [x[0] for x in tmpl.inlined_templates] == \
+            ['level3', 'level2', 'level1', 'layout']
+        source = flat_env.compile(LEVEL4TEMPLATE, 'level4', raw=True)
+        assert 'get_template' not in source
+        assert 'parent_template' not in source
+
+    def test_super(self):
+        env = self.make_env({
+            'a': '{% block intro %}INTRO{% endblock %}|'
+                 'BEFORE|{% block data %}INNER{% endblock %}|AFTER',
+            'b': '{% extends "a" %}{% block data %}({{ '
+                 'super() }}){% endblock %}',
+            'c': '{% extends "b" %}{% block intro %}--{{ '
+                 'super() }}--{% endblock %}\n{% block data '
+                 '%}[{{ super() }}]{% endblock %}{% block x %}'
+                 '{{ super() }}{% endblock %}{{ self.x() }}'
+        })
+        tmpl = env.get_template('c')
+        assert tmpl.render() == '--INTRO--|BEFORE|[(INNER)]|AFTER'
+        assert env.get_template('c').module.__html__() == tmpl.render()
+
+    def test_toplevel_code(self):
+        env = self.make_env({
+            'a': '{{ title }}|{% block x %}{% endblock %}',
+            'b': 'BEFORE|{% extends "a" %}{% set title = "T" %}IGNORED'
+                 '{% block x %}{{ title }}{% endblock %}',
+        })
+        tmpl = env.get_template('b')
+        assert tmpl.inlined_templates
+        assert tmpl.render() == 'BEFORE|T|T'
+
+    def test_dynamic_parent_not_flattened(self):
+        env = self.make_env({
+            'master': 'MASTER{% block x %}{% endblock %}',
+            'middle': '{% extends master %}',
+            'child': '{% extends "middle" %}{% block x %}CHILD{% endblock %}'
+        })
+        tmpl = env.get_template('child')
+        assert not tmpl.inlined_templates
+        assert tmpl.render(master='master') == 'MASTERCHILD'
+
+    def test_extend_flattened_template(self):
+        env = self.make_env({
+            'a': '<{% block x %}A{% endblock %}>',
+            'b': '{% extends "a" %}{% block x %}B{{ super() }}{% endblock %}',
+            'c': '{% extends parent %}{% block x %}C{{ super() }}'
+                 '{% endblock %}',
+        })
+        assert env.get_template('b').render() == '<BA>'
+        assert env.get_template('c').render(parent='b') == '<CBA>'
+
+    def test_reload_on_parent_change(self):
+        mapping = {
+            'a': '<{% block x %}{% endblock %}>',
+            'b': '{% extends "a" %}{% block x %}B{% endblock %}',
+        }
+        env = self.make_env(mapping)
+        tmpl = env.get_template('b')
+        assert tmpl.render() == '<B>'
+        assert env.get_template('b') is tmpl
+        mapping['a'] = '[{% block x %}{% endblock %}]'
+        assert not tmpl.is_up_to_date
+        assert env.get_template('b').render() == '[B]'
+
+    def test_stale_bytecode(self):
+        class DictBytecodeCache(BytecodeCache):
+            def __init__(self):
+                self.buckets = {}
+
+            def load_bytecode(self, bucket):
+                if bucket.key in self.buckets:
+                    bucket.bytecode_from_string(self.buckets[bucket.key])
+
+            def dump_bytecode(self, bucket):
+                self.buckets[bucket.key] = bucket.bytecode_to_string()
+
+        mapping = {
+            'a': '<{% block x %}{% endblock %}>',
+            'b': '{% extends "a" %}{% block x %}B{% endblock %}',
+        }
+        bcc = DictBytecodeCache()
+        assert self.make_env(mapping, bytecode_cache=bcc) \
+            .get_template('b').render() == '<B>'
+        mapping['a'] = '[{% block x %}{% endblock %}]'
+        assert self.make_env(mapping, bytecode_cache=bcc) \
+            .get_template('b').render() == '[B]'
@@ -112,6 +112,61 @@ class TestLexer():
             result = tmpl.render()
             assert result.replace(seq, 'X') == '1X2X3X4'
 
+    def test_state_regexes(self, env):
+        # the combined expression of a state picks the same rule as
+        # trying the rules one after another
+        env = Environment(line_statement_prefix='#', line_comment_prefix='##',
+                          lstrip_blocks=True, trim_blocks=True)
+        source = (u'a {%- raw %}{{ b }}{% endraw %}\n  {% if x.y[0] > 1.5 %}'
+                  u'{{ "c" ~ \'d\' }}{# e #}\n# for f in g ## h\n'
+                  u'{{ {"i": (j)} }}{% endif -%}  ')
+        for state, rules in iteritems(env.lexer.rules):
+            for balanced in False, True:
+                regex, rule_groups = env.lexer.state_regexes[state][balanced]
+                for pos in range(len(source) + 1):
+                    expected = None
+                    for rule in rules:
+                        if balanced and rule[1] in ('block_end',
+                                                    'variable_end',
+                                                    'linestatement_end'):
+                            continue
+                        m = rule[0].match(source, pos)
+                        if m is not None:
+                            expected = rule, m.group()
+                            break
+                    m = regex.match(source, pos)
+                    if expected is None:
+                        assert m is None
+                    else:
+                        assert rule_groups[m.lastgroup][:3] == expected[0]
+                        assert m.group() == expected[1]
+
+    def test_data_search(self, env):
+        # searching the template data for directives yields the same tokens
+        # as the root rule
+        from jinja2.lexer import Lexer
+        sources = [u'', u'a', u'a {{ b }}', u'a\n  {%- if b -%}\n {% endif %}',
+                   u'{ {{{ {{- x }} {#- y #} {# z -#} {%+ raw %}{% endraw %}',
+                   u'  # for x in y\n  ## c\n\t# endfor\n# x ##\n',
+                   u'a\r\nb\rc\x0bd\u2028e\n', u'  {%%}{{ \n', u'{% if']
+        for options in ({}, {'lstrip_blocks': True, 'trim_blocks': True},
+                        {'line_statement_prefix': '#',
+                         'line_comment_prefix': '##',
+                         'keep_trailing_newline': True}):
+            env = Environment(**options)
+            lexer = Lexer(env)
+            assert lexer.tag_re is not None
+            root_rule = Lexer(env)
+            root_rule.tag_re = None
+            for source in sources:
+                try:
+                    expected = list(root_rule.tokeniter(source, None))
+                except TemplateSyntaxError:
+                    pytest.raises(TemplateSyntaxError, list,
+                                  lexer.tokeniter(source, None))
+                else:
+                    assert list(lexer.tokeniter(source, None)) == expected
+
     def test_trailing_newline(self, env):
         for keep in [True, False]:
             env = Environment(keep_trailing_newline=keep)
@@ -611,3 +666,124 @@ ${item} ## the rest of the stuff
     ${item}
 <!--- endfor -->''')
         assert tmpl.render(seq=range(5)) == '01234'
+
+
+@pytest.mark.lexnparse
+@pytest.mark.incremental
+class TestIncrementalParsing():
+
+    source = (u'<ul>\n{% for item in seq %}\n  <li>{{ item }}</li>\n'
+              u'{% endfor %}\n</ul>\n{% if foo %}{{ foo }}{% endif %}\n'
+              u'{% raw %}{{ raw }}{% endraw %}\n{# comment #}{{ bar }}\n')
+
+    def dump(self, node):
+        if isinstance(node, nodes.Node):
+            return (type(node).__name__, node.lineno,
+                    tuple(self.dump(x) for x in node.iter_fields()))
+        elif isinstance(node, (list, tuple)):
+            return tuple(self.dump(x) for x in node)
+        return node
+
+    def assert_edit(self, env, doc, offset, removed, inserted):
+        source = doc.source[:offset] + inserted + \
+            doc.source[offset + removed:]
+        rv = doc.edit(offset, removed, inserted)
+        assert rv.source == source
+        assert self.dump(rv.ast) == self.dump(env.parse(source))
+        return rv
+
+    def test_edits(self, env):
+        doc = env.parse_incremental(self.source)
+        assert self.dump(doc.ast) == self.dump(env.parse(self.source))
+        edits = [
+            (u'<ul>', 0, u'<h1>{{ title }}</h1>\n'),
+            (u'item }}', 4, u'entry'),
+            (u'{% endfor %}', 0, u'{% else %}\n\n'),
+            (u'foo %}', 3, u'not foo'),
+            (u'raw %}', 0, u'\n'),
+            (u'</ul>', 5, u''),
+            (u'{{ bar }}', 0, u'{{ baz }}'),
+        ]
+        undo = []
+        for needle, removed, inserted in edits:
+            offset = doc.source.index(needle)
+            undo.append((offset, len(inserted),
+                         doc.source[offset:offset + removed]))
+            doc = self.assert_edit(env, doc, offset, removed, inserted)
+        for offset, removed, inserted in reversed(undo):
+            doc = self.assert_edit(env, doc, offset, removed, inserted)
+        assert doc.source == self.source
+
+    def test_edit_directives(self, env):
+        doc = env.parse_incremental(self.source)
+        offset = self.source.index('{% if')
+        doc = self.assert_edit(env, doc, offset, 0,
+                               u'{% for x in y %}{% endfor %}')
+        doc = self.assert_edit(env, doc, offset + 16, 0, u'{{ x }}')
+        offset = doc.source.index('{# comment')
+        doc = self.assert_edit(env, doc, offset + 2, 0, u'{% endraw %}')
+
+    def test_line_statements(self):
+        env = Environment(line_statement_prefix='#',
+                          line_comment_prefix='##', trim_blocks=True)
+        source = u'# for item in seq\n  {{ item }} ## item\n# endfor\nend\n'
+        doc = env.parse_incremental(source)
+        doc = self.assert_edit(env, doc, source.index('  {{'), 0,
+                               u'# if item\n# endif\n')
+        doc = self.assert_edit(env, doc, doc.source.index('# endif'), 0,
+                               u'  {{ item }}\n')
+        doc = self.assert_edit(env, doc, doc.source.index('## item'), 2,
+                               u'')
+
+    def test_shares_unchanged_statements(self, env):
+        doc = env.parse_incremental(self.source)
+        offset = self.source.index('foo }}')
+        rv = doc.edit(offset, 3, u'baz')
+        assert rv.ast.body[0] is doc.ast.body[0]
+        assert rv.ast.body[1] is doc.ast.body[1]
+        assert rv.ast.body[-1] is doc.ast.body[-1]
+        assert rv.ast.body[3] is not doc.ast.body[3]
+
+        rv = doc.edit(0, 0, u'\n\n')
+        assert rv.ast.body[1] is not doc.ast.body[1]
+        assert rv.ast.body[1].lineno == doc.ast.body[1].lineno + 2
+        assert self.dump(rv.ast) == self.dump(env.parse(rv.source))
+
+    def test_newlines(self, env):
+        doc = env.parse_incremental(u'foo\r\n{{ bar }}\rbaz')
+        assert doc.source == u'foo\n{{ bar }}\nbaz'
+        doc = self.assert_edit(env, doc, 3, 0, u'\n')
+        rv = doc.edit(0, 0, u'\r\n')
+        assert rv.source == u'\n' + doc.source
+
+    def test_syntax_error(self, env):
+        doc = env.parse_incremental(self.source)
+        offset = self.source.index('{% endfor %}')
+        with pytest.raises(TemplateSyntaxError) as excinfo:
+            doc.edit(offset, 12, u'')
+        assert 'endfor' in str(excinfo.value)
+        with pytest.raises(TemplateSyntaxError) as excinfo:
+            doc.edit(0, 0, u'{{ foo %}')
+        assert excinfo.value.lineno == 1
+        pytest.raises(ValueError, doc.edit, len(self.source), 1, u'')
+        assert self.dump(doc.ast) == self.dump(env.parse(self.source))
+
+    def test_render(self, env):
+        doc = env.parse_incremental(u'{% for item in seq %}{{ item }}'
+                                    u'{% endfor %}')
+        doc = doc.edit(doc.source.index('{{ item }}') + 10, 0, u'-')
+        tmpl = env.from_string(doc.ast)
+        assert tmpl.render(seq=[1, 2]) == u'1-2-'
+
+    def test_preprocessing_extension(self):
+        from jinja2.ext import Extension
+
+        class UpperExtension(Extension):
+            def preprocess(self, source, name, filename=None):
+                return source.replace(u'x', u'y')
+
+        env = Environment(extensions=[UpperExtension])
+        doc = env.parse_incremental(u'x{{ x }}')
+        doc = doc.edit(0, 0, u'x')
+        assert self.dump(doc.ast) == self.dump(env.parse(u'xx{{ x }}'))
+        assert env.from_string(doc.ast).render(y=1) == u'yy1'
@@ -11,6 +11,7 @@
 import os
 import sys
 import tempfile
+import time
 import shutil
 import pytest
 import weakref
@@ -119,6 +120,89 @@ class TestLoaders():
         pytest.raises(TemplateNotFound, split_template_path, '../foo')
 
 
+@pytest.mark.loaders
+@pytest.mark.filesystemloader
+class TestWatchingFileSystemLoader():
+
+    def setup_method(self):
+        self.searchpath = tempfile.mkdtemp()
+        self.filename = os.path.join(self.searchpath, 'test.html')
+        self.write('one', 1000)
+
+    def teardown_method(self):
+        shutil.rmtree(self.searchpath)
+
+    def write(self, source, mtime):
+        with open(self.filename, 'w') as f:
+            f.write(source)
+        os.utime(self.filename, (mtime, mtime))
+
+    def wait_for(self, func):
+        for _ in range(100):
+            if func():
+                return True
+            time.sleep(0.05)
+        return False
+
+    def test_polling_watcher(self):
+        watcher = loaders.PollingWatcher(interval=3600)
+        loader = loaders.FileSystemLoader(self.searchpath, watch=watcher)
+        env = Environment(loader=loader)
+        try:
+            tmpl = env.get_template('test.html')
+            assert tmpl.render() == 'one'
+            assert tmpl is env.get_template('test.html')
+            self.write('two', 2000)
+            assert tmpl.is_up_to_date
+            watcher.check()
+            assert not tmpl.is_up_to_date
+            assert env.get_template('test.html').render() == 'two'
+        finally:
+            loader.close()
+        assert loader.watcher is None
+        assert not tmpl.is_up_to_date
+
+    def test_watch_removed_file(self):
+        watcher = loaders.PollingWatcher(interval=3600)
+        loader = loaders.FileSystemLoader(self.searchpath, watch=watcher)
+        try:
+            uptodate = loader.get_source(None, 'test.html')[2]
+            assert uptodate()
+            os.remove(self.filename)
+            watcher.check()
+            assert not uptodate()
+        finally:
+            loader.close()
+
+    def test_watched_files_are_shared(self):
+        watcher = loaders.PollingWatcher(interval=3600)
+        loader = loaders.FileSystemLoader(self.searchpath, watch=watcher)
+        try:
+            first = loader.get_source(None, 'test.html')[2]
+            assert loader.get_source(None, 'test.html')[2] is first
+            self.write('two', 2000)
+            second = loader.get_source(None, 'test.html')[2]
+            assert second is not first
+            assert not first() and second()
+        finally:
+            loader.close()
+
+    @pytest.mark.skipif(not sys.platform.startswith('linux'),
+                        reason='inotify is only available on linux')
+    def test_inotify_watcher(self):
+        loader = loaders.FileSystemLoader(self.searchpath, watch=True)
+        assert isinstance(loader.watcher, loaders.InotifyWatcher)
+        env = Environment(loader=loader)
+        try:
+            tmpl = env.get_template('test.html')
+            assert tmpl is env.get_template('test.html')
+            self.write('two', 2000)
+            assert self.wait_for(lambda: not tmpl.is_up_to_date)
+            assert env.get_template('test.html').render() == 'two'
+        finally:
+            loader.close()
+
+
 @pytest.mark.loaders
 @pytest.mark.moduleloader
 class TestModuleLoader():
@@ -232,3 +316,109 @@ class TestModuleLoader():
         assert tmpl1.render() == 'BAR'
         tmpl2 = self.mod_env.get_template('DICT/test.html')
         assert tmpl2.render() == 'DICT_TEMPLATE'
+
+
+@pytest.mark.loaders
+@pytest.mark.compile
+class TestIncrementalCompile():
+
+    def setup(self):
+        self.target = tempfile.mkdtemp()
+        self.templates = {
+            'page.liquid': '{% include "header" %}{{ foo }}',
+            'other.liquid': 'other',
+            'snippets/header.liquid': '[header]',
+            'dynamic.liquid': '{% include name %}',
+        }
+        self.env = Environment(loader=loaders.DictLoader(self.templates))
+
+    def teardown(self):
+        shutil.rmtree(self.target)
+
+    def compile(self, **kwargs):
+        from jinja2.compile import compile_templates
+        kwargs.setdefault('workers', 1)
+        return compile_templates(self.env, self.target, **kwargs)
+
+    def test_compile(self):
+        rv = self.compile()
+        assert rv.compiled == sorted(self.templates)
+        assert rv.unchanged == rv.removed == []
+        assert not rv.errors
+        mod_env = Environment(loader=loaders.ModuleLoader(self.target))
+        tmpl = mod_env.get_template('page.liquid')
+        assert tmpl.render(foo=42) == '[header]42'
+        key = loaders.ModuleLoader.get_template_key('page.liquid')
+        assert getattr(mod_env.loader.module, key).__file__.endswith('.pyc')
+
+    def test_unchanged(self):
+        self.compile()
+        rv = self.compile()
+        assert rv.compiled == []
+        assert rv.unchanged == sorted(self.templates)
+
+    def test_dependents(self):
+        self.compile()
+        self.templates['snippets/header.liquid'] = '[new header]'
+        rv = self.compile()
+        assert rv.compiled == ['dynamic.liquid', 'page.liquid',
+                               'snippets/header.liquid']
+        assert rv.unchanged == ['other.liquid']
+
+    def test_removed(self):
+        from jinja2.compile import get_module_path
+        self.compile()
+        filename = get_module_path(self.target, 'other.liquid')
+        assert os.path.isfile(filename)
+        del self.templates['other.liquid']
+        rv = self.compile()
+        assert rv.removed == ['other.liquid']
+        assert not os.path.isfile(filename)
+
+    def test_missing_module(self):
+        from jinja2.compile import get_module_path
+        self.compile()
+        os.remove(get_module_path(self.target, 'other.liquid'))
+        assert self.compile().compiled == ['other.liquid']
+
+    def test_environment_changed(self):
+        self.compile()
+        self.env = self.env.overlay(trim_blocks=True)
+        assert self.compile().compiled == sorted(self.templates)
+        assert self.compile(force=True).compiled == sorted(self.templates)
+
+    def test_errors(self):
+        self.templates['broken.liquid'] = '{% if %}'
+        rv = self.compile()
+        assert list(rv.errors) == ['broken.liquid']
+        rv = self.compile()
+        assert list(rv.errors) == ['broken.liquid']
+        assert rv.compiled == []
+        self.templates['broken.liquid'] = 'fixed'
+        rv = self.compile()
+        assert not rv.errors
+        assert rv.compiled == ['broken.liquid', 'dynamic.liquid']
+
+    @pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+    def test_workers(self):
+        rv = self.compile(workers=2)
+        assert rv.compiled == sorted(self.templates)
+        mod_env = Environment(loader=loaders.ModuleLoader(self.target))
+        assert mod_env.get_template('other.liquid').render() == 'other'
+
+    def test_main(self):
+        from jinja2.compile import main
+        source = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(source, 'index.liquid'), 'w') as f:
+                f.write('{{ 1 + 1 }}')
+            with open(os.path.join(source, 'notes.txt'), 'w') as f:
+                f.write('{% if %}')
+            assert main(['-q', '-j', '1', '-x', 'liquid',
+                         source, self.target]) == 0
+            mod_env = Environment(loader=loaders.ModuleLoader(self.target))
+            assert mod_env.get_template('index.liquid').render() == '2'
+            pytest.raises(TemplateNotFound, mod_env.get_template,
+                          'notes.txt')
+        finally:
+            shutil.rmtree(source)
@@ -12,9 +12,13 @@ import gc
 
 import pytest
 
+import time
 import pickle
+import threading
 
-from jinja2.utils import LRUCache, escape, object_type_repr, urlize
+from jinja2 import Environment
+from jinja2.utils import LRUCache, ConcurrentLRUCache, escape, \
+     object_type_repr, urlize, SingleFlight
 
 
 @pytest.mark.utils
@@ -44,6 +48,148 @@ class TestLRUCache():
             assert copy._queue == cache._queue
 
 
+@pytest.mark.utils
+@pytest.mark.lrucache
+class TestConcurrentLRUCache():
+
+    def test_simple(self):
+        d = ConcurrentLRUCache(3)
+        d["a"] = 1
+        d["b"] = 2
+        d["c"] = 3
+        d["a"]
+        d["d"] = 4
+        assert len(d) == 3
+        assert 'a' in d and 'c' in d and 'd' in d and 'b' not in d
+        assert d.keys() == ['d', 'a', 'c']
+        assert list(reversed(d)) == ['c', 'a', 'd']
+        del d['a']
+        assert d.items() == [('d', 4), ('c', 3)]
+        assert d.setdefault('c', 42) == 3
+        assert d.setdefault('e', 42) == 42
+        d.clear()
+        assert len(d) == 0 and d.get('e') is None
+
+    def test_segments(self):
+        d = ConcurrentLRUCache(10, segments=3)
+        assert len(d._segments) == 3
+        for idx in range(100):
+            d[idx] = idx
+        assert len(d) == 10
+        assert d.keys() == list(range(99, 89, -1))
+        assert ConcurrentLRUCache(400).capacity == 400
+        assert len(ConcurrentLRUCache(2)._segments) == 1
+
+    def test_exact_capacity(self):
+        for capacity, segments in (400, None), (8000, None), (100, 16):
+            cache = ConcurrentLRUCache(capacity, segments)
+            for idx in range(capacity):
+                cache['template-%d.html' % idx] = idx
+            assert len(cache) == capacity
+            assert cache['template-0.html'] == 0
+            cache['one-more.html'] = None
+            assert len(cache) == capacity
+            assert 'template-1.html' not in cache
+            assert 'template-0.html' in cache
+            del cache['one-more.html']
+            assert len(cache) == capacity - 1
+            cache.clear()
+            assert len(cache) == 0
+            cache['x'] = 1
+            assert len(cache) == 1
+
+    def test_pickleable(self):
+        cache = ConcurrentLRUCache(2)
+        cache["foo"] = 42
+        cache["bar"] = 23
+        cache["foo"]
+
+        for protocol in range(3):
+            copy = pickle.loads(pickle.dumps(cache, protocol))
+            assert copy.capacity == cache.capacity
+            assert copy.items() == cache.items()
+
+    def test_copy(self):
+        cache = ConcurrentLRUCache(300)
+        for idx in range(5):
+            cache[idx] = idx
+        copy = cache.copy()
+        assert copy.items() == cache.items()
+        assert len(copy._segments) == len(cache._segments)
+
+    def test_threaded_access(self):
+        cache = ConcurrentLRUCache(50, segments=4)
+        errors = []
+
+        def worker(offset):
+            try:
+                for idx in range(2000):
+                    key = (idx + offset) % 80
+                    if cache.get(key) is None:
+                        cache[key] = key
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(x,))
+                   for x in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors
+        assert len(cache) == 50
+        assert len(cache.items()) == 50
+
+    def test_environment_cache(self):
+        env = Environment(cache_size=400)
+        assert isinstance(env.cache, ConcurrentLRUCache)
+        assert env.cache.capacity == 400
+        assert isinstance(env.overlay().cache, ConcurrentLRUCache)
+
+
+@pytest.mark.utils
+@pytest.mark.singleflight
+class TestSingleFlight():
+
+    def test_one_call(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def func():
+            calls.append(1)
+            release.wait()
+            return len(calls)
+
+        threads = [threading.Thread(target=lambda: results.append(
+            flight.do('key', func))) for x in range(8)]
+        for thread in threads:
+            thread.start()
+        # give the threads time to join the flight
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert results == [1] * 8
+        assert calls == [1]
+        assert len(flight) == 0
+
+    def test_failure(self):
+        flight = SingleFlight()
+        calls = []
+
+        def func():
+            calls.append(1)
+            if len(calls) == 1:
+                raise ValueError()
+            return 42
+
+        pytest.raises(ValueError, flight.do, 'key', func)
+        assert flight.do('key', func) == 42
+        assert len(flight) == 0
+
+
 @pytest.mark.utils
 @pytest.mark.helpers
 class TestHelpers():